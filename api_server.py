@@ -0,0 +1,286 @@
+# api_server.py
+
+"""
+Headless HTTP/SSE API for the assistant. Workers keep no conversation state:
+every request loads its session from the session store and saves it back.
+With the default SQLite store any worker on the same host can serve any
+conversation. Across dynos, set CMUGPT_SESSION_URL=redis://... so they share
+one store.
+
+Run with:
+    uvicorn api_server:app --workers 4
+"""
+
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+import contextlib
+from typing import Dict, Any, List, Optional, Callable
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from session_manager import SessionStore, create_session_store, SESSION_IDLE_SECONDS
+from session_memory import export_session, restore_session
+from cache_warmer import CacheWarmer, build_cache_warmer
+from calendar_queue import get_calendar_queue
+from warmup import warm_up, warmup_enabled
+from structured_logging import configure_logging
+from usage_accounting import UsageLedger, USAGE_METER
+from perplexity_integration import get_related_prefetcher
+from hedged_requests import hedge_stats, hedging_enabled
+from dining_hours import get_dining_hours
+from metrics import ACTIVE_SESSIONS, CONTENT_TYPE, get_worker_metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+MAX_MESSAGE_CHARS = 4000
+
+
+def _default_factory():
+    # Imported lazily so importing this module doesn't pull in the Google client libraries
+    from production_cmugpt_assistant import CMUGPTAssistant
+    return CMUGPTAssistant()
+
+
+class AssistantService:
+    """Runs one turn of a session: load it from the store, process, save it back."""
+
+    def __init__(self, factory: Callable[[], Any], store: SessionStore, warmer: Optional[CacheWarmer] = None):
+        self.factory = factory
+        self.store = store
+        self.warmer = warmer
+        # Turns for the same session are serialized within a worker, across workers
+        # clients are expected to wait for one answer before sending the next message.
+        # A lock lives only while a turn holds or waits for it: (lock, turns using it)
+        self._session_locks: Dict[str, List[Any]] = {}
+        self._locks_lock = threading.Lock()
+        # When each session last had a turn here, for the active sessions gauge
+        self._last_turn: Dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def _session_lock(self, session_id: str):
+        with self._locks_lock:
+            entry = self._session_locks.setdefault(session_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._locks_lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._session_locks[session_id]
+
+    def active_sessions(self, within_seconds: float = SESSION_IDLE_SECONDS) -> int:
+        """Sessions with a turn on this worker in the last within_seconds."""
+        cutoff = time.monotonic() - within_seconds
+        with self._locks_lock:
+            for session_id in [sid for sid, at in self._last_turn.items() if at < cutoff]:
+                del self._last_turn[session_id]
+            return len(self._last_turn)
+
+    def load(self, session_id: str) -> Optional[Any]:
+        state = self.store.load(session_id)
+        if state is None:
+            return None
+        assistant = self.factory()
+        assistant.session_id = session_id
+        restore_session(assistant, state)
+        return assistant
+
+    def create(self) -> str:
+        session_id = uuid.uuid4().hex
+        assistant = self.factory()
+        assistant.session_id = session_id
+        self.store.save(session_id, export_session(assistant))
+        if self.warmer is not None:
+            # With a shared CMUGPT_CACHE_URL, whichever worker serves the first question benefits
+            self.warmer.warm(session_id, assistant)
+        return session_id
+
+    def turn(self, session_id: str, message: str, on_token: Optional[Callable[[str], None]] = None) -> Optional[Dict[str, Any]]:
+        with self._session_lock(session_id):
+            assistant = self.load(session_id)
+            if assistant is None:
+                return None
+            with self._locks_lock:
+                self._last_turn[session_id] = time.monotonic()
+            refs_before = {call['result_ref'] for call in assistant.functions_called}
+            if on_token is None:
+                response = assistant.process_user_input(message)
+            else:
+                response = assistant.process_user_input(message, on_token=on_token)
+            self.store.save(session_id, export_session(assistant))
+            new_calls = [call for call in assistant.functions_called if call['result_ref'] not in refs_before]
+            return {
+                "session_id": session_id,
+                "response": response,
+                "functions_called": new_calls,
+                "show_eats": getattr(assistant, "show_eats", False),
+                "show_courses": getattr(assistant, "show_courses", False),
+                "usage": assistant.usage.last_turn() if hasattr(assistant, "usage") else None,
+            }
+
+
+def create_app(factory: Optional[Callable[[], Any]] = None, store: Optional[SessionStore] = None) -> Starlette:
+    service = AssistantService(factory or _default_factory,
+                               store or create_session_store(),
+                               build_cache_warmer())
+    ACTIVE_SESSIONS.set_function(service.active_sessions)
+    # Starts writing this worker's values, a scrape of any worker includes them
+    get_worker_metrics()
+    # Starts keeping the dining hours snapshot fresh
+    get_dining_hours()
+
+    async def read_message(request: Request) -> Optional[str]:
+        try:
+            body = await request.json()
+        except ValueError:
+            return None
+        message = body.get("message") if isinstance(body, dict) else None
+        if not isinstance(message, str) or not message.strip() or len(message) > MAX_MESSAGE_CHARS:
+            return None
+        return message
+
+    async def health(request: Request):
+        return JSONResponse({"status": "ok"})
+
+    async def create_session(request: Request):
+        session_id = await run_in_threadpool(service.create)
+        return JSONResponse({"session_id": session_id}, status_code=201)
+
+    async def get_session(request: Request):
+        session_id = request.path_params["session_id"]
+        state = await run_in_threadpool(service.store.load, session_id)
+        if state is None:
+            return JSONResponse({"error": "Session not found."}, status_code=404)
+        transcript = [{"role": m["role"], "content": m.get("content")} for m in state["messages"]
+                      if m["role"] in ("user", "assistant") and m.get("content")]
+        return JSONResponse({
+            "session_id": session_id,
+            "messages": transcript,
+            "functions_called": state["functions_called"],
+            **state.get("flags", {}),
+        })
+
+    async def delete_session(request: Request):
+        await run_in_threadpool(service.store.delete, request.path_params["session_id"])
+        return Response(status_code=204)
+
+    async def get_notifications(request: Request):
+        """Calendar changes applied (or failed) since the last poll, when write-behind is on."""
+        queue = get_calendar_queue()
+        if queue is None:
+            return JSONResponse({"pending": 0, "notifications": []})
+        session_id = request.path_params["session_id"]
+        notifications = await run_in_threadpool(queue.pop_notifications, session_id)
+        pending = await run_in_threadpool(queue.pending, session_id)
+        return JSONResponse({"pending": pending, "notifications": notifications})
+
+    async def get_usage(request: Request):
+        """Token usage and estimated cost of one session, with its budget state."""
+        state = await run_in_threadpool(service.store.load, request.path_params["session_id"])
+        if state is None:
+            return JSONResponse({"error": "Session not found."}, status_code=404)
+        ledger = UsageLedger(meter=None)
+        ledger.restore(state.get("usage", {}))
+        return JSONResponse(ledger.summary())
+
+    async def process_usage(request: Request):
+        """Usage of every session served by this worker since it started, by model, call type and tool,
+        and the model router's recent latency per model."""
+        stats = USAGE_METER.stats()
+        # Imported here, it pulls in openai
+        from model_router import get_model_router
+        stats["model_router"] = get_model_router().stats()
+        prefetcher = get_related_prefetcher()
+        if prefetcher is not None:
+            stats["related_prefetch"] = prefetcher.stats()
+        if hedging_enabled():
+            stats["hedging"] = hedge_stats()
+        stats["dining_hours"] = get_dining_hours().stats()
+        return JSONResponse(stats)
+
+    async def metrics(request: Request):
+        """Prometheus text format, summed over every uvicorn worker, see metrics.py."""
+        body = await run_in_threadpool(get_worker_metrics().render)
+        return PlainTextResponse(body, media_type=CONTENT_TYPE)
+
+    async def post_message(request: Request):
+        message = await read_message(request)
+        if message is None:
+            return JSONResponse({"error": "Expected a JSON body with a non-empty 'message'."}, status_code=400)
+        result = await run_in_threadpool(service.turn, request.path_params["session_id"], message)
+        if result is None:
+            return JSONResponse({"error": "Session not found."}, status_code=404)
+        return JSONResponse(result)
+
+    async def stream_message(request: Request):
+        """Server-sent events: "token" events as the answer streams, then one "done" event."""
+        message = await read_message(request)
+        if message is None:
+            return JSONResponse({"error": "Expected a JSON body with a non-empty 'message'."}, status_code=400)
+        session_id = request.path_params["session_id"]
+        if await run_in_threadpool(service.store.load, session_id) is None:
+            return JSONResponse({"error": "Session not found."}, status_code=404)
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def on_token(token: str) -> None:
+            loop.call_soon_threadsafe(queue.put_nowait, ("token", {"text": token}))
+
+        def run_turn() -> None:
+            try:
+                result = service.turn(session_id, message, on_token=on_token)
+                loop.call_soon_threadsafe(queue.put_nowait, ("done", result))
+            except Exception as e:
+                logger.exception("Streaming turn failed.")
+                loop.call_soon_threadsafe(queue.put_nowait, ("error", {"error": type(e).__name__}))
+
+        async def events():
+            worker = loop.run_in_executor(None, run_turn)
+            while True:
+                event, data = await queue.get()
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+                if event in ("done", "error"):
+                    break
+            await worker
+
+        return StreamingResponse(events(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    routes = [
+        Route("/healthz", health, methods=["GET"]),
+        Route("/sessions", create_session, methods=["POST"]),
+        Route("/sessions/{session_id}", get_session, methods=["GET"]),
+        Route("/sessions/{session_id}", delete_session, methods=["DELETE"]),
+        Route("/sessions/{session_id}/notifications", get_notifications, methods=["GET"]),
+        Route("/sessions/{session_id}/usage", get_usage, methods=["GET"]),
+        Route("/usage", process_usage, methods=["GET"]),
+        Route("/metrics", metrics, methods=["GET"]),
+        Route("/sessions/{session_id}/messages", post_message, methods=["POST"]),
+        Route("/sessions/{session_id}/messages/stream", stream_message, methods=["POST"]),
+    ]
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        # uvicorn only starts accepting connections once this yields
+        if warmup_enabled():
+            await run_in_threadpool(warm_up)
+        yield
+
+    return Starlette(routes=routes, lifespan=lifespan)
+
+
+# JSON logs on a background writer thread, request threads never wait on stdout
+configure_logging()
+app = create_app()
@@ -1,5 +1,8 @@
 import streamlit as st
 from cmugpt_assistant import CMUGPTAssistant
+from structured_logging import configure_logging
+
+configure_logging()
 
 
 st.title("CMUGPT Chat Assistant")
@@ -9,27 +12,18 @@ st.title("CMUGPT Chat Assistant")
 # Initialize CMUGPTAssistant in session state
 if 'assistant' not in st.session_state:
     st.session_state['assistant'] = CMUGPTAssistant()
-    st.session_state['messages'] = []
-    st.session_state['functions_called'] = []
 
 
 
-# Display the conversation
-for message in st.session_state['messages']:
-    if message['role'] == 'user':
-        with st.chat_message('user'):
-            st.write(message['content'])
-    elif message['role'] == 'assistant':
-        with st.chat_message('assistant'):
-            st.write(message['content'])
+# Display the conversation, straight from the assistant's message store
+for role, content in st.session_state['assistant'].messages.transcript():
+    with st.chat_message(role):
+        st.write(content)
 
 # Chat input
 prompt = st.chat_input("Ask me anything about Carnegie Mellon University")
 
 if prompt:
-    # Add user's message to session state
-    st.session_state['messages'].append({"role": "user", "content": prompt})
-
     # Display user's message
     with st.chat_message('user'):
         st.write(prompt)
@@ -37,18 +31,10 @@ if prompt:
     # Process user input
     assistant_response = st.session_state['assistant'].process_user_input(prompt)
 
-    # Add assistant's message to session state
-    st.session_state['messages'].append({"role": "assistant", "content": assistant_response})
-
     # Display assistant's message
     with st.chat_message('assistant'):
         st.write(assistant_response)
 
-    # Get functions called
-    functions_called = st.session_state['assistant'].get_functions_called()
-
-    # Update functions_called in session state
-    st.session_state['functions_called'] = functions_called
     st.rerun()
 
 if st.session_state['assistant'].show_eats:
@@ -61,8 +47,8 @@ if st.session_state['assistant'].show_eats:
 
 # Display functions called in the sidebar
 st.sidebar.title("Functions Called")
-for func in st.session_state['functions_called']:
+for func in st.session_state['assistant'].get_functions_called():
     st.sidebar.subheader(f"Function: {func['function_name']}")
     st.sidebar.write(f"**Arguments:** {func['arguments']}")
-    st.sidebar.write(f"**Result:** {func['result']}")
+    st.sidebar.write(f"**Result:** {st.session_state['assistant'].get_function_result(func['result_ref'])}")
     st.sidebar.write("---")
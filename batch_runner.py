@@ -0,0 +1,244 @@
+# batch_runner.py
+
+"""
+Runs a JSONL file of conversations through the assistant, several at a time,
+without a UI. Used to warm the shared cache, to re-run an evaluation set after
+a change, and to measure throughput.
+
+    python batch_runner.py questions.jsonl --out answers.jsonl --workers 8
+
+Each input line is one conversation, a list of user messages sent in order to
+a fresh assistant, or a single question:
+
+    {"id": "dining-1", "turns": ["Where can I get lunch near Gates?", "Is it open now?"]}
+    {"id": "founded", "question": "When was CMU founded?", "expected_tool": "general_purpose_knowledge_search"}
+
+Each output line is the same conversation with its answers, the tools each
+turn called, per-turn latency and token usage. Any other input fields
+(expected answers, tags) are copied under "meta". Results are appended as
+conversations finish, so an interrupted run picks up where it stopped: ids
+already in the output are skipped, failed ones are run again.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterator, List, Set
+
+from structured_logging import configure_logging
+
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+DEFAULT_ASSISTANT = "production_cmugpt_assistant:CMUGPTAssistant"
+DEFAULT_WORKERS = int(os.getenv("CMUGPT_BATCH_WORKERS", "4"))
+# Input fields that are the conversation itself, everything else is passed through as "meta"
+CONVERSATION_FIELDS = {"id", "turns", "question"}
+
+
+# --- Input and Output ---
+
+def load_conversations(path: str) -> Iterator[Dict[str, Any]]:
+    """Yields {"id", "turns", "meta"} per input line. Lines without an id are named by line number."""
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            turns = entry.get("turns")
+            if turns is None and "question" in entry:
+                turns = [entry["question"]]
+            if not turns or not all(isinstance(turn, str) for turn in turns):
+                raise ValueError(f"{path}:{line_number}: expected 'turns' (a list of strings) or 'question'")
+            yield {
+                "id": str(entry.get("id", f"line-{line_number}")),
+                "turns": turns,
+                "meta": {k: v for k, v in entry.items() if k not in CONVERSATION_FIELDS},
+            }
+
+
+def completed_ids(path: str) -> Set[str]:
+    """Ids already answered in an earlier run's output. A line cut off by an interruption is ignored."""
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if not result.get("error"):
+                done.add(result["id"])
+    return done
+
+
+class ResultWriter:
+    """Appends one JSON line per finished conversation, flushed so an interruption loses nothing written."""
+
+    def __init__(self, path: str):
+        # Don't glue the first new line onto a partial one left by a killed run
+        needs_newline = False
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        self._file = open(path, "a", encoding="utf-8")
+        if needs_newline:
+            self._file.write("\n")
+        self._lock = threading.Lock()
+
+    def write(self, result: Dict[str, Any]) -> None:
+        line = json.dumps(result, default=str, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+# --- Running ---
+
+def load_factory(spec: str) -> Callable[[], Any]:
+    """"module:Class" -> the class, imported on demand so --help stays fast."""
+    module_name, _, attribute = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attribute or "CMUGPTAssistant")
+
+
+def run_conversation(factory: Callable[[], Any], conversation: Dict[str, Any],
+                     include_results: bool = False) -> Dict[str, Any]:
+    """Sends each turn to a fresh assistant and returns the conversation's result line."""
+    turns: List[Dict[str, Any]] = []
+    result: Dict[str, Any] = {"id": conversation["id"], "meta": conversation["meta"], "turns": turns}
+    assistant = None
+    started = time.perf_counter()
+    try:
+        assistant = factory()
+        assistant.session_id = f"batch-{conversation['id']}"
+        for message in conversation["turns"]:
+            refs_before = {call["result_ref"] for call in assistant.functions_called}
+            turn_started = time.perf_counter()
+            response = assistant.process_user_input(message)
+            latency_ms = (time.perf_counter() - turn_started) * 1000
+            tools = []
+            for call in assistant.functions_called:
+                if call["result_ref"] in refs_before:
+                    continue
+                tool = {"name": call["function_name"], "arguments": call["arguments"]}
+                if include_results:
+                    tool["result"] = assistant.result_store.get(call["result_ref"])
+                tools.append(tool)
+            usage = assistant.usage.last_turn() if hasattr(assistant, "usage") else None
+            if usage is not None:
+                usage.pop("entries", None)
+            turns.append({"message": message, "response": response, "tools": tools,
+                          "latency_ms": round(latency_ms, 1), "usage": usage})
+            # The assistant answers a failed turn with an apology, it must not count as answered
+            turn_error = getattr(assistant, "last_turn_error", None)
+            if turn_error:
+                result["error"] = f"Turn {len(turns)} failed: {turn_error}"
+                break
+    except Exception as e:
+        logger.exception(f"Conversation {conversation['id']} failed.")
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    if assistant is not None and hasattr(assistant, "usage"):
+        result["usage"] = assistant.usage.summary()["total"]
+    return result
+
+
+def _percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def summarize(results: List[Dict[str, Any]], wall_seconds: float) -> Dict[str, Any]:
+    """Throughput, turn latency percentiles and token totals of this run."""
+    latencies = [turn["latency_ms"] for result in results for turn in result["turns"]]
+    usages = [result["usage"] for result in results if result.get("usage")]
+    return {
+        "conversations": len(results),
+        "errors": sum(1 for result in results if result.get("error")),
+        "turns": len(latencies),
+        "wall_seconds": round(wall_seconds, 2),
+        "turns_per_second": round(len(latencies) / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+        "latency_ms": {"p50": _percentile(latencies, 50), "p95": _percentile(latencies, 95),
+                       "max": max(latencies, default=0.0)},
+        "prompt_tokens": sum(u["prompt_tokens"] for u in usages),
+        "completion_tokens": sum(u["completion_tokens"] for u in usages),
+        "cost_usd": round(sum(u["cost_usd"] for u in usages), 6),
+    }
+
+
+def run_batch(conversations: List[Dict[str, Any]], factory: Callable[[], Any], writer: ResultWriter,
+              workers: int = DEFAULT_WORKERS, include_results: bool = False) -> Dict[str, Any]:
+    """Runs the conversations on a pool of workers, writing each result as it finishes."""
+    results: List[Dict[str, Any]] = []
+
+    def finish(future) -> None:
+        result = future.result()
+        writer.write(result)
+        results.append(result)
+        logger.info(f"Finished {result['id']} ({len(results)} of {len(futures)})",
+                    extra={"latency_ms": result["latency_ms"], "error": result.get("error")})
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as executor:
+        futures = [executor.submit(run_conversation, factory, conversation, include_results)
+                   for conversation in conversations]
+        pending = set(futures)
+        try:
+            for future in as_completed(futures):
+                pending.discard(future)
+                finish(future)
+        except KeyboardInterrupt:
+            # Conversations already running finish and are written, the rest wait for the next run
+            running = [future for future in pending if not future.cancel()]
+            for future in running:
+                finish(future)
+            raise
+    return summarize(results, time.perf_counter() - started)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of conversations")
+    parser.add_argument("--out", required=True, help="JSONL results, appended to and resumed from")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--assistant", default=DEFAULT_ASSISTANT, help="module:Class to run the conversations with")
+    parser.add_argument("--limit", type=int, help="run at most this many conversations")
+    parser.add_argument("--include-results", action="store_true", help="write full tool results into the trace")
+    args = parser.parse_args()
+
+    # The summary goes to stdout, logs to stderr
+    configure_logging(stream=sys.stderr)
+    done = completed_ids(args.out)
+    conversations = [c for c in load_conversations(args.input) if c["id"] not in done]
+    if args.limit is not None:
+        conversations = conversations[:args.limit]
+    if done:
+        logger.info(f"Resuming: {len(done)} conversations already in {args.out}, {len(conversations)} to run.")
+
+    writer = ResultWriter(args.out)
+    try:
+        summary = run_batch(conversations, load_factory(args.assistant), writer, args.workers, args.include_results)
+    except KeyboardInterrupt:
+        logger.warning("Interrupted, run again with the same --out to resume.")
+        return 130
+    finally:
+        writer.close()
+    print(json.dumps(summary, indent=2))
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+# benchmarks/canvas_standin.py
+
+"""
+A local stand-in for the parts of the Canvas API that canvas_tools uses:
+paginated REST course and assignment lists (with Link headers), the planner,
+and the /api/graphql query from canvas_tools._graphql_query. Every request
+sleeps for `latency` seconds to stand in for the round trip to Canvas.
+
+    python benchmarks/canvas_standin.py --port 8900 --latency 0.08
+"""
+
+import re
+import json
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse, parse_qs
+
+
+def _iso(moment: datetime) -> str:
+    return moment.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def make_dataset(courses: int = 8, assignments: int = 30) -> Dict[str, Any]:
+    """Current-term courses plus one finished course, each with assignments due every other day, every third handed in."""
+    now = datetime.now(timezone.utc)
+    current = {"id": 2, "name": "Fall", "start_at": _iso(now - timedelta(days=50)), "end_at": _iso(now + timedelta(days=60))}
+    past = {"id": 1, "name": "Spring", "start_at": _iso(now - timedelta(days=300)), "end_at": _iso(now - timedelta(days=150))}
+    course_list = [{"id": 100 + i, "name": f"Course {i}", "course_code": f"{15 + i}-{100 + i}",
+                    "enrollment_term_id": current["id"], "term": current} for i in range(courses)]
+    course_list.append({"id": 99, "name": "Old Course", "course_code": "99-999",
+                        "enrollment_term_id": past["id"], "term": past})
+    course_assignments = {
+        course["id"]: [{"id": course["id"] * 1000 + n, "name": f"{course['course_code']} HW {n}",
+                        "due_at": _iso(now + timedelta(days=2 * n - 10, hours=course["id"] % 24)),
+                        "submission": {"submitted_at": _iso(now - timedelta(hours=n)) if n % 3 == 0 else None}}
+                       for n in range(assignments)]
+        for course in course_list
+    }
+    return {"courses": course_list, "assignments": course_assignments}
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body: Any, next_url: Optional[str] = None, status: int = 200) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if next_url:
+            self.send_header("Link", f'<{next_url}>; rel="next"')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _page(self, items: List[Any], url) -> None:
+        query = parse_qs(url.query)
+        page = int(query.get("page", ["1"])[0])
+        per_page = int(query.get("per_page", ["10"])[0])
+        next_url = None
+        if page * per_page < len(items):
+            next_url = f"{self.server.url}{url.path}?page={page + 1}&per_page={per_page}"
+        self._send(items[(page - 1) * per_page:page * per_page], next_url)
+
+    def do_GET(self):
+        self.server.hit()
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        data = self.server.dataset
+        if url.path == "/api/v1/courses":
+            return self._page(data["courses"], url)
+        if parts[:3] == ["api", "v1", "courses"] and len(parts) == 5 and parts[4] == "assignments":
+            now = _iso(datetime.now(timezone.utc))
+            upcoming = [a for a in data["assignments"].get(int(parts[3]), []) if a["due_at"] >= now]
+            return self._page(upcoming, url)
+        if url.path == "/api/v1/planner/items" and self.server.planner:
+            query = parse_qs(url.query)
+            start, end = query["start_date"][0], query["end_date"][0]
+            names = {c["id"]: c["name"] for c in data["courses"]}
+            items = [{"plannable_type": "assignment", "context_name": names[course_id],
+                      "plannable_date": a["due_at"], "plannable": {"title": a["name"], "due_at": a["due_at"]},
+                      "submissions": {"submitted": bool(a["submission"]["submitted_at"])}}
+                     for course_id, assignments in data["assignments"].items() for a in assignments
+                     if start <= a["due_at"].replace("Z", "+00:00") < end]
+            return self._page(items, url)
+        self._send({"errors": [{"message": "The specified resource does not exist."}]}, status=404)
+
+    def do_POST(self):
+        self.server.hit()
+        if urlparse(self.path).path != "/api/graphql" or not self.server.graphql:
+            return self._send({"errors": [{"message": "The specified resource does not exist."}]}, status=404)
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        # Aliased course(id: ...) fields, the only query shape canvas_tools sends
+        aliases = re.findall(r'(\w+): course\(id: "(\d+)"\)', body.get("query", ""))
+        if not aliases:
+            return self._send({"errors": [{"message": "Unsupported query for the stand-in server."}]})
+        first = int((body.get("variables") or {}).get("assignments", 20))
+        data = self.server.dataset
+        result = {}
+        for alias, course_id in aliases:
+            if not any(course["id"] == int(course_id) for course in data["courses"]):
+                result[alias] = None
+                continue
+            assignments = data["assignments"].get(int(course_id), [])
+            nodes = [{"name": a["name"], "dueAt": a["due_at"],
+                      "submissionsConnection": {"nodes": [{"submittedAt": a["submission"]["submitted_at"]}]}}
+                     for a in assignments[:first]]
+            result[alias] = {"_id": course_id,
+                             "assignmentsConnection": {"nodes": nodes, "pageInfo": {"hasNextPage": len(assignments) > first}}}
+        self._send({"data": result})
+
+
+class CanvasStandIn(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.05,
+                 dataset: Optional[Dict[str, Any]] = None, planner: bool = True, graphql: bool = True):
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.dataset = dataset or make_dataset()
+        self.planner = planner
+        self.graphql = graphql
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def hit(self) -> None:
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency)
+
+    def start(self) -> "CanvasStandIn":
+        threading.Thread(target=self.serve_forever, daemon=True, name="canvas-standin").start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a local stand-in Canvas API.")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--courses", type=int, default=8)
+    args = parser.parse_args()
+
+    server = CanvasStandIn(port=args.port, latency=args.latency, dataset=make_dataset(args.courses))
+    print(f"Stand-in Canvas listening on {server.url} (set CANVAS_BASE_URL to this)")
+    server.serve_forever()
@@ -0,0 +1,70 @@
+# benchmarks/canvas_transport.py
+
+"""
+Compares Canvas REST (serial and concurrent per-course calls) with the
+GraphQL batch query, against the local stand-in server, with a cold cache
+on every run.
+
+    python benchmarks/canvas_transport.py --latency 0.08 --courses 8 --runs 5
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import canvas_tools  # noqa: E402
+from cache_backends import MemoryCache, set_cache_backend  # noqa: E402
+from canvas_standin import CanvasStandIn, make_dataset  # noqa: E402
+
+
+def run(server: CanvasStandIn, transport: str, concurrency: int, runs: int):
+    canvas_tools.CANVAS_TRANSPORT = transport
+    canvas_tools.MAX_CONCURRENT_REQUESTS = concurrency
+    canvas_tools.USE_PLANNER = False
+    timings, requests, answer = [], [], None
+    for _ in range(runs):
+        set_cache_backend(MemoryCache())
+        before = server.requests
+        started = time.perf_counter()
+        answer = canvas_tools.fetch_upcoming_assignments(days=14)
+        timings.append(time.perf_counter() - started)
+        requests.append(server.requests - before)
+    return statistics.median(timings), statistics.median(requests), answer
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.08, help="seconds added to every request")
+    parser.add_argument("--courses", type=int, default=8)
+    parser.add_argument("--assignments", type=int, default=30, help="per course")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.getLogger("canvas_tools").setLevel(logging.WARNING)
+    server = CanvasStandIn(latency=args.latency, dataset=make_dataset(args.courses, args.assignments)).start()
+    os.environ["CANVAS_BASE_URL"] = server.url
+    os.environ["CANVAS_API_TOKEN"] = "benchmark-token"
+
+    rows = [
+        ("REST, serial", "rest", 1),
+        (f"REST, {canvas_tools.MAX_CONCURRENT_REQUESTS} concurrent", "rest", canvas_tools.MAX_CONCURRENT_REQUESTS),
+        ("GraphQL batch", "graphql", 1),
+    ]
+    answers = set()
+    print(f"{args.courses} courses, {args.assignments} assignments each, {args.latency * 1000:.0f} ms per request\n")
+    print(f"{'transport':<22}{'median ms':>10}{'requests':>10}")
+    for label, transport, concurrency in rows:
+        seconds, requests, answer = run(server, transport, concurrency, args.runs)
+        answers.add(answer.get("assignments_list") or answer.get("error"))
+        print(f"{label:<22}{seconds * 1000:>10.0f}{requests:>10.0f}")
+    print("\nAll transports gave the same answer." if len(answers) == 1 else "\nWARNING: transports disagree.")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# benchmarks/dining_lookup.py
+
+"""
+Times find_open_dining lookups against a dining hours snapshot (dining_hours.py),
+at every half hour of the week and from a few buildings, with and without a
+location name.
+
+    python benchmarks/dining_lookup.py
+    python benchmarks/dining_lookup.py --snapshot data/dining_hours.json --budget-us 200
+
+Exits 1 if the median lookup is over --budget-us.
+"""
+
+import os
+import sys
+import math
+import time
+import argparse
+import statistics
+from datetime import timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from dining_hours import DiningHours, parse_when  # noqa: E402
+
+NEAR = [None, "Gates", "Cohon Center", "Tepper", "Wean Hall"]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--snapshot", default=os.path.join(ROOT, "data", "dining_hours.sample.json"))
+    parser.add_argument("--runs", type=int, default=5, help="passes over the week, the median is reported")
+    parser.add_argument("--budget-us", type=float, help="fail if the median lookup takes longer than this")
+    args = parser.parse_args()
+
+    # Never reloads or ages out during the run, only the lookups are timed
+    hours = DiningHours(args.snapshot, max_age_days=math.inf, reload_seconds=math.inf)
+    monday = parse_when(time_of_day="00:00")
+    monday -= timedelta(days=monday.weekday())
+    times = [monday + timedelta(minutes=30 * i) for i in range(7 * 48)]
+    if hours.lookup(times[0]) is None:
+        print(f"Could not load {args.snapshot}.")
+        return 1
+    location = hours.lookup(times[0])["open"] or hours.lookup(times[20])["open"]
+    names = [None] + ([location[0]["name"]] if location else [])
+
+    samples = []
+    for _ in range(args.runs):
+        for near in NEAR:
+            for name in names:
+                started = time.perf_counter()
+                for when in times:
+                    hours.lookup(when, near, name)
+                samples.append((time.perf_counter() - started) / len(times) * 1e6)
+    median = statistics.median(samples)
+    print(f"{len(hours._snapshot.index.locations)} locations, {len(hours._snapshot.index.boundaries)} segments: "
+          f"median {median:.1f} us per lookup, p90 {sorted(samples)[int(len(samples) * 0.9)]:.1f} us")
+    if args.budget_us is not None and median > args.budget_us:
+        print(f"Over budget ({args.budget_us:.0f} us).")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
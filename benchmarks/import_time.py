@@ -0,0 +1,80 @@
+# benchmarks/import_time.py
+
+"""
+Startup guard: imports a module in a fresh interpreter under
+`python -X importtime`. It fails (exit 1) if the import takes longer than
+the budget, or if any module that should be deferred to first use is
+loaded at import.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --module api_server --budget-ms 1200 --top 15
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from warmup import DEFERRED_MODULES  # noqa: E402
+
+# Cumulative import time of production_cmugpt_assistant, with room for machine noise.
+# Most of it is openai (~85%), which every turn needs anyway.
+DEFAULT_BUDGET_MS = 900
+
+
+def measure(module: str) -> Tuple[float, Dict[str, float], Dict[str, float]]:
+    """Returns (total ms, {module: cumulative ms}, the same for direct imports only) for one cold import."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    cumulative: Dict[str, float] = {}
+    depths: Dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        # "import time:   self [us] | cumulative | imported package", nesting is indented by two spaces
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, total, name = line[len("import time:"):].split("|")
+        if not total.strip().isdigit():
+            continue
+        cumulative[name.strip()] = int(total) / 1000
+        depths[name.strip()] = len(name) - len(name.lstrip())
+    direct_depth = depths.get(module, 1) + 2
+    direct = {name: ms for name, ms in cumulative.items() if depths[name] == direct_depth}
+    return cumulative.get(module, 0.0), cumulative, direct
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="production_cmugpt_assistant")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("CMUGPT_IMPORT_BUDGET_MS", DEFAULT_BUDGET_MS)))
+    parser.add_argument("--runs", type=int, default=3, help="the fastest run is reported, to discount noise")
+    parser.add_argument("--top", type=int, default=10, help="show the slowest top-level imports")
+    args = parser.parse_args()
+
+    runs: List[Tuple[float, Dict[str, float], Dict[str, float]]] = [measure(args.module) for _ in range(args.runs)]
+    total, cumulative, direct = min(runs, key=lambda run: run[0])
+
+    print(f"import {args.module}: {total:.0f} ms (best of {args.runs}), budget {args.budget_ms:.0f} ms\n")
+    for name, ms in sorted(direct.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {ms:8.1f} ms  {name}")
+
+    failed = False
+    eager = [name for name in DEFERRED_MODULES if name in cumulative]
+    if eager:
+        print(f"\nFAIL: imported at startup but should be deferred: {', '.join(eager)}")
+        failed = True
+    if total > args.budget_ms:
+        print(f"\nFAIL: {total:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+        failed = True
+    if not failed:
+        print("\nOK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
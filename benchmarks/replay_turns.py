@@ -0,0 +1,104 @@
+# benchmarks/replay_turns.py
+
+"""
+Runs a scripted conversation through the production assistant and reports
+per-turn latency. Upstream calls (OpenAI, Perplexity, Canvas, Calendar) go
+through a cassette (http_cassette.py), so once recorded the benchmark runs
+anywhere, with no network or API keys.
+
+    # once, with real credentials
+    python benchmarks/replay_turns.py --record --cassette benchmarks/cassettes/turns.jsonl.gz
+    # then, with the recorded upstream timings, or instantly to see local overhead only
+    python benchmarks/replay_turns.py --cassette benchmarks/cassettes/turns.jsonl.gz --runs 5
+    python benchmarks/replay_turns.py --cassette benchmarks/cassettes/turns.jsonl.gz --instant --budget-ms 200
+
+Exits 1 if a replay needed a request the cassette doesn't have (the
+conversation no longer matches the recording) or the total is over --budget-ms.
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+from typing import List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_TURNS = [
+    "When was Carnegie Mellon founded?",
+    "Who founded it?",
+    "What are my current courses?",
+    "What's on my calendar this week?",
+    "Find me a free hour tomorrow afternoon.",
+]
+
+
+def read_turns(path: str) -> List[str]:
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cassette", default=os.path.join(ROOT, "benchmarks", "cassettes", "turns.jsonl.gz"))
+    parser.add_argument("--record", action="store_true", help="call the real services and record them")
+    parser.add_argument("--instant", action="store_true", help="replay without the recorded delays")
+    parser.add_argument("--turns", help="file with one user message per line")
+    parser.add_argument("--runs", type=int, default=3, help="replays of the conversation, the median is reported")
+    parser.add_argument("--budget-ms", type=float, help="fail if the conversation takes longer than this")
+    args = parser.parse_args()
+
+    # Read by http_cassette at import, so set before the assistant is imported
+    os.environ["CMUGPT_HTTP_MODE"] = "record" if args.record else "replay"
+    os.environ["CMUGPT_HTTP_CASSETTE"] = args.cassette
+    os.environ["CMUGPT_REPLAY_TIMING"] = "0" if args.instant else "1"
+    if not args.record:
+        # The clients want keys, replay never sends them
+        for name in ("OPENAI_API_KEY", "PERPLEXITY_API_KEY", "CANVAS_API_TOKEN"):
+            os.environ.setdefault(name, "replay")
+        os.environ.setdefault("CANVAS_BASE_URL", "https://canvas.cmu.edu")
+
+    from http_cassette import get_cassette
+    from cache_backends import MemoryCache, set_cache_backend
+    from production_cmugpt_assistant import CMUGPTAssistant
+
+    turns = read_turns(args.turns) if args.turns else DEFAULT_TURNS
+    cassette = get_cassette()
+    runs = 1 if args.record else args.runs
+    timings: List[List[float]] = []
+    for _ in range(runs):
+        cassette.rewind()
+        # Every run starts cold, as the recording did
+        set_cache_backend(MemoryCache())
+        assistant = CMUGPTAssistant()
+        run = []
+        for message in turns:
+            started = time.perf_counter()
+            assistant.process_user_input(message)
+            run.append((time.perf_counter() - started) * 1000)
+        timings.append(run)
+    if args.record:
+        cassette.save()
+
+    print(f"{'turn':<44}{'median ms':>10}")
+    for i, message in enumerate(turns):
+        print(f"{message[:42]:<44}{statistics.median(run[i] for run in timings):>10.0f}")
+    total = statistics.median(sum(run) for run in timings)
+    print(f"{'total':<44}{total:>10.0f}\n")
+    stats = cassette.stats()
+    print(", ".join(f"{k} {v}" for k, v in stats.items()))
+
+    failed = False
+    if stats["misses"]:
+        print("\nFAIL: requests missing from the cassette, record it again")
+        failed = True
+    if args.budget_ms is not None and total > args.budget_ms:
+        print(f"\nFAIL: {total:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
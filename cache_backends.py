@@ -0,0 +1,362 @@
+# cache_backends.py
+
+"""
+Pluggable caches shared by the Perplexity search, canvas_tools and the tool
+registry. Pick one with CMUGPT_CACHE_URL:
+
+    memory://                 per-process LRU (default)
+    sqlite:///path/cache.db   shared by every worker on the same machine
+    redis://host:6379/0       shared by every worker on every dyno
+"""
+
+import os
+import json
+import time
+import zlib
+import socket
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Dict, List, Tuple
+from urllib.parse import urlparse
+
+from metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+DEFAULT_MAX_ENTRIES = 2048
+# Values bigger than this are not cached at all
+DEFAULT_MAX_VALUE_BYTES = 256 * 1024
+# Serialized values above this size are zlib-compressed
+COMPRESS_THRESHOLD = 1024
+
+
+# --- Serialization ---
+
+def dumps(value: Any) -> bytes:
+    """Compact JSON, zlib-compressed when large. The first byte tags the format."""
+    raw = json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if len(raw) > COMPRESS_THRESHOLD:
+        return b"z" + zlib.compress(raw, 6)
+    return b"j" + raw
+
+
+def loads(blob: bytes) -> Any:
+    tag, body = blob[:1], blob[1:]
+    if tag == b"z":
+        body = zlib.decompress(body)
+    return json.loads(body.decode("utf-8"))
+
+
+class CacheBackend:
+    """
+    Key/value cache with per-entry TTLs. Values must be JSON-serializable.
+    Backends never raise on cache failures, they log and behave like a miss.
+    """
+
+    def __init__(self, max_value_bytes: int = DEFAULT_MAX_VALUE_BYTES):
+        self.max_value_bytes = max_value_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        blob = self._get(key)
+        # Keys are "<namespace>:...", e.g. "tool:", "canvas:", "calendar:"
+        namespace = key.split(":", 1)[0]
+        if blob is None:
+            self.misses += 1
+            CACHE_LOOKUPS.inc(namespace=namespace, result="miss")
+            return None
+        self.hits += 1
+        CACHE_LOOKUPS.inc(namespace=namespace, result="hit")
+        return loads(blob)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        blob = dumps(value)
+        if len(blob) > self.max_value_bytes:
+            logger.debug(f"Not caching {key}, {len(blob)} bytes is over the size limit.")
+            return False
+        self._set(key, blob, ttl)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {"backend": type(self).__name__, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def _get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def _set(self, key: str, blob: bytes, ttl: Optional[float]) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    """An in-process LRU. Fast, but every worker has its own copy."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, **kwargs):
+        super().__init__(**kwargs)
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Optional[float], bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, blob = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return blob
+
+    def _set(self, key: str, blob: bytes, ttl: Optional[float]) -> None:
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, blob)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache(CacheBackend):
+    """A cache file shared by all worker processes on one machine, survives restarts."""
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_MAX_ENTRIES, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+            "expires_at REAL, accessed_at REAL NOT NULL)"
+        )
+
+    def _get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        try:
+            with self._lock:
+                row = self._conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                if row[1] is not None and row[1] <= now:
+                    self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    return None
+                self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+        except sqlite3.Error as e:
+            logger.warning(f"SQLite cache read failed: {e}")
+            return None
+
+    def _set(self, key: str, blob: bytes, ttl: Optional[float]) -> None:
+        now = time.time()
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, blob, now + ttl if ttl else None, now),
+                )
+                self._writes += 1
+                # Trimming scans the table, so only do it every so often
+                if self._writes % 64 == 0:
+                    self._trim(now)
+        except sqlite3.Error as e:
+            logger.warning(f"SQLite cache write failed: {e}")
+
+    def _trim(self, now: float) -> None:
+        self._conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        self._conn.execute(
+            "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def delete(self, key: str) -> None:
+        try:
+            with self._lock:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            logger.warning(f"SQLite cache delete failed: {e}")
+
+    def clear(self) -> None:
+        try:
+            with self._lock:
+                self._conn.execute("DELETE FROM cache")
+        except sqlite3.Error as e:
+            logger.warning(f"SQLite cache clear failed: {e}")
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisCache(CacheBackend):
+    """
+    A cache on any server that speaks the Redis protocol (RESP). Uses a tiny
+    built-in client so redis-py is not required. Size limits on the server
+    side come from its maxmemory policy. Entries are written with TTLs.
+    """
+
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0,
+                 password: Optional[str] = None, prefix: str = "cmugpt:", timeout: float = 2.0, **kwargs):
+        super().__init__(**kwargs)
+        self.host, self.port, self.db, self.password = host, port, db, password
+        self.prefix = prefix
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    # --- RESP client ---
+
+    def _connect(self) -> None:
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile("rb")
+        if self.password:
+            self._call("AUTH", self.password)
+        if self.db:
+            self._call("SELECT", str(self.db))
+
+    def _close(self) -> None:
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = self._file = None
+
+    def _call(self, *args) -> Any:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self) -> Any:
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(rest)
+            return None if count < 0 else [self._read_reply() for _ in range(count)]
+        raise RedisError(f"Unexpected reply {line!r}")
+
+    def command(self, *args) -> Any:
+        """Runs one command, reconnecting once if the connection has dropped."""
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return self._call(*args)
+                except (OSError, ConnectionError) as e:
+                    self._close()
+                    if attempt == 1:
+                        raise ConnectionError(f"Redis unavailable: {e}")
+
+    # --- CacheBackend ---
+
+    def _get(self, key: str) -> Optional[bytes]:
+        try:
+            return self.command("GET", self.prefix + key)
+        except (ConnectionError, RedisError) as e:
+            logger.warning(f"Redis cache read failed: {e}")
+            return None
+
+    def _set(self, key: str, blob: bytes, ttl: Optional[float]) -> None:
+        args: List[Any] = ["SET", self.prefix + key, blob]
+        if ttl:
+            args += ["PX", int(ttl * 1000)]
+        try:
+            self.command(*args)
+        except (ConnectionError, RedisError) as e:
+            logger.warning(f"Redis cache write failed: {e}")
+
+    def delete(self, key: str) -> None:
+        try:
+            self.command("DEL", self.prefix + key)
+        except (ConnectionError, RedisError) as e:
+            logger.warning(f"Redis cache delete failed: {e}")
+
+    def clear(self) -> None:
+        # Only our own keys, the server may be shared with other apps
+        try:
+            cursor = b"0"
+            while True:
+                cursor, keys = self.command("SCAN", cursor, "MATCH", self.prefix + "*", "COUNT", 500)
+                if keys:
+                    self.command("DEL", *keys)
+                if cursor in (b"0", "0"):
+                    break
+        except (ConnectionError, RedisError) as e:
+            logger.warning(f"Redis cache clear failed: {e}")
+
+
+def create_cache_backend(url: str) -> CacheBackend:
+    """Builds a backend from a memory://, sqlite:/// or redis:// URL."""
+    parsed = urlparse(url)
+    if parsed.scheme == "memory":
+        return MemoryCache()
+    if parsed.scheme == "sqlite":
+        # sqlite:///cache.db is relative to the working directory, sqlite:////tmp/cache.db is absolute
+        return SQLiteCache(url[len("sqlite:///"):])
+    if parsed.scheme in ("redis", "tcp"):
+        db = int(parsed.path.lstrip("/") or 0)
+        return RedisCache(parsed.hostname or "localhost", parsed.port or 6379, db, parsed.password)
+    raise ValueError(f"Unsupported cache URL: {url}")
+
+
+_backend: Optional[CacheBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_cache_backend() -> CacheBackend:
+    """The process-wide cache, configured by CMUGPT_CACHE_URL (default memory://)."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_cache_backend(os.getenv("CMUGPT_CACHE_URL", "memory://"))
+    return _backend
+
+
+def set_cache_backend(backend: CacheBackend) -> None:
+    """Replaces the process-wide cache, e.g. with a RedisCache pointed at a local fake server."""
+    global _backend
+    _backend = backend
@@ -0,0 +1,221 @@
+# cache_warmer.py
+
+"""
+Prefetches a user's Canvas courses and upcoming-week calendar into the shared
+cache (cache_backends.py) in the background, so the first personal question
+of a session is answered from cache instead of the network.
+
+Warming runs on a small pool of low-priority threads, is rate-limited with a
+token bucket (jobs over the limit are skipped, not queued), can be cancelled
+per session or all at once, and keeps counters for stats(). Tasks are
+deduplicated by the cache entry they fill: sessions sharing the same Canvas
+user and calendar refetch them once per scheduled pass, not once each.
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+WARMER_WORKERS = int(os.getenv("CMUGPT_WARMER_WORKERS", "2"))
+# Sustained warm-ups per minute across the process, with bursts up to WARMER_BURST
+WARMER_RATE_PER_MINUTE = float(os.getenv("CMUGPT_WARMER_RATE_PER_MINUTE", "30"))
+WARMER_BURST = int(os.getenv("CMUGPT_WARMER_BURST", "4"))
+# How often recently active sessions are re-warmed, 0 disables the schedule
+WARMER_INTERVAL_SECONDS = float(os.getenv("CMUGPT_WARMER_INTERVAL_SECONDS", "300"))
+# Niceness added to warmer threads so they yield to request handling
+WARMER_NICENESS = 10
+
+
+def lower_thread_priority(niceness: int = WARMER_NICENESS) -> None:
+    """ThreadPoolExecutor initializer for background pools that should yield to request handling."""
+    # On Linux every thread has its own nice value, elsewhere this is a no-op
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), niceness)
+    except (AttributeError, OSError):
+        pass
+
+
+class TokenBucket:
+    """Allows rate_per_minute acquisitions on average, burst at once."""
+
+    def __init__(self, rate_per_minute: float, burst: int):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+WarmTask = Tuple[str, str, Callable[..., Any]]
+
+
+def warm_tasks(assistant: Any) -> List[WarmTask]:
+    """
+    The cache-backed fetches worth running ahead of time for this assistant,
+    as (name, key, fetch). key names the cache entry the fetch fills, tasks
+    with the same key are only run once at a time.
+    """
+    tasks = []
+    if "get_current_canvas_courses" in getattr(assistant, "TOOL_NAMES", ()):
+        import canvas_tools
+        tasks.append(("canvas_courses", canvas_tools.user_cache_key("term_courses"),
+                      canvas_tools.fetch_current_courses))
+    if "get_upcoming_canvas_assignments" in getattr(assistant, "TOOL_NAMES", ()):
+        import canvas_tools
+        tasks.append(("canvas_assignments", canvas_tools.user_cache_key("upcoming_assignments"),
+                      canvas_tools.fetch_upcoming_assignments))
+    if hasattr(assistant, "fetch_upcoming_events"):
+        tasks.append(("calendar_upcoming", assistant.UPCOMING_EVENTS_CACHE_KEY, assistant.fetch_upcoming_events))
+    return tasks
+
+
+class CacheWarmer:
+    """
+    warm(session_id, assistant) queues the assistant's warm_tasks(). Each task
+    only has to populate the cache, its return value is discarded. Tasks take
+    a refresh flag: session starts leave a fresh cache entry alone, scheduled
+    re-warms refetch so entries are replaced before they expire. A task whose
+    key is already queued or running is skipped, and a scheduled pass runs
+    each key once.
+    """
+
+    def __init__(self, max_workers: int = WARMER_WORKERS, rate_per_minute: float = WARMER_RATE_PER_MINUTE,
+                 burst: int = WARMER_BURST, tasks: Callable[[Any], List[WarmTask]] = warm_tasks):
+        self.tasks = tasks
+        self.limiter = TokenBucket(rate_per_minute, burst)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cache-warmer",
+                                            initializer=lower_thread_priority)
+        self._pending: Dict[str, List[Future]] = {}
+        # Cache key -> its queued or running warm-up
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._schedule: Optional[threading.Thread] = None
+        self.counters = {"scheduled": 0, "completed": 0, "failed": 0, "rate_limited": 0, "cancelled": 0,
+                         "deduplicated": 0}
+        self.busy_seconds = 0.0
+
+    def _count(self, name: str, amount: float = 1) -> None:
+        with self._lock:
+            self.counters[name] += amount
+
+    def warm(self, session_id: str, assistant: Any, refresh: bool = False,
+             warmed: Optional[Set[str]] = None) -> int:
+        """
+        Queues warm-ups for a session, returns how many were queued. Keys in
+        `warmed` are skipped, and the keys queued are added to it.
+        """
+        if self._stopped.is_set():
+            return 0
+        queued = []
+        for name, key, fetch in self.tasks(assistant):
+            with self._lock:
+                running = self._in_flight.get(key)
+                duplicate = (warmed is not None and key in warmed) or (running is not None and not running.done())
+            if duplicate:
+                self._count("deduplicated")
+                continue
+            if not self.limiter.try_acquire():
+                self._count("rate_limited")
+                logger.debug(f"Skipped warming {name} for {session_id}, over the rate limit.")
+                continue
+            future = self._executor.submit(self._run, session_id, name, fetch, refresh)
+            with self._lock:
+                self._in_flight[key] = future
+            if warmed is not None:
+                warmed.add(key)
+            queued.append(future)
+            self._count("scheduled")
+        if queued:
+            with self._lock:
+                # Forget sessions and keys whose warm-ups have all finished
+                self._pending = {sid: [f for f in futures if not f.done()]
+                                 for sid, futures in self._pending.items() if not all(f.done() for f in futures)}
+                self._in_flight = {key: f for key, f in self._in_flight.items() if not f.done()}
+                self._pending.setdefault(session_id, []).extend(queued)
+        return len(queued)
+
+    def _run(self, session_id: str, name: str, fetch: Callable[..., Any], refresh: bool) -> None:
+        started = time.perf_counter()
+        try:
+            result = fetch(refresh=refresh)
+            # canvas_tools reports failures in the result rather than raising
+            if isinstance(result, dict) and result.get("error"):
+                raise RuntimeError(result["error"])
+            self._count("completed")
+        except Exception as e:
+            self._count("failed")
+            logger.info(f"Warming {name} for {session_id} failed: {e}")
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.busy_seconds += elapsed
+
+    def cancel(self, session_id: str) -> int:
+        """Cancels warm-ups for a session that haven't started yet."""
+        with self._lock:
+            futures = self._pending.pop(session_id, [])
+        cancelled = sum(1 for future in futures if future.cancel())
+        self._count("cancelled", cancelled)
+        return cancelled
+
+    def start_schedule(self, sessions: Callable[[], List[Tuple[str, Any]]],
+                       interval: float = WARMER_INTERVAL_SECONDS) -> None:
+        """
+        Re-warms every (session_id, assistant) that sessions() returns each
+        interval seconds, e.g. SessionManager.recent_sessions. Each cache key
+        is refetched once per pass, however many sessions share it.
+        """
+        if interval <= 0 or self._schedule is not None:
+            return
+
+        def loop():
+            while not self._stopped.wait(interval):
+                warmed: Set[str] = set()
+                try:
+                    for session_id, assistant in sessions():
+                        self.warm(session_id, assistant, refresh=True, warmed=warmed)
+                except Exception:
+                    logger.exception("Scheduled cache warming failed.")
+
+        self._schedule = threading.Thread(target=loop, daemon=True, name="cache-warmer-schedule")
+        self._schedule.start()
+
+    def shutdown(self) -> None:
+        """Stops the schedule and cancels everything that hasn't started."""
+        self._stopped.set()
+        with self._lock:
+            session_ids = list(self._pending)
+        for session_id in session_ids:
+            self.cancel(session_id)
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.counters)
+            stats["busy_seconds"] = round(self.busy_seconds, 3)
+            stats["pending"] = sum(1 for futures in self._pending.values() for f in futures if not f.done())
+        return stats
+
+
+def build_cache_warmer() -> Optional[CacheWarmer]:
+    """The warmer is on by default, set CMUGPT_CACHE_WARMER=0 to turn it off."""
+    if os.getenv("CMUGPT_CACHE_WARMER", "1") == "0":
+        return None
+    return CacheWarmer()
@@ -0,0 +1,257 @@
+# calendar_queue.py
+
+"""
+Write-behind for Google Calendar mutations (CMUGPT_CALENDAR_WRITE_BEHIND=1).
+The assistant validates a change, enqueues it in a local SQLite queue and
+replies straight away. A background worker applies it to Google, retrying
+transient failures, and leaves a notification for the session that made it.
+
+Jobs survive restarts. Each one is applied with an idempotency key, so a
+retry after a crash or timeout can't apply it twice. An insert carries a
+client-chosen event id (a retried insert gets 409 Conflict rather than a
+duplicate event), and deletes treat 404/410 as already done.
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+QUEUE_DB_PATH = os.getenv("CMUGPT_CALENDAR_QUEUE_DB", "calendar_queue.db")
+MAX_ATTEMPTS = 5
+# Retries back off 2, 4, 8, ... seconds
+RETRY_BASE_SECONDS = 2.0
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+# How long the worker sleeps when the queue is empty and nothing wakes it
+IDLE_POLL_SECONDS = 5.0
+
+
+def new_event_id() -> str:
+    """A Calendar event id chosen by us, so the insert is idempotent (hex is valid base32hex)."""
+    return uuid.uuid4().hex
+
+
+def _status_of(error: Exception) -> Optional[int]:
+    # googleapiclient's HttpError carries the response, other errors (network) don't
+    return getattr(getattr(error, "resp", None), "status", None)
+
+
+def _is_retryable(error: Exception) -> bool:
+    status = _status_of(error)
+    return status in RETRYABLE_STATUSES if status is not None else isinstance(error, (OSError, TimeoutError))
+
+
+# --- Operations ---
+
+def _insert(service: Any, payload: Dict[str, Any]) -> None:
+    try:
+        service.events().insert(calendarId="primary", body=payload["event"], fields="id").execute()
+    except Exception as e:
+        # Our id already exists: an earlier attempt got through before failing to report back
+        if _status_of(e) != 409:
+            raise
+
+
+def _delete_ids(service: Any, event_ids: List[str]) -> None:
+    for event_id in event_ids:
+        try:
+            service.events().delete(calendarId="primary", eventId=event_id).execute()
+        except Exception as e:
+            if _status_of(e) not in (404, 410):
+                raise
+
+
+def _delete(service: Any, payload: Dict[str, Any]) -> None:
+    _delete_ids(service, payload["event_ids"])
+
+
+def _delete_window(service: Any, payload: Dict[str, Any]) -> None:
+    events = service.events().list(calendarId="primary", timeMin=payload["time_min"], timeMax=payload["time_max"],
+                                   singleEvents=True, fields="items(id)").execute()
+    _delete_ids(service, [event["id"] for event in events.get("items", [])])
+
+
+OPERATIONS: Dict[str, Callable[[Any, Dict[str, Any]], None]] = {
+    "insert": _insert,
+    "delete": _delete,
+    "delete_window": _delete_window,
+}
+
+
+class CalendarWriteQueue:
+    """
+    A durable queue of calendar mutations, applied oldest first by one worker
+    thread per process (a job waiting to retry doesn't hold up the ones
+    behind it). Several processes can share the database file, each job is
+    claimed by exactly one of them.
+    """
+
+    def __init__(self, path: str = QUEUE_DB_PATH, service_factory: Optional[Callable[[], Any]] = None,
+                 on_write: Optional[Callable[[], None]] = None):
+        self.path = path
+        self.service_factory = service_factory
+        # Called after every applied job, e.g. to invalidate cached event lists
+        self.on_write = on_write
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (key TEXT PRIMARY KEY, session_id TEXT NOT NULL, kind TEXT NOT NULL, "
+            "payload TEXT NOT NULL, label TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "run_at REAL NOT NULL, error TEXT, notified INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, run_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_by_session ON jobs (session_id, notified)")
+
+    def start(self) -> "CalendarWriteQueue":
+        """Starts the worker. Jobs left running by a crashed worker are retried."""
+        if self._worker is None and self.service_factory is not None:
+            with self._lock:
+                # Only safe because every operation is idempotent
+                self._conn.execute("UPDATE jobs SET status = 'pending' WHERE status = 'running'")
+            self._worker = threading.Thread(target=self._loop, daemon=True, name="calendar-writer")
+            self._worker.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wake.set()
+
+    def enqueue(self, session_id: str, kind: str, payload: Dict[str, Any], label: str,
+                key: Optional[str] = None) -> str:
+        """
+        Queues a mutation and returns its key. `label` describes it to the user,
+        e.g. "Add 'Study group' on 10/21 at 18:00". Enqueueing the same key twice
+        is a no-op.
+        """
+        if kind not in OPERATIONS:
+            raise ValueError(f"Unknown calendar operation: {kind}")
+        key = key or uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO jobs (key, session_id, kind, payload, label, status, run_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, 'pending', ?, ?)",
+                (key, session_id, kind, json.dumps(payload), label, now, now),
+            )
+        self._wake.set()
+        return key
+
+    def pending(self, session_id: str) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE session_id = ? AND status IN ('pending', 'running')", (session_id,)
+            ).fetchone()
+        return row[0]
+
+    def pop_notifications(self, session_id: str) -> List[Dict[str, Any]]:
+        """Finished jobs the session hasn't been told about yet, marked as told."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, label, status, error FROM jobs WHERE session_id = ? AND notified = 0 "
+                "AND status IN ('done', 'failed') ORDER BY created_at", (session_id,)
+            ).fetchall()
+            if rows:
+                self._conn.executemany("UPDATE jobs SET notified = 1 WHERE key = ?", [(row[0],) for row in rows])
+        return [{"key": key, "label": label, "status": status, "error": error}
+                for key, label, status, error in rows]
+
+    # --- Worker ---
+
+    def _claim(self) -> Optional[tuple]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key, kind, payload, attempts FROM jobs WHERE status = 'pending' AND run_at <= ? "
+                "ORDER BY created_at LIMIT 1", (time.time(),)
+            ).fetchone()
+            if row is None:
+                return None
+            # Another process may have claimed it between the SELECT and here
+            claimed = self._conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1 WHERE key = ? AND status = 'pending'",
+                (row[0],),
+            ).rowcount
+        return row if claimed else None
+
+    def _finish(self, key: str, status: str, error: Optional[str] = None, run_at: Optional[float] = None) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = ?, error = ?, run_at = COALESCE(?, run_at) WHERE key = ?",
+                               (status, error, run_at, key))
+
+    def _next_wait(self) -> float:
+        with self._lock:
+            row = self._conn.execute("SELECT MIN(run_at) FROM jobs WHERE status = 'pending'").fetchone()
+        if row[0] is None:
+            return IDLE_POLL_SECONDS
+        return max(0.0, min(IDLE_POLL_SECONDS, row[0] - time.time()))
+
+    def run_pending(self) -> int:
+        """Applies every job that is due, returns how many were attempted."""
+        service = self.service_factory()
+        attempted = 0
+        while not self._stopped.is_set():
+            job = self._claim()
+            if job is None:
+                break
+            key, kind, payload, attempts = job
+            attempted += 1
+            try:
+                OPERATIONS[kind](service, json.loads(payload))
+            except Exception as e:
+                if _is_retryable(e) and attempts + 1 < MAX_ATTEMPTS:
+                    delay = RETRY_BASE_SECONDS * 2 ** attempts
+                    logger.warning(f"Calendar {kind} {key} failed ({e}), retrying in {delay:.0f}s.")
+                    self._finish(key, "pending", str(e), time.time() + delay)
+                else:
+                    logger.error(f"Calendar {kind} {key} failed: {e}")
+                    self._finish(key, "failed", str(e))
+                continue
+            self._finish(key, "done")
+            if self.on_write is not None:
+                self.on_write()
+        return attempted
+
+    def _loop(self) -> None:
+        while not self._stopped.is_set():
+            # Cleared before the run, so an enqueue during it still wakes the next wait
+            self._wake.clear()
+            try:
+                self.run_pending()
+            except Exception:
+                logger.exception("Calendar write worker failed.")
+            self._wake.wait(self._next_wait())
+
+
+_queue: Optional[CalendarWriteQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_calendar_queue(service_factory: Optional[Callable[[], Any]] = None,
+                       on_write: Optional[Callable[[], None]] = None) -> Optional[CalendarWriteQueue]:
+    """
+    The process-wide queue, or None unless CMUGPT_CALENDAR_WRITE_BEHIND=1.
+    The worker starts once a caller supplies the service factory, readers
+    (e.g. the API server's notifications route) can pass nothing.
+    """
+    global _queue
+    if os.getenv("CMUGPT_CALENDAR_WRITE_BEHIND", "0") != "1":
+        return None
+    with _queue_lock:
+        if _queue is None:
+            _queue = CalendarWriteQueue()
+        if service_factory is not None and _queue.service_factory is None:
+            _queue.service_factory = service_factory
+            _queue.on_write = on_write
+            _queue.start()
+    return _queue
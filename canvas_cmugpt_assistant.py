@@ -5,14 +5,31 @@ import json
 from dotenv import load_dotenv
 import os
 import time
-from perplexity_integration import CMUPerplexitySearch
+import logging
+from perplexity_integration import CMUPerplexitySearch, build_speculative_search
 import requests
-import canvas_tools# <-- IMPORT the new module
+import uuid
+from intent_router import build_default_router
+from tool_registry import TOOL_REGISTRY
+from result_compactor import ResultStore, CompactionLedger
+from session_memory import MessageStore, new_functions_called, memory_footprint, MAX_FUNCTIONS_CALLED, MAX_RESULT_CHARS
+from structured_logging import start_turn
+from usage_accounting import UsageLedger, BUDGET_HISTORY_MESSAGES
+from model_router import get_model_router, tool_output_chars, SYNTHESIS_SMALL_MAX_CHARS
 
 # Load environment variables at the module level
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 class CMUGPTAssistant:
+    # Tools from tool_registry.py that this assistant exposes to the model
+    TOOL_NAMES = [
+        "general_purpose_knowledge_search",
+        "get_current_canvas_courses",
+        "get_upcoming_canvas_assignments",
+    ]
+
     def __init__(self):
         # Set up OpenAI client with timeout configuration
         self.client = OpenAI(
@@ -20,178 +37,229 @@ class CMUGPTAssistant:
             timeout=60.0,  # 60 second timeout
             max_retries=3  # Allow 3 retries
         )
+        # Set by the session manager when it owns this assistant, tags the turn's log records
+        self.session_id = None
+        # Why the last turn answered with an apology instead of an answer, None when it didn't
+        self.last_turn_error = None
+
+        self.registry = TOOL_REGISTRY
 
         # Define the function definitions (tools) for the model
         self.tools = self.get_tools() # Call the method to get tools
 
         # Initialize conversation messages
-        self.messages = [
+        self.messages = MessageStore([
             {
                 "role": "system",
                 "content": "You are CMUGPT, an assistant knowledgeable about Carnegie Mellon University in Pittsburgh, Pennsylvania. Use the supplied tools to assist the user. You can also access the user's Canvas information if they ask for it, using the appropriate tools." # Added Canvas context
             },
-        ]
+        ])
 
         # Keep track of functions called
-        self.functions_called = []
+        self.functions_called = new_functions_called()
+        # Full tool results live here, only compacted versions go into self.messages
+        self.result_store = ResultStore(MAX_FUNCTIONS_CALLED, MAX_RESULT_CHARS)
+        self.compaction = CompactionLedger()
+        # Tokens and estimated cost of every model call, see usage_accounting.py
+        self.usage = UsageLedger()
+        # Picks the model per call from recent latency and errors, shared by every session
+        self.router = get_model_router()
 
         # Initialize helper classes for tools
-        self.perplexity_search = CMUPerplexitySearch()
-        # No specific initialization needed for canvas_tools module itself
+        self.perplexity_search = CMUPerplexitySearch(usage=self.usage)
+        # Optionally start Perplexity alongside the first OpenAI call (CMUGPT_SPECULATIVE_SEARCH=1)
+        self.speculative_search = build_speculative_search(self.perplexity_search)
+
+        # Router for obvious tool intents, lets us skip the tool-selection call
+        self.intent_router = build_default_router(self.TOOL_NAMES)
 
     def get_tools(self):
         """Defines the tools (functions) available to the OpenAI model."""
-        tools = [
-            # --- Existing Perplexity Tool ---
-            {
-                "type": "function",
-                "function": {
-                    "name": "general_purpose_knowledge_search",
-                    "description": "Search for general knowledge about Carnegie Mellon University.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "search_query": {
-                                "type": "string",
-                                "description": "The query to search for general knowledge."
-                            }
-                        },
-                        "required": ["search_query"],
-                        "additionalProperties": False
-                    },
-                    "strict": True
-                }
-            },
-            # --- ADDED Canvas Courses Tool ---
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_current_canvas_courses",
-                    "description": "Fetches the user's currently active courses from Canvas for the most recent academic term.",
-                    "parameters": { # This tool takes no parameters from the LLM
-                        "type": "object",
-                        "properties": {},
-                        "required": []
-                    }
-                }
-            },
-            # --- Add definitions for other tools here ---
-        ]
-        return tools
+        # Schemas, implementations and timeout policy are declared once in tool_registry.py
+        return self.registry.openai_tools(self.TOOL_NAMES)
+
+    def complete(self, call_type, **kwargs):
+        # The model comes from the router (model_router.py). Past the session's budget it's the cheaper
+        # one, and an answer that only restates short tool results may go to the small model
+        small_ok = call_type == "synthesis" and tool_output_chars(kwargs["messages"]) <= SYNTHESIS_SMALL_MAX_CHARS
+        return self.router.complete(self.client, call_type, over_budget=self.usage.over_budget,
+                                    small_ok=small_ok, **kwargs)
 
     def process_user_input(self, user_input):
         """Handles user input, interacts with OpenAI, calls tools, and returns the final response."""
+        start_turn(self.session_id)
+        self.usage.start_turn()
+        self.last_turn_error = None
         self.messages.append({"role": "user", "content": user_input})
+        self.compaction.start_turn()
+        if self.usage.over_budget:
+            # Over budget the history is kept short too, it's resent on every call
+            dropped = self.messages.compact(BUDGET_HISTORY_MESSAGES)
+            if dropped:
+                logger.info(f"Session over its usage budget, dropped {dropped} older messages.")
         max_retries = 3
         retry_delay = 1
 
+        route = self.intent_router.route(user_input) if self.intent_router else None
+        if route is not None:
+            logger.info(f"Routed locally to {route.tool_name} ({route.source}, confidence {route.confidence:.2f})")
+            self.execute_routed_intent(route)
+            if route.template:
+                # UI-only tools answer with a template, no model call needed
+                self.messages.append({"role": "assistant", "content": route.template})
+                return route.template
+
+        if route is None and self.speculative_search:
+            self.speculative_search.start(user_input)
+
         for attempt in range(max_retries):
             try:
-                print(f"\n--- Attempt {attempt + 1}: Sending messages to OpenAI ---")
-                # print(json.dumps(self.messages, indent=2)) # Uncomment for deep debugging
+                if route is not None:
+                    # Tool result is already in the conversation, just get the final response
+                    response_after_tool, decision = self.complete(
+                        "synthesis",
+                        messages=self.messages.to_openai(),
+                    )
+                    self.usage.record_openai("synthesis", response_after_tool, route=decision)
+                    final_assistant_message = response_after_tool.choices[0].message
+                    self.messages.append(final_assistant_message)
+                    return final_assistant_message.content
+
+                logger.debug(f"Attempt {attempt + 1}: sending messages to OpenAI")
 
-                response = self.client.chat.completions.create(
-                    model='gpt-4o-mini',
-                    messages=self.messages,
+                response, decision = self.complete(
+                    "tool_selection",
+                    messages=self.messages.to_openai(),
                     tools=self.tools,
                     tool_choice="auto" # Let the model decide when to call tools
                 )
+                self.usage.record_openai("tool_selection", response, route=decision)
 
                 assistant_message = response.choices[0].message
-                print(f"--- OpenAI Response Choice 0 ---")
-                # print(assistant_message) # Uncomment for deep debugging
 
                 # Check if the model wants to call a tool
                 if assistant_message.tool_calls:
-                    print("--- Tool Call Requested ---")
                     # Append the assistant's turn message that contains the tool_calls request
                     self.messages.append(assistant_message)
 
-                    # Process all tool calls requested in this turn
+                    # Parse all tool calls requested in this turn
+                    calls = []
                     for tool_call in assistant_message.tool_calls:
                         function_name = tool_call.function.name
                         # Arguments might be empty, handle safely
                         try:
                             arguments = json.loads(tool_call.function.arguments) if tool_call.function.arguments else {}
                         except json.JSONDecodeError:
-                             print(f"Error decoding arguments for {function_name}: {tool_call.function.arguments}")
+                             logger.warning(f"Error decoding arguments for {function_name}: {tool_call.function.arguments}")
                              arguments = {"error": "Invalid arguments format"} # Handle error case
+                        logger.info(f"Executing tool: {function_name}", extra={"tool": function_name, "arguments": arguments})
+                        calls.append((function_name, arguments))
 
-                        print(f"Executing tool: {function_name} with args: {arguments}")
-                        # Execute the corresponding function
-                        result = self.execute_function(function_name, arguments)
-                        print(f"Tool result: {result}")
+                    # Execute them through the registry, parallel-safe tools run concurrently
+                    results = self.registry.dispatch_many(self, calls)
 
-                        # Keep track of functions called (for sidebar display)
-                        self.functions_called.append({
-                            'function_name': function_name,
-                            'arguments': arguments,
-                            'result': result # Store the actual result dict/string
-                        })
+                    for tool_call, (function_name, arguments), result in zip(assistant_message.tool_calls, calls, results):
+                        logger.debug("Tool result: %s", result)
+
+                        # Keep track of functions called (for sidebar display) and compact the result
+                        content = self.record_tool_result(function_name, arguments, result)
 
                         # Append the tool's result message back to the conversation history
                         self.messages.append({
                             "role": "tool",
-                            "content": json.dumps(result), # Result should be JSON serializable
+                            "content": content, # Compacted JSON, the full result is in self.result_store
                             "tool_call_id": tool_call.id
                         })
 
+                    if self.speculative_search:
+                        self.speculative_search.finish_turn()
+
                     # --- Call OpenAI AGAIN with the tool results included ---
-                    print("--- Calling OpenAI again with tool results ---")
-                    # print(json.dumps(self.messages, indent=2)) # Uncomment for deep debugging
+                    logger.debug("Calling OpenAI again with tool results")
 
-                    response_after_tool = self.client.chat.completions.create(
-                        model='gpt-4o-mini',
-                        messages=self.messages,
+                    response_after_tool, decision = self.complete(
+                        "synthesis",
+                        messages=self.messages.to_openai(),
                         # No tools needed here, we want a final text response
                     )
+                    self.usage.record_openai("synthesis", response_after_tool, route=decision)
 
                     final_assistant_message = response_after_tool.choices[0].message
-                    print(f"--- Final OpenAI Response ---")
-                    # print(final_assistant_message) # Uncomment for deep debugging
 
                     self.messages.append(final_assistant_message) # Append final assistant response
                     return final_assistant_message.content # Return the content
 
                 else:
                     # No tool call requested, just return the direct response
-                    print("--- Direct Response Received ---")
+                    logger.debug("Direct response received")
+                    if self.speculative_search:
+                        self.speculative_search.finish_turn()
                     self.messages.append(assistant_message) # Append direct assistant response
                     return assistant_message.content
 
             except APITimeoutError as e:
-                print(f"Attempt {attempt + 1} failed: Timeout Error - {e}")
-                if attempt == max_retries - 1: return f"I apologize, but I'm having trouble connecting. Please try again in a moment. (Error: Connection timeout)"
+                logger.warning(f"Attempt {attempt + 1} failed: Timeout Error - {e}")
+                if attempt == max_retries - 1:
+                    self.last_turn_error = f"{type(e).__name__}: {e}"
+                    return f"I apologize, but I'm having trouble connecting. Please try again in a moment. (Error: Connection timeout)"
                 time.sleep(retry_delay)
                 retry_delay *= 2
             except APIError as e:
-                print(f"Attempt {attempt + 1} failed: API Error - {e}")
-                if attempt == max_retries - 1: return f"I apologize, but there was an error processing your request. Please try again. (Error: {str(e)})"
+                logger.warning(f"Attempt {attempt + 1} failed: API Error - {e}")
+                if attempt == max_retries - 1:
+                    self.last_turn_error = f"{type(e).__name__}: {e}"
+                    return f"I apologize, but there was an error processing your request. Please try again. (Error: {str(e)})"
                 time.sleep(retry_delay)
                 retry_delay *= 2
             except Exception as e:
-                print(f"Attempt {attempt + 1} failed: Unexpected Error - {e}")
-                # Log the full traceback for unexpected errors
-                import traceback
-                traceback.print_exc()
+                # Logs the full traceback for unexpected errors
+                logger.exception(f"Attempt {attempt + 1} failed: Unexpected Error - {e}")
+                self.last_turn_error = f"{type(e).__name__}: {e}"
                 return f"I apologize, but an unexpected error occurred. Please try again. (Error: {type(e).__name__})"
 
+        self.last_turn_error = f"No answer after {max_retries} attempts"
         return "I apologize, but I was unable to process your request after multiple attempts. Please try again later."
 
+    def record_tool_result(self, function_name, arguments, result):
+        """Stores the full result for the sidebar and returns the compacted content for the model."""
+        result_ref = self.result_store.put(result)
+        content = self.registry.compact(function_name, result)
+        tokens_saved = self.compaction.record(function_name, json.dumps(result), content)
+        self.functions_called.append({
+            'function_name': function_name,
+            'arguments': arguments,
+            'result_ref': result_ref, # Look up with get_function_result()
+            'tokens_saved': tokens_saved
+        })
+        return content
+
+    def execute_routed_intent(self, route):
+        """Runs a locally routed tool and records it as if the model had requested it."""
+        tool_call_id = f"call_local_{uuid.uuid4().hex[:20]}"
+        result = self.execute_function(route.tool_name, route.arguments)
+        logger.debug("Tool result: %s", result)
+        content = self.record_tool_result(route.tool_name, route.arguments, result)
+
+        # The tool result must follow an assistant message that requested it
+        self.messages.append({
+            "role": "assistant",
+            "tool_calls": [{
+                "id": tool_call_id,
+                "type": "function",
+                "function": {"name": route.tool_name, "arguments": json.dumps(route.arguments)}
+            }]
+        })
+        self.messages.append({
+            "role": "tool",
+            "content": content,
+            "tool_call_id": tool_call_id
+        })
+        return result
+
     def execute_function(self, function_name, arguments):
         """Dispatcher to call the correct tool implementation."""
-        if function_name == 'general_purpose_knowledge_search':
-            # Pass the specific argument the tool expects
-            return self.general_purpose_knowledge_search(arguments.get('search_query'))
-        # --- ADDED Canvas Courses Tool Call ---
-        elif function_name == 'get_current_canvas_courses':
-            # This tool takes no arguments from the LLM
-            # Call the function imported from canvas_tools.py
-            return canvas_tools.fetch_current_courses()
-        # --- Add elif statements for other tools here ---
-        else:
-            print(f"Error: Function '{function_name}' not found.")
-            return {"error": f"Function '{function_name}' not found."}
+        # Tools are looked up by name in the shared registry, see tool_registry.py
+        return self.registry.dispatch(self, function_name, arguments)
 
     # --- Tool Implementations (or calls to modules) ---
 
@@ -200,11 +268,23 @@ class CMUGPTAssistant:
         # Ensure search_query is provided
         if not search_query:
              return {"error": "Search query was not provided."}
+        if self.speculative_search:
+            result = self.speculative_search.claim(search_query)
+            if result is not None:
+                return result
         return self.perplexity_search.search(search_query)
 
-    # Note: get_current_canvas_courses implementation is now in canvas_tools.py
+    # Note: get_current_canvas_courses is declared in tool_registry.py and implemented in canvas_tools.py
 
     def get_functions_called(self):
         """Returns the history of functions called during the session."""
         # Return a copy to prevent external modification
-        return list(self.functions_called)
\ No newline at end of file
+        return list(self.functions_called)
+
+    def memory_footprint(self):
+        """Approximate bytes held by this session's messages, functions_called and results."""
+        return memory_footprint(self.messages, self.functions_called, self.result_store)
+
+    def get_function_result(self, result_ref):
+        """Returns the full result of a function call recorded in functions_called."""
+        return self.result_store.get(result_ref)
\ No newline at end of file
@@ -1,20 +1,76 @@
 # canvas_tools.py
 
+"""
+Canvas courses and upcoming assignments for the user of CANVAS_API_TOKEN,
+cached per user in the shared cache.
+
+Courses and their term always come from REST (/courses with active
+enrollments). GraphQL's allCourses would also list concluded and invited
+enrollments. Assignments come from the planner, one paginated call for
+every course. Without the planner they are fetched per course over REST,
+or with CMUGPT_CANVAS_TRANSPORT=graphql in one GraphQL query for all
+current courses, falling back to REST per course when it fails. So the
+GraphQL transport only batches the assignments, and only when the planner
+isn't used.
+"""
+
 import os
+import time
+import heapq
+import hashlib
 import requests
 import logging
-from datetime import datetime, timezone
-from typing import List, Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Optional, Tuple
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from cache_backends import get_cache_backend
+from payload_stats import parse_json
+from http_cassette import mount_requests
+from hedged_requests import hedged
+from metrics import instrument_session
+
+# Logging is configured by the application, not at import
 logger = logging.getLogger(__name__)
 
 # --- Constants ---
-# How many courses to request per API call. 50 is a reasonable balance.
-# Note: This initial version doesn't handle pagination across multiple calls.
-# It assumes the user's active courses fit within this limit.
+# How many items to request per API call. 50 is a reasonable balance.
 PER_PAGE = 50
+# Safety limit when following Link headers
+MAX_PAGES = 10
+# Enrollments rarely change mid-session, so course lists are cached for a few minutes
+COURSES_CACHE_TTL = 300
+ASSIGNMENTS_CACHE_TTL = 300
+# Per-course requests in flight at once, Canvas throttles bursts from one token
+MAX_CONCURRENT_REQUESTS = int(os.getenv("CMUGPT_CANVAS_CONCURRENCY", "6"))
+# Set CMUGPT_CANVAS_PLANNER=0 to always use per-course assignment calls
+USE_PLANNER = os.getenv("CMUGPT_CANVAS_PLANNER", "1") != "0"
+MAX_ASSIGNMENT_DAYS = 60
+# "graphql" fetches every current course's assignments in one query, falling back to REST on any failure
+CANVAS_TRANSPORT = os.getenv("CMUGPT_CANVAS_TRANSPORT", "rest")
+# Assignments per course in one GraphQL query, courses with more are completed over REST
+GRAPHQL_ASSIGNMENTS_PER_COURSE = 100
+# After a GraphQL failure, REST is used for this long before GraphQL is tried again
+GRAPHQL_RETRY_SECONDS = 600
+# The only keys kept from each Canvas object, everything else is dropped right after parsing
+COURSE_FIELDS = ("id", "name", "course_code", "enrollment_term_id", "term")
+ASSIGNMENT_FIELDS = ("name", "due_at", "submission")
+PLANNER_FIELDS = ("plannable_type", "plannable", "plannable_date", "context_name", "submissions")
+# Planner items that aren't something to hand in
+PLANNER_SKIP_TYPES = {"announcement", "calendar_event", "planner_note"}
+
+# --- Helper Function for Caching ---
+
+def _user_cache_key(kind: str, base_url: str, token: str) -> str:
+    """Cache keys are per Canvas user, identified by a hash of the token (never the token itself)."""
+    user = hashlib.sha1(f"{base_url}|{token}".encode("utf-8")).hexdigest()[:16]
+    return f"canvas:{kind}:{user}"
+
+
+def user_cache_key(kind: str) -> str:
+    """_user_cache_key() for the configured Canvas user, e.g. to tell apart what cache_warmer.py warms."""
+    return _user_cache_key(kind, os.getenv("CANVAS_BASE_URL", "").rstrip('/'), os.getenv("CANVAS_API_TOKEN", ""))
+
 
 # --- Helper Function for Term Filtering ---
 
@@ -76,71 +132,206 @@ def _find_most_recent_term_id(courses: List[Dict[str, Any]]) -> Optional[int]:
     return most_recent_term_id
 
 
-# --- Main Function to Fetch Courses ---
+# --- HTTP Helpers ---
 
-def fetch_current_courses() -> Dict[str, Any]:
-    """
-    Fetches active courses for the user associated with the API token,
-    filters them for the most recent term, and formats the result.
+# One pooled session so per-course requests reuse connections
+_http = requests.Session()
+_http.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=MAX_CONCURRENT_REQUESTS))
+_http.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=MAX_CONCURRENT_REQUESTS))
+# Recorded or replayed instead when CMUGPT_HTTP_MODE is set, see http_cassette.py
+mount_requests(_http, "canvas", pool_maxsize=MAX_CONCURRENT_REQUESTS)
+instrument_session(_http, "canvas")
 
-    Returns:
-        A dictionary containing either a 'courses_list' string or an 'error' string.
-    """
-    logger.info("Attempting to fetch current Canvas courses...")
 
-    # 1. Get Credentials from Environment
+def _canvas_credentials() -> Optional[Tuple[str, str]]:
     token = os.getenv("CANVAS_API_TOKEN")
     base_url = os.getenv("CANVAS_BASE_URL")
-
     if not token or not base_url:
         logger.error("Canvas API token or base URL not found in environment variables.")
-        return {"error": "Canvas API connection is not configured."}
+        return None
+    return base_url.rstrip('/'), token
 
-    # 2. Construct API Request Details
-    api_url = f"{base_url.rstrip('/')}/api/v1/courses"
-    headers = {"Authorization": f"Bearer {token}"}
-    params = {
-        "include[]": "term",
-        "enrollment_state": "active",
-        "per_page": PER_PAGE
-    }
 
-    # 3. Make API Call
-    try:
-        logger.debug(f"Making GET request to {api_url} with params: {params}")
-        response = requests.get(api_url, headers=headers, params=params, timeout=20)
+def _get_paginated(url: str, token: str, params: Dict[str, Any], keep: Optional[Tuple[str, ...]] = None,
+                   name: str = "canvas", max_pages: int = MAX_PAGES) -> List[Dict[str, Any]]:
+    """
+    GETs a Canvas list endpoint, following the Link header's rel="next" until
+    the last page (or max_pages). Only the `keep` keys of each item are kept,
+    and every page is metered under `name`. Raises requests exceptions and
+    ValueError.
+    """
+    headers = {"Authorization": f"Bearer {token}"}
+    items: List[Dict[str, Any]] = []
+    for _ in range(max_pages):
+        logger.debug(f"Making GET request to {url} with params: {params}")
+        # GETs are hedged against a slow Canvas node when CMUGPT_HEDGE_REQUESTS=1
+        response = hedged(_http, "canvas", "GET", url, headers=headers, params=params, timeout=20)
         response.raise_for_status()
+        # requests negotiates gzip, Content-Length is the compressed size when Canvas compresses
+        length = response.headers.get("Content-Length")
+        page = parse_json(name, response.content, int(length) if length and length.isdigit() else None, keep)
+        if not isinstance(page, list):
+            raise ValueError(f"Expected a list from {url}, got {type(page).__name__}")
+        items.extend(page)
+        next_url = response.links.get("next", {}).get("url")
+        if not next_url:
+            break
+        # The next link already carries the query string
+        url, params = next_url, None
+    else:
+        logger.warning(f"Stopped paging {url} after {max_pages} pages.")
+    return items
 
-        all_courses = response.json()
-        logger.info(f"Successfully fetched {len(all_courses)} active course enrollment(s) from Canvas.")
-
-        if not isinstance(all_courses, list):
-             logger.error(f"Unexpected API response format. Expected list, got {type(all_courses)}")
-             return {"error": "Received unexpected data format from Canvas."}
-
-        if not all_courses:
-            return {"courses_list": "You do not seem to be enrolled in any active courses."}
 
-    except requests.exceptions.Timeout:
+def _request_error(action: str, error: Exception) -> Dict[str, Any]:
+    """Maps a failed Canvas request to the error dict the tools return."""
+    if isinstance(error, requests.exceptions.Timeout):
         logger.error("Request to Canvas API timed out.")
         return {"error": "The request to Canvas timed out. Please try again later."}
-    except requests.exceptions.HTTPError as http_err:
-        logger.error(f"HTTP error occurred: {http_err} - Status Code: {http_err.response.status_code}")
-        if http_err.response.status_code == 401:
+    if isinstance(error, requests.exceptions.HTTPError):
+        status = error.response.status_code
+        logger.error(f"HTTP error occurred: {error} - Status Code: {status}")
+        if status == 401:
             return {"error": "Authentication failed. Please check the Canvas API token."}
-        else:
-            return {"error": f"Failed to fetch courses from Canvas (HTTP {http_err.response.status_code})."}
-    except requests.exceptions.RequestException as req_err:
-        logger.error(f"Error during Canvas API request: {req_err}")
-        return {"error": "Could not connect to Canvas to fetch courses."}
-    except ValueError as json_err:
-        logger.error(f"Error parsing JSON response from Canvas: {json_err}")
+        return {"error": f"Failed to fetch {action} from Canvas (HTTP {status})."}
+    if isinstance(error, requests.exceptions.RequestException):
+        logger.error(f"Error during Canvas API request: {error}")
+        return {"error": f"Could not connect to Canvas to fetch {action}."}
+    if isinstance(error, ValueError):
+        logger.error(f"Error parsing JSON response from Canvas: {error}")
         return {"error": "Received invalid data format from Canvas."}
+    logger.exception(f"An unexpected error occurred during {action} fetching.")
+    return {"error": f"An unexpected error occurred while fetching {action}."}
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+
+def _due_key(assignment: Dict[str, Any]) -> datetime:
+    # Unparseable due dates sort last
+    return _parse_time(assignment["due_at"]) or datetime.max.replace(tzinfo=timezone.utc)
+
+
+# --- GraphQL Transport ---
+
+# Asked of each current course. For a student Canvas only returns their own submission
+GRAPHQL_COURSE_FIELDS = """
+    _id
+    assignmentsConnection(first: $assignments) {
+      nodes { name dueAt submissionsConnection(first: 1) { nodes { submittedAt } } }
+      pageInfo { hasNextPage }
+    }"""
+
+_graphql_retry_at = 0.0
+
+
+def _graphql_query(course_ids: List[Any]) -> str:
+    """One aliased course() per course, allCourses would also list courses the user isn't actively enrolled in."""
+    courses = "".join(f'\n  c{int(course_id)}: course(id: "{int(course_id)}") {{{GRAPHQL_COURSE_FIELDS}\n  }}'
+                      for course_id in course_ids)
+    return f"query UpcomingAssignments($assignments: Int!) {{{courses}\n}}"
+
+
+def _graphql_assignments(base_url: str, token: str, courses: List[Dict[str, Any]],
+                         refresh: bool = False) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+    """
+    The assignments of the current term's courses (from active enrollments,
+    see fetch_current_term_courses) in one GraphQL query, instead of one REST
+    call per course.
+
+    Returns:
+        {course_id: [...]} in the same shape as _course_assignments (courses
+        whose assignments didn't fit in one page are left out), or None when
+        GraphQL failed and the caller should use REST.
+    """
+    global _graphql_retry_at
+    cache = get_cache_backend()
+    cache_key = _user_cache_key("graphql_assignments", base_url, token)
+    cached = None if refresh else cache.get(cache_key)
+    if cached is not None:
+        return cached
+    if time.monotonic() < _graphql_retry_at:
+        return None
+
+    try:
+        response = _http.post(f"{base_url}/api/graphql", headers={"Authorization": f"Bearer {token}"},
+                              json={"query": _graphql_query([course["id"] for course in courses]),
+                                    "variables": {"assignments": GRAPHQL_ASSIGNMENTS_PER_COURSE}},
+                              timeout=20)
+        response.raise_for_status()
+        length = response.headers.get("Content-Length")
+        payload = parse_json("canvas:graphql", response.content, int(length) if length and length.isdigit() else None)
+        if payload.get("errors"):
+            raise ValueError(f"GraphQL errors: {payload['errors']}")
+        data = payload["data"]
+    except Exception as e:
+        logger.warning(f"Canvas GraphQL request failed, using REST for {GRAPHQL_RETRY_SECONDS}s: {e}")
+        _graphql_retry_at = time.monotonic() + GRAPHQL_RETRY_SECONDS
+        return None
+
+    assignments: Dict[str, List[Dict[str, Any]]] = {}
+    for course in courses:
+        connection = (data.get(f"c{int(course['id'])}") or {}).get("assignmentsConnection")
+        if connection is None or (connection.get("pageInfo") or {}).get("hasNextPage"):
+            continue
+        items = []
+        for a in connection.get("nodes") or []:
+            if not a.get("dueAt"):
+                continue
+            submissions = (a.get("submissionsConnection") or {}).get("nodes") or []
+            items.append({"name": a.get("name") or 'Untitled', "course": course["name"], "due_at": a["dueAt"],
+                          "submitted": any(s.get("submittedAt") for s in submissions)})
+        items.sort(key=_due_key)
+        assignments[str(course["id"])] = items
+
+    cache.set(cache_key, assignments, ASSIGNMENTS_CACHE_TTL)
+    logger.info(f"Fetched the assignments of {len(assignments)} courses in one GraphQL query.")
+    return assignments
+
+
+# --- Current Term Courses ---
+
+def fetch_current_term_courses(refresh: bool = False) -> Dict[str, Any]:
+    """
+    Fetches active courses and keeps the ones in the most recent term.
+
+    Returns:
+        {'term_name': str, 'courses': [{'id', 'name', 'course_code'}, ...]}
+        or a dictionary with an 'error' string.
+    """
+    credentials = _canvas_credentials()
+    if credentials is None:
+        return {"error": "Canvas API connection is not configured."}
+    base_url, token = credentials
+
+    cache = get_cache_backend()
+    cache_key = _user_cache_key("term_courses", base_url, token)
+    cached = None if refresh else cache.get(cache_key)
+    if cached is not None:
+        logger.info("Returning current term courses from cache.")
+        return cached
+
+    params = {
+        "include[]": "term",
+        "enrollment_state": "active",
+        "per_page": PER_PAGE
+    }
+    try:
+        all_courses = _get_paginated(f"{base_url}/api/v1/courses", token, params, COURSE_FIELDS, "canvas:courses")
     except Exception as e:
-        logger.exception("An unexpected error occurred during course fetching.")
-        return {"error": "An unexpected error occurred while fetching courses."}
+        return _request_error("courses", e)
+    logger.info(f"Successfully fetched {len(all_courses)} active course enrollment(s) from Canvas.")
 
-    # 4. Filter by Term
+    if not all_courses:
+        return {"term_name": None, "courses": []}
+
+    # Filter by Term
     most_recent_term_id = _find_most_recent_term_id(all_courses)
 
     if most_recent_term_id is None:
@@ -157,20 +348,185 @@ def fetch_current_courses() -> Dict[str, Any]:
                   break  # Found the name, no need to check further
     logger.info(f"Using term name: '{most_recent_term_name}' for ID {most_recent_term_id}")
 
-    current_term_courses = [
-        course for course in all_courses
-        if course.get('enrollment_term_id') == most_recent_term_id
-    ]
+    result = {
+        "term_name": most_recent_term_name,
+        "courses": [
+            {"id": course.get('id'), "name": course.get('name', 'Unnamed Course'),
+             "course_code": course.get('course_code', 'No Code')}
+            for course in all_courses if course.get('enrollment_term_id') == most_recent_term_id
+        ],
+    }
+    cache.set(cache_key, result, COURSES_CACHE_TTL)
+    return result
 
-    if not current_term_courses:
-        return {"courses_list": f"No active courses found for the most recent term ('{most_recent_term_name}')."}
 
-    # 5. Format Output
-    output_lines = [f"Here are your current courses for {most_recent_term_name}:"]
-    for course in current_term_courses:
-        name = course.get('name', 'Unnamed Course')
-        code = course.get('course_code', 'No Code')
-        output_lines.append(f"- {name} ({code})")
+# --- Main Function to Fetch Courses ---
 
-    logger.info(f"Formatted {len(current_term_courses)} courses for the current term.")
-    return {"courses_list": "\n".join(output_lines)}
\ No newline at end of file
+def fetch_current_courses(refresh: bool = False) -> Dict[str, Any]:
+    """
+    Fetches active courses for the user associated with the API token,
+    filters them for the most recent term, and formats the result.
+
+    Args:
+        refresh: Skip the cached copy and refetch, used by cache_warmer.py.
+
+    Returns:
+        A dictionary containing either a 'courses_list' string or an 'error' string.
+    """
+    logger.info("Attempting to fetch current Canvas courses...")
+
+    term = fetch_current_term_courses(refresh=refresh)
+    if "error" in term:
+        return term
+    if term["term_name"] is None:
+        return {"courses_list": "You do not seem to be enrolled in any active courses."}
+    if not term["courses"]:
+        return {"courses_list": f"No active courses found for the most recent term ('{term['term_name']}')."}
+
+    output_lines = [f"Here are your current courses for {term['term_name']}:"]
+    for course in term["courses"]:
+        output_lines.append(f"- {course['name']} ({course['course_code']})")
+
+    logger.info(f"Formatted {len(term['courses'])} courses for the current term.")
+    return {"courses_list": "\n".join(output_lines)}
+
+
+# --- Upcoming Assignments ---
+
+def _planner_items(base_url: str, token: str, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    """Everything due in [start, end) across all courses, from the planner in one paginated call."""
+    params = {"start_date": start.isoformat(), "end_date": end.isoformat(), "per_page": PER_PAGE}
+    items = []
+    for item in _get_paginated(f"{base_url}/api/v1/planner/items", token, params, PLANNER_FIELDS, "canvas:planner"):
+        plannable = item.get('plannable') or {}
+        due_at = plannable.get('due_at') or item.get('plannable_date')
+        if item.get('plannable_type') in PLANNER_SKIP_TYPES or not due_at:
+            continue
+        submissions = item.get('submissions')
+        items.append({
+            "name": plannable.get('title') or plannable.get('name') or 'Untitled',
+            "course": item.get('context_name') or '',
+            "due_at": due_at,
+            "submitted": bool(submissions.get('submitted')) if isinstance(submissions, dict) else False,
+        })
+    items.sort(key=_due_key)
+    return items
+
+
+def _course_assignments(base_url: str, token: str, course: Dict[str, Any], refresh: bool) -> List[Dict[str, Any]]:
+    """A course's upcoming assignments sorted by due date, cached per course."""
+    cache = get_cache_backend()
+    cache_key = _user_cache_key(f"assignments:{course['id']}", base_url, token)
+    cached = None if refresh else cache.get(cache_key)
+    if cached is not None:
+        return cached
+    # "future" is everything not yet due, the caller cuts it at its own window ("upcoming" stops about a
+    # week out, days goes up to MAX_ASSIGNMENT_DAYS). Descriptions (HTML) and rubrics are never used
+    params = {"bucket": "future", "order_by": "due_at", "per_page": PER_PAGE,
+              "include[]": "submission", "exclude_response_fields[]": ["description", "rubric"]}
+    assignments = []
+    url = f"{base_url}/api/v1/courses/{course['id']}/assignments"
+    for assignment in _get_paginated(url, token, params, ASSIGNMENT_FIELDS, "canvas:assignments"):
+        if not assignment.get('due_at'):
+            continue
+        submission = assignment.get('submission')
+        assignments.append({
+            "name": assignment.get('name', 'Untitled'),
+            "course": course['name'],
+            "due_at": assignment['due_at'],
+            "submitted": bool(submission.get('submitted_at')) if isinstance(submission, dict) else False,
+        })
+    assignments.sort(key=_due_key)
+    cache.set(cache_key, assignments, ASSIGNMENTS_CACHE_TTL)
+    return assignments
+
+
+def _fan_out_assignments(base_url: str, token: str, courses: List[Dict[str, Any]],
+                         refresh: bool) -> Tuple[List[List[Dict[str, Any]]], List[str]]:
+    """Fetches every course's assignments at once, at most MAX_CONCURRENT_REQUESTS in flight."""
+    per_course, failed = [], []
+    if not courses:
+        return per_course, failed
+    with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_REQUESTS, len(courses)),
+                            thread_name_prefix="canvas") as executor:
+        futures = {executor.submit(_course_assignments, base_url, token, course, refresh): course
+                   for course in courses}
+        for future in as_completed(futures):
+            try:
+                per_course.append(future.result())
+            except Exception as e:
+                course = futures[future]
+                logger.warning(f"Could not fetch assignments for {course['name']}: {e}")
+                failed.append(course['name'])
+    return per_course, failed
+
+
+def fetch_upcoming_assignments(days: int = 7, refresh: bool = False) -> Dict[str, Any]:
+    """
+    Lists assignments due in the next `days` days, soonest first. Uses the
+    planner endpoint (one paginated call) when the Canvas instance has it,
+    otherwise fetches each current course's assignments concurrently and
+    merges the per-course lists, which are already sorted, with a heap.
+
+    Returns:
+        A dictionary containing either an 'assignments_list' string or an 'error' string.
+    """
+    logger.info(f"Attempting to fetch Canvas assignments due in the next {days} days...")
+    credentials = _canvas_credentials()
+    if credentials is None:
+        return {"error": "Canvas API connection is not configured."}
+    base_url, token = credentials
+
+    days = max(1, min(int(days), MAX_ASSIGNMENT_DAYS))
+    now = datetime.now(timezone.utc)
+    end = now + timedelta(days=days)
+
+    upcoming: Optional[List[Dict[str, Any]]] = None
+    failed: List[str] = []
+    if USE_PLANNER:
+        cache = get_cache_backend()
+        cache_key = _user_cache_key(f"planner:{days}", base_url, token)
+        upcoming = None if refresh else cache.get(cache_key)
+        if upcoming is None:
+            try:
+                upcoming = _planner_items(base_url, token, now, end)
+                cache.set(cache_key, upcoming, ASSIGNMENTS_CACHE_TTL)
+            except Exception as e:
+                # Older or locked-down instances don't expose the planner, fall back to per-course calls
+                logger.info(f"Planner unavailable, fetching assignments per course: {e}")
+
+    if upcoming is None:
+        term = fetch_current_term_courses(refresh=refresh)
+        if "error" in term:
+            return term
+        courses, per_course = term["courses"], []
+        batch = _graphql_assignments(base_url, token, courses, refresh) if CANVAS_TRANSPORT == "graphql" else None
+        if batch is not None:
+            # Courses the query couldn't fit all assignments for are fetched over REST below
+            per_course = [batch[str(c["id"])] for c in courses if str(c["id"]) in batch]
+            courses = [c for c in courses if str(c["id"]) not in batch]
+        fetched, failed = _fan_out_assignments(base_url, token, courses, refresh)
+        per_course += fetched
+        if failed and not per_course:
+            return {"error": "Could not fetch assignments from Canvas."}
+        upcoming = list(heapq.merge(*per_course, key=_due_key))
+
+    output_lines = []
+    for assignment in upcoming:
+        due = _parse_time(assignment["due_at"])
+        if due is None or due < now:
+            continue
+        if due >= end:
+            break
+        status = " (submitted)" if assignment["submitted"] else ""
+        output_lines.append(f"- {due.astimezone().strftime('%a %b %d %I:%M %p')}: "
+                            f"{assignment['name']} [{assignment['course']}]{status}")
+
+    if not output_lines:
+        result = {"assignments_list": f"Nothing is due in the next {days} days."}
+    else:
+        result = {"assignments_list": "\n".join([f"Due in the next {days} days:"] + output_lines)}
+    if failed:
+        result["assignments_list"] += f"\n(Could not load assignments for: {', '.join(failed)})"
+    logger.info(f"Found {len(output_lines)} assignment(s) due in the next {days} days.")
+    return result
@@ -3,9 +3,18 @@ import json
 from dotenv import load_dotenv
 import os
 import time
-from perplexity_integration import CMUPerplexitySearch  # Changed from relative import
+import logging
+from perplexity_integration import CMUPerplexitySearch, build_speculative_search  # Changed from relative import
 import requests
+import uuid
 from datetime import datetime
+from intent_router import build_default_router
+from tool_registry import TOOL_REGISTRY
+from result_compactor import ResultStore, CompactionLedger
+from session_memory import MessageStore, new_functions_called, memory_footprint, MAX_FUNCTIONS_CALLED, MAX_RESULT_CHARS
+from structured_logging import start_turn
+from usage_accounting import UsageLedger, BUDGET_HISTORY_MESSAGES
+from model_router import get_model_router, tool_output_chars, SYNTHESIS_SMALL_MAX_CHARS
 
 
 #from courses import get_courses, get_course_by_id, get_fces, get_fces_by_id, get_schedules
@@ -13,7 +22,16 @@ from datetime import datetime
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 class CMUGPTAssistant:
+    # Tools from tool_registry.py that this assistant exposes to the model
+    TOOL_NAMES = [
+        "general_purpose_knowledge_search",
+        "show_cmueats_website",
+        "find_open_dining",
+    ]
+
     def __init__(self):
         # Set up OpenAI client with timeout configuration
         self.client = OpenAI(
@@ -22,103 +40,126 @@ class CMUGPTAssistant:
             max_retries=3  # Allow 3 retries
         )
         self.show_eats = False
+        # Set by the session manager when it owns this assistant, tags the turn's log records
+        self.session_id = None
+        # Why the last turn answered with an apology instead of an answer, None when it didn't
+        self.last_turn_error = None
         
+        self.registry = TOOL_REGISTRY
+
         # Define the function definitions (tools) for the model
         self.tools = self.get_tools()
         
         # Initialize conversation messages
-        self.messages = [
+        self.messages = MessageStore([
             {
                 "role": "system",
                 "content": "You are CMUGPT, an assistant knowledgeable about Carnegie Mellon University in Pittsburgh, Pennsylvania. Use the supplied tools to assist the user."
             },
             {
                 "role": "system",
-                "content": "If someone inquires about dining direct them to visit https://cmueats.com and always call the function to display it to the UI, while if someone asks about courses at CMU direct them ot visit https://cmucourses.com, while if someone asks about directions direct them to visit https://cmumaps.com, while if someone asks about ScottyLabs direct them to visit https://ScottyLabs.org"
+                "content": "If someone asks which dining locations are open, or about the hours of one, call find_open_dining and answer from its result; otherwise if someone inquires about dining direct them to visit https://cmueats.com and always call the function to display it to the UI, while if someone asks about courses at CMU direct them ot visit https://cmucourses.com, while if someone asks about directions direct them to visit https://cmumaps.com, while if someone asks about ScottyLabs direct them to visit https://ScottyLabs.org"
             },
             #{
             #    "role": "system",
             #    "content": "Write concise, relevant responses, with the skilled style of a Pultizer Prize-winning author.  Do not use course search function, all others allowed."
             #}
-        ]
+        ])
         
         # Keep track of functions called
-        self.functions_called = []
+        self.functions_called = new_functions_called()
+        # Full tool results are kept out of self.messages, the sidebar looks them up by reference
+        self.result_store = ResultStore(MAX_FUNCTIONS_CALLED, MAX_RESULT_CHARS)
+        self.compaction = CompactionLedger()
+        # Tokens and estimated cost of every model call, see usage_accounting.py
+        self.usage = UsageLedger()
+        # Picks the model per call from recent latency and errors, shared by every session
+        self.router = get_model_router()
 
         
         
-        self.perplexity_search = CMUPerplexitySearch()
+        self.perplexity_search = CMUPerplexitySearch(usage=self.usage)
+        # Optionally start Perplexity alongside the first OpenAI call (CMUGPT_SPECULATIVE_SEARCH=1)
+        self.speculative_search = build_speculative_search(self.perplexity_search)
+
+        # Obvious tool intents are routed locally to skip the tool-selection call
+        self.intent_router = build_default_router(self.TOOL_NAMES)
     
     def get_tools(self):
-        tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "general_purpose_knowledge_search",
-                    "description": "Search for general knowledge about Carnegie Mellon University. Today's date is "  + datetime.now().strftime("%B %d, %Y"),
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "search_query": {
-                                "type": "string",
-                                "description": "The query to search for general knowledge."
-                            }
-                        },
-                        "required": ["search_query"],
-                        "additionalProperties": False
-                    },
-                    "strict": True  # Enabling Structured Outputs
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "show_cmueats_website",
-                    "description": "Display cmueats website to the UI frontend",
-                        "required": [""],
-                        "additionalProperties": False
-                    },
-                    "strict": True  # Enabling Structured Outputs
-            },
-        ]
-        return tools
+        # Schemas, implementations and timeout policy are declared once in tool_registry.py
+        return self.registry.openai_tools(self.TOOL_NAMES)
+
+    def complete(self, call_type, **kwargs):
+        # The model comes from the router (model_router.py). Past the session's budget it's the cheaper
+        # one, and an answer that only restates short tool results may go to the small model
+        small_ok = call_type == "synthesis" and tool_output_chars(kwargs["messages"]) <= SYNTHESIS_SMALL_MAX_CHARS
+        return self.router.complete(self.client, call_type, over_budget=self.usage.over_budget,
+                                    small_ok=small_ok, **kwargs)
 
     def process_user_input(self, user_input):
+        start_turn(self.session_id)
+        self.usage.start_turn()
+        self.last_turn_error = None
         self.messages.append({"role": "user", "content": user_input})
+        self.compaction.start_turn()
+        if self.usage.over_budget:
+            # Over budget the history is kept short too, it's resent on every call
+            dropped = self.messages.compact(BUDGET_HISTORY_MESSAGES)
+            if dropped:
+                logger.info(f"Session over its usage budget, dropped {dropped} older messages.")
         max_retries = 3
         retry_delay = 1
 
+        route = self.intent_router.route(user_input) if self.intent_router else None
+        if route is not None:
+            self.execute_routed_intent(route)
+            if route.template:
+                # UI-only tools don't need the model to say anything beyond the template
+                self.messages.append({"role": "assistant", "content": route.template})
+                return route.template
+
+        if route is None and self.speculative_search:
+            self.speculative_search.start(user_input)
+
         for attempt in range(max_retries):
             try:
-                response = self.client.chat.completions.create(
-                    model='gpt-4o-mini',  # Fixed model name
-                    messages=self.messages,
+                if route is not None:
+                    # The tool already ran locally, go straight to the final response
+                    response, decision = self.complete(
+                        "synthesis",
+                        messages=self.messages.to_openai(),
+                    )
+                    self.usage.record_openai("synthesis", response, route=decision)
+                    assistant_message = response.choices[0].message
+                    self.messages.append(assistant_message)
+                    return assistant_message.content
+
+                response, decision = self.complete(
+                    "tool_selection",
+                    messages=self.messages.to_openai(),
                     tools=self.tools,
                 )
+                self.usage.record_openai("tool_selection", response, route=decision)
 
                 assistant_message = response.choices[0].message
                 
                 if assistant_message.tool_calls:
                     # The model wants to call functions
                     tool_calls = assistant_message.tool_calls
-                    function_results = []
+                    calls = [(tool_call.function.name, json.loads(tool_call.function.arguments or "{}"))
+                             for tool_call in tool_calls]
+                    # Parallel-safe tools requested in the same turn run concurrently
+                    function_results = self.registry.dispatch_many(self, calls)
 
-                    for tool_call in tool_calls:
-                        function_name = tool_call.function.name
-                        arguments = json.loads(tool_call.function.arguments)
-                        result = self.execute_function(function_name, arguments)
+                    for tool_call, (function_name, arguments), result in zip(tool_calls, calls, function_results):
 
                         # Keep track of functions called
-                        self.functions_called.append({
-                            'function_name': function_name,
-                            'arguments': arguments,
-                            'result': result
-                        })
+                        content = self.record_tool_result(function_name, arguments, result)
 
                         # Prepare the function result message
                         function_result_message = {
                             "role": "tool",
-                            "content": json.dumps(result),
+                            "content": content,
                             "tool_call_id": tool_call.id
                         }
 
@@ -129,12 +170,16 @@ class CMUGPTAssistant:
                         })
                         self.messages.append(function_result_message)
 
+                    if self.speculative_search:
+                        self.speculative_search.finish_turn()
+
                     # After providing the function results, call the model again to get the final response
-                    response = self.client.chat.completions.create(
-                        model='gpt-4o-mini',
-                        messages=self.messages,
+                    response, decision = self.complete(
+                        "synthesis",
+                        messages=self.messages.to_openai(),
                         #tools=self.tools,
                     )
+                    self.usage.record_openai("synthesis", response, route=decision)
 
                     
 
@@ -143,46 +188,95 @@ class CMUGPTAssistant:
 
                     return assistant_message.content
                 else:
+                    if self.speculative_search:
+                        self.speculative_search.finish_turn()
                     self.messages.append(assistant_message)
                     return assistant_message.content
 
             except APITimeoutError as e:
+                logger.warning(f"OpenAI call timed out (attempt {attempt + 1} of {max_retries}).")
                 if attempt == max_retries - 1:
+                    self.last_turn_error = f"{type(e).__name__}: {e}"
                     return f"I apologize, but I'm having trouble connecting. Please try again in a moment. (Error: Connection timeout)"
                 time.sleep(retry_delay)
                 retry_delay *= 2
                 
             except APIError as e:
+                logger.warning(f"OpenAI call failed (attempt {attempt + 1} of {max_retries}): {e}")
                 if attempt == max_retries - 1:
+                    self.last_turn_error = f"{type(e).__name__}: {e}"
                     return f"I apologize, but there was an error processing your request. Please try again. (Error: {str(e)})"
                 time.sleep(retry_delay)
                 retry_delay *= 2
                 
             except Exception as e:
+                logger.exception("Turn failed with an unexpected error.")
+                self.last_turn_error = f"{type(e).__name__}: {e}"
                 return f"I apologize, but an unexpected error occurred. Please try again. (Error: {str(e)})"
 
+        self.last_turn_error = f"No answer after {max_retries} attempts"
         return "I apologize, but I was unable to process your request after multiple attempts. Please try again later."
 
+    def record_tool_result(self, function_name, arguments, result):
+        # Keep the full result out-of-band and only send the compacted version to the model
+        result_ref = self.result_store.put(result)
+        content = self.registry.compact(function_name, result)
+        tokens_saved = self.compaction.record(function_name, json.dumps(result), content)
+        self.functions_called.append({
+            'function_name': function_name,
+            'arguments': arguments,
+            'result_ref': result_ref,
+            'tokens_saved': tokens_saved
+        })
+        return content
+
+    def execute_routed_intent(self, route):
+        # Record the locally routed call as if the model had requested it
+        tool_call_id = f"call_local_{uuid.uuid4().hex[:20]}"
+        result = self.execute_function(route.tool_name, route.arguments)
+        content = self.record_tool_result(route.tool_name, route.arguments, result)
+
+        self.messages.append({
+            "role": "assistant",
+            "tool_calls": [{
+                "id": tool_call_id,
+                "type": "function",
+                "function": {"name": route.tool_name, "arguments": json.dumps(route.arguments)}
+            }]
+        })
+        self.messages.append({
+            "role": "tool",
+            "content": content,
+            "tool_call_id": tool_call_id
+        })
+        return result
+
     # Function to execute the functions
     def execute_function(self, function_name, arguments):
-        if function_name == 'general_purpose_knowledge_search':
-            return self.general_purpose_knowledge_search(arguments.get('search_query'))
-        #Add elif statements here
-        elif function_name == 'show_cmueats_website':
-            return self.show_cmu_eats()
-        else:
-            return {"error": "Function not found."}
+        # Dictionary lookup in the shared tool registry, which also applies the tool's timeout
+        return self.registry.dispatch(self, function_name, arguments)
 
     # Define the functions (simulate the functionality)
     def general_purpose_knowledge_search(self, search_query):
         # Use Perplexity API for general knowledge searches
+        if self.speculative_search:
+            # The search may already be running from the raw user text
+            result = self.speculative_search.claim(search_query)
+            if result is not None:
+                return result
         return self.perplexity_search.search(search_query)
     def show_cmu_eats(self):
-        print("show cmu eats function called")
+        logger.debug("Showing CMU Eats on the frontend.")
         self.show_eats = True
         return "Displaying CMUEATS.com website on frontend."
 
     def get_functions_called(self):
-        return self.functions_called
+        return list(self.functions_called)
+
+    def memory_footprint(self):
+        return memory_footprint(self.messages, self.functions_called, self.result_store)
+
+    def get_function_result(self, result_ref):
+        return self.result_store.get(result_ref)
 
     
\ No newline at end of file
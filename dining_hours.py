@@ -0,0 +1,584 @@
+# dining_hours.py
+
+"""
+Answers "what's open now" and "what's open at 9pm near Gates" from a local
+JSON snapshot of campus dining hours, without a web search. The opening hours
+of every location are laid out over the minutes of the week (Monday 00:00 is
+minute 0). The week is cut at every opening and closing time, and each piece
+stores which locations are open during it. A lookup is one bisect and takes
+microseconds.
+
+The snapshot is written from the CMU Eats API (CMUGPT_DINING_API_URL) by
+
+    python dining_hours.py --refresh
+
+and by every running process, from a side thread, once the file is older
+than CMUGPT_DINING_REFRESH_SECONDS (hourly by default, 0 turns it off). A
+running process checks the file's mtime every CMUGPT_DINING_RELOAD_SECONDS
+and loads the new version without a restart. Locations whose entries didn't
+change are reused, only new or edited ones are parsed again. Snapshot format:
+
+    {"generated_at": "2026-10-19T06:00:00-04:00",
+     "locations": [{"id": "schatz", "name": "Schatz Dining Room", "building": "Cohon University Center",
+                    "lat": 40.4443, "lon": -79.9420,
+                    "hours": {"mon": ["07:30-10:30", "11:00-20:00"], "fri": ["22:00-02:00"]},
+                    "closed_dates": ["2026-11-26"]}]}
+
+A closing time at or before the opening time is on the next day.
+closed_dates can be added by hand for holidays the API doesn't know about.
+
+The snapshot isn't trusted for times more than CMUGPT_DINING_MAX_AGE_DAYS
+after it was generated, since hours change over breaks. Then, or when there
+is no snapshot, or when a location the user named isn't in it, lookup()
+returns None and the tool falls back to a Perplexity search.
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import bisect
+import logging
+import argparse
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
+from metrics import DINING_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DINING_HOURS_PATH = os.getenv("CMUGPT_DINING_HOURS", os.path.join(DATA_DIR, "dining_hours.json"))
+CAMPUS_BUILDINGS_PATH = os.path.join(DATA_DIR, "campus_buildings.json")
+DINING_API_URL = os.getenv("CMUGPT_DINING_API_URL", "https://dining.apis.scottylabs.org/locations")
+CAMPUS_TIMEZONE = ZoneInfo(os.getenv("CMUGPT_CAMPUS_TIMEZONE", "America/New_York"))
+DINING_MAX_AGE_DAYS = float(os.getenv("CMUGPT_DINING_MAX_AGE_DAYS", "7"))
+# How often a lookup may stat the snapshot file to see whether it changed
+DINING_RELOAD_SECONDS = float(os.getenv("CMUGPT_DINING_RELOAD_SECONDS", "5"))
+# A running process fetches new hours once the snapshot is this old, 0 leaves it to --refresh
+DINING_REFRESH_SECONDS = float(os.getenv("CMUGPT_DINING_REFRESH_SECONDS", "3600"))
+# Wait before trying again after a failed fetch
+DINING_REFRESH_RETRY_SECONDS = 300
+# Closed locations opening within this many minutes are listed as opening soon
+OPENING_SOON_MINUTES = 60
+# Open locations listed per answer, nearest (or alphabetically) first
+MAX_OPEN_RESULTS = 12
+# Straight-line distance, slower than a real walk between buildings
+WALKING_METERS_PER_MINUTE = 70
+DAY_MINUTES = 24 * 60
+WEEK_MINUTES = 7 * DAY_MINUTES
+DAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+# '21:00', '2100', '9', '9pm', '9:30 p.m.'
+TIME_OF_DAY_PATTERN = re.compile(r"(\d{1,2})(?::?(\d{2}))?(?::\d{2})?\s*(?:([ap])\.?\s*m?\.?)?")
+
+# (location index, start, end) in minutes of the week. end can be past WEEK_MINUTES for hours over Sunday midnight
+Opening = Tuple[int, int, int]
+
+
+def _minutes(text: str) -> int:
+    hours, _, minutes = text.strip().partition(":")
+    value = int(hours) * 60 + int(minutes or 0)
+    if not 0 <= value <= DAY_MINUTES:
+        raise ValueError(f"Invalid time of day '{text}'")
+    return value
+
+
+def _clock(minutes: int) -> str:
+    return f"{minutes // 60 % 24:02d}:{minutes % 60:02d}"
+
+
+def _normalize(text: str) -> str:
+    return " ".join("".join(c if c.isalnum() else " " for c in text.lower()).split())
+
+
+def _distance_m(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    # Equirectangular, plenty for distances across campus
+    lat = math.radians((a[0] + b[0]) / 2)
+    dx = math.radians(b[1] - a[1]) * math.cos(lat)
+    dy = math.radians(b[0] - a[0])
+    return 6371000 * math.hypot(dx, dy)
+
+
+@dataclass(frozen=True)
+class DiningLocation:
+    id: str
+    name: str
+    building: str
+    coordinates: Optional[Tuple[float, float]]
+    # Sorted, merged (start, end) minutes of the week
+    intervals: Tuple[Tuple[int, int], ...]
+    closed_dates: FrozenSet[str]
+
+    @classmethod
+    def from_entry(cls, entry: Dict[str, Any]) -> "DiningLocation":
+        intervals = []
+        for day, ranges in (entry.get("hours") or {}).items():
+            offset = DAYS.index(day[:3].lower()) * DAY_MINUTES
+            for text in ranges:
+                opens, _, closes = text.partition("-")
+                start, end = _minutes(opens), _minutes(closes)
+                if end <= start:
+                    end += DAY_MINUTES
+                intervals.append((offset + start, offset + end))
+        intervals.sort()
+        merged: List[Tuple[int, int]] = []
+        for start, end in intervals:
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        # Open through Sunday midnight into Monday morning is one opening
+        if len(merged) > 1 and merged[-1][1] >= WEEK_MINUTES + merged[0][0]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], WEEK_MINUTES + merged[0][1]))
+            merged.pop(0)
+        lat, lon = entry.get("lat"), entry.get("lon")
+        name = entry["name"]
+        return cls(
+            id=str(entry.get("id") or name),
+            name=name,
+            building=entry.get("building") or "",
+            coordinates=(float(lat), float(lon)) if lat is not None and lon is not None else None,
+            intervals=tuple(merged),
+            closed_dates=frozenset(entry.get("closed_dates") or ()),
+        )
+
+
+class HoursIndex:
+    """Which locations are open at each minute of the week, built once per snapshot."""
+
+    def __init__(self, locations: List[DiningLocation]):
+        self.locations = locations
+        starts_at: Dict[int, List[Opening]] = {}
+        ends_at: Dict[int, List[Opening]] = {}
+        for index, location in enumerate(locations):
+            for start, end in location.intervals:
+                opening = (index, start, end)
+                # Hours over Sunday midnight are also open from minute 0 of the week
+                pieces = [(start, min(end, WEEK_MINUTES))]
+                if end > WEEK_MINUTES:
+                    pieces.append((0, end - WEEK_MINUTES))
+                for piece_start, piece_end in pieces:
+                    starts_at.setdefault(piece_start, []).append(opening)
+                    ends_at.setdefault(piece_end, []).append(opening)
+        self.boundaries: List[int] = sorted({0, *starts_at, *ends_at} - {WEEK_MINUTES})
+        self.segments: List[Tuple[Opening, ...]] = []
+        open_now: Dict[Opening, None] = {}
+        for boundary in self.boundaries:
+            for opening in ends_at.get(boundary, ()):
+                open_now.pop(opening, None)
+            for opening in starts_at.get(boundary, ()):
+                open_now[opening] = None
+            self.segments.append(tuple(open_now))
+
+    def open_at(self, minute: int) -> Tuple[Opening, ...]:
+        return self.segments[bisect.bisect_right(self.boundaries, minute % WEEK_MINUTES) - 1]
+
+    def next_opening(self, index: int, minute: int) -> Optional[int]:
+        """Minutes from `minute` until the location next opens, None if it never does."""
+        intervals = self.locations[index].intervals
+        if not intervals:
+            return None
+        minute %= WEEK_MINUTES
+        i = bisect.bisect_right(intervals, (minute, WEEK_MINUTES * 2))
+        start = intervals[i][0] if i < len(intervals) else intervals[0][0] + WEEK_MINUTES
+        return start - minute
+
+
+def _time_of_day(text: str) -> int:
+    """Minutes after midnight for '21:00', '9pm', '9:30 p.m.', 'noon' or 'midnight'."""
+    cleaned = text.strip().lower()
+    if cleaned == "noon":
+        return 12 * 60
+    if cleaned == "midnight":
+        return 0
+    match = TIME_OF_DAY_PATTERN.fullmatch(cleaned)
+    if match is None:
+        raise ValueError(f"Invalid time of day '{text}'")
+    hours, minutes, half = int(match[1]), int(match[2] or 0), match[3]
+    if half:
+        if not 1 <= hours <= 12:
+            raise ValueError(f"Invalid time of day '{text}'")
+        hours = hours % 12 + (12 if half == "p" else 0)
+    if minutes > 59 or hours * 60 + minutes > DAY_MINUTES:
+        raise ValueError(f"Invalid time of day '{text}'")
+    return hours * 60 + minutes
+
+
+def _date(text: str):
+    for layout in ("%m/%d/%Y", "%m/%d/%y"):
+        try:
+            return datetime.strptime(text.strip(), layout).date()
+        except ValueError:
+            pass
+    # '2026-10-19', or a whole ISO timestamp of which only the day is used
+    return datetime.fromisoformat(text.strip()).date()
+
+
+def parse_when(date: Optional[str] = None, time_of_day: Optional[str] = None,
+               now: Optional[datetime] = None) -> datetime:
+    """
+    Campus time for a tool's date ('MM/DD/YYYY' or ISO) and time ('HH:MM' or
+    '9pm'), each defaulting to now. ValueError for anything else.
+    """
+    when = now or datetime.now(CAMPUS_TIMEZONE)
+    if date:
+        day = _date(date)
+        when = when.replace(year=day.year, month=day.month, day=day.day)
+    if time_of_day:
+        minutes = _time_of_day(time_of_day) % DAY_MINUTES
+        when = when.replace(hour=minutes // 60, minute=minutes % 60, second=0, microsecond=0)
+    return when
+
+
+class _Snapshot:
+    """One loaded version of the snapshot file. Replaced whole, so lookups never see a half-loaded one."""
+
+    def __init__(self, index: HoursIndex, generated_at: Optional[datetime], stamp: Tuple[float, int]):
+        self.index = index
+        self.generated_at = generated_at
+        self.stamp = stamp
+        self.by_name = {_normalize(location.name): i for i, location in enumerate(index.locations)}
+        self._walks: Dict[str, List[Optional[int]]] = {}
+
+    def walk_minutes(self, place: str, coordinates: Tuple[float, float]) -> List[Optional[int]]:
+        """Minutes from place to each location, computed once per place and snapshot."""
+        walks = self._walks.get(place)
+        if walks is None:
+            walks = self._walks[place] = [
+                max(1, round(_distance_m(coordinates, location.coordinates) / WALKING_METERS_PER_MINUTE))
+                if location.coordinates else None for location in self.index.locations]
+        return walks
+
+
+class DiningHours:
+    """The snapshot file, loaded on first use and again whenever it changes."""
+
+    def __init__(self, path: str = DINING_HOURS_PATH, buildings_path: str = CAMPUS_BUILDINGS_PATH,
+                 max_age_days: float = DINING_MAX_AGE_DAYS, reload_seconds: float = DINING_RELOAD_SECONDS):
+        self.path = path
+        self.buildings_path = buildings_path
+        self.max_age = timedelta(days=max_age_days) if math.isfinite(max_age_days) else None
+        self.reload_seconds = reload_seconds
+        self._snapshot: Optional[_Snapshot] = None
+        self._checked: Optional[float] = None
+        # Parsed locations by their JSON entry, so a reload only parses what changed
+        self._parsed: Dict[str, DiningLocation] = {}
+        self._buildings: Optional[Dict[str, Tuple[str, Tuple[float, float]]]] = None
+        self._lock = threading.Lock()
+        self._counter_lock = threading.Lock()
+        self.counters = {"loads": 0, "load_errors": 0, "lookups": 0, "fallbacks": 0,
+                         "refreshes": 0, "refresh_errors": 0}
+
+    # --- Loading ---
+
+    def _current(self) -> Optional[_Snapshot]:
+        now = time.monotonic()
+        if self._checked is not None and now - self._checked < self.reload_seconds:
+            return self._snapshot
+        # One thread checks the file, the others keep answering from the loaded version (or wait for the first)
+        if self._lock.acquire(blocking=self._snapshot is None):
+            try:
+                self._checked = now
+                self._reload_if_changed()
+            finally:
+                self._lock.release()
+        return self._snapshot
+
+    def _reload_if_changed(self) -> None:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            if self._snapshot is not None:
+                logger.warning(f"Dining hours snapshot {self.path} was removed, keeping the loaded version.")
+            return
+        stamp = (stat.st_mtime, stat.st_size)
+        if self._snapshot is not None and self._snapshot.stamp == stamp:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            parsed: Dict[str, DiningLocation] = {}
+            reused = 0
+            for entry in data.get("locations", []):
+                key = json.dumps(entry, sort_keys=True)
+                location = self._parsed.get(key)
+                if location is None:
+                    location = DiningLocation.from_entry(entry)
+                else:
+                    reused += 1
+                parsed[key] = location
+            generated_at = data.get("generated_at")
+            generated_at = datetime.fromisoformat(generated_at) if generated_at else None
+            if generated_at is not None and generated_at.tzinfo is None:
+                generated_at = generated_at.replace(tzinfo=CAMPUS_TIMEZONE)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # A half-written or broken file doesn't take the loaded hours down with it
+            self.counters["load_errors"] += 1
+            logger.warning(f"Could not load dining hours from {self.path}: {e}")
+            return
+        self._parsed = parsed
+        self._snapshot = _Snapshot(HoursIndex(list(parsed.values())), generated_at, stamp)
+        self.counters["loads"] += 1
+        logger.info(f"Loaded {len(parsed)} dining locations from {self.path} ({reused} unchanged).")
+
+    def _building_coordinates(self) -> Dict[str, Tuple[str, Tuple[float, float]]]:
+        """Normalized building names and aliases -> (building name, coordinates)."""
+        if self._buildings is None:
+            buildings: Dict[str, Tuple[str, Tuple[float, float]]] = {}
+            try:
+                with open(self.buildings_path, encoding="utf-8") as f:
+                    for name, entry in json.load(f).items():
+                        value = (name, (float(entry["lat"]), float(entry["lon"])))
+                        for alias in [name, *entry.get("aliases", [])]:
+                            buildings[_normalize(alias)] = value
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Could not load campus buildings from {self.buildings_path}: {e}")
+            self._buildings = buildings
+        return self._buildings
+
+    # --- Lookups ---
+
+    def _resolve_place(self, snapshot: _Snapshot, place: str) -> Optional[Tuple[str, Tuple[float, float]]]:
+        """Coordinates of a building or dining location the user named, e.g. "Gates" or "GHC"."""
+        wanted = _normalize(place)
+        buildings = self._building_coordinates()
+        if wanted in buildings:
+            return buildings[wanted]
+        index = snapshot.by_name.get(wanted)
+        if index is not None and snapshot.index.locations[index].coordinates:
+            location = snapshot.index.locations[index]
+            return location.name, location.coordinates
+        for alias, value in buildings.items():
+            if wanted in alias or alias in wanted:
+                return value
+        return None
+
+    def _match_locations(self, snapshot: _Snapshot, name: str) -> List[int]:
+        wanted = _normalize(name)
+        if wanted in snapshot.by_name:
+            return [snapshot.by_name[wanted]]
+        return [i for normalized, i in snapshot.by_name.items() if wanted in normalized]
+
+    def lookup(self, when: Optional[datetime] = None, near: Optional[str] = None,
+               location: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        What's open at `when` (campus time, default now), nearest to `near` first.
+        With `location`, only the locations matching that name. None when the
+        snapshot can't answer and a web search should.
+        """
+        with self._counter_lock:
+            self.counters["lookups"] += 1
+        snapshot = self._current()
+        when = (when or datetime.now(CAMPUS_TIMEZONE)).astimezone(CAMPUS_TIMEZONE)
+        if snapshot is None:
+            return self._fallback("no snapshot")
+        if self.max_age is not None and (snapshot.generated_at is None or when - snapshot.generated_at > self.max_age):
+            return self._fallback("snapshot too old for this time")
+        candidates: Optional[Set[int]] = None
+        if location:
+            candidates = set(self._match_locations(snapshot, location))
+            if not candidates:
+                return self._fallback(f"'{location}' not in snapshot")
+
+        index = snapshot.index
+        minute = when.weekday() * DAY_MINUTES + when.hour * 60 + when.minute
+        result: Dict[str, Any] = {"time": when.strftime("%a %m/%d %H:%M")}
+        walks: Optional[List[Optional[int]]] = None
+        if near:
+            origin = self._resolve_place(snapshot, near)
+            if origin is None:
+                result["note"] = f"Unknown building '{near}', results are not sorted by distance."
+            else:
+                result["near"] = origin[0]
+                walks = snapshot.walk_minutes(*origin)
+
+        def order(i: int):
+            return (walks[i] or 0) if walks else 0, index.locations[i].name
+
+        def describe(i: int, **fields: Any) -> Dict[str, Any]:
+            place = index.locations[i]
+            entry = {"name": place.name, "building": place.building, **fields}
+            if walks and walks[i] is not None:
+                entry["walk_minutes"] = walks[i]
+            return entry
+
+        def label(minutes_from_now: int) -> str:
+            at = when + timedelta(minutes=minutes_from_now)
+            return at.strftime("%H:%M") if at.date() == when.date() else at.strftime("%a %H:%M")
+
+        def closed_on(i: int, minutes_from_now: int) -> bool:
+            closed_dates = index.locations[i].closed_dates
+            return bool(closed_dates) and (when + timedelta(minutes=minutes_from_now)).date().isoformat() in closed_dates
+
+        # Location -> minutes until it closes (None if it never does), and until it opens
+        open_now: Dict[int, Optional[int]] = {}
+        for i, start, end in index.open_at(minute):
+            if candidates is not None and i not in candidates:
+                continue
+            # Minutes since this opening started, it may have started last Sunday
+            elapsed = (minute - start) % WEEK_MINUTES
+            if not closed_on(i, -elapsed):
+                open_now[i] = None if end - start >= WEEK_MINUTES else end - start - elapsed
+        later: Dict[int, int] = {}
+        for i in (candidates if candidates is not None else range(len(index.locations))):
+            if i in open_now:
+                continue
+            wait = index.next_opening(i, minute)
+            if wait is None or (candidates is None and wait > OPENING_SOON_MINUTES) or closed_on(i, wait):
+                continue
+            later[i] = wait
+
+        # Sorted before describing, only the listed ones are formatted
+        opened = sorted(open_now, key=order)
+        result["open"] = [describe(i, closes="open 24/7" if open_now[i] is None else label(open_now[i]))
+                          for i in opened[:MAX_OPEN_RESULTS]]
+        if len(opened) > MAX_OPEN_RESULTS:
+            result["more_open"] = len(opened) - MAX_OPEN_RESULTS
+        result["closed" if candidates is not None else "opening_soon"] = [
+            describe(i, opens=label(later[i])) for i in sorted(later, key=order)]
+        result["snapshot"] = snapshot.generated_at.strftime("%m/%d %H:%M") if snapshot.generated_at else None
+        DINING_LOOKUPS.inc(source="index")
+        return result
+
+    def _fallback(self, reason: str) -> None:
+        with self._counter_lock:
+            self.counters["fallbacks"] += 1
+        DINING_LOOKUPS.inc(source="search")
+        logger.info(f"Dining hours lookup falls back to search: {reason}.")
+        return None
+
+    # --- Refreshing ---
+
+    def start_refresh(self, interval: float = DINING_REFRESH_SECONDS, url: str = DINING_API_URL) -> None:
+        """
+        Fetches new hours from a daemon thread whenever the snapshot file is
+        older than `interval`. Going by the file's age, the workers sharing it
+        fetch about once per interval between them, not once each.
+        """
+        def loop():
+            while True:
+                try:
+                    age = time.time() - os.stat(self.path).st_mtime
+                except FileNotFoundError:
+                    age = math.inf
+                if age >= interval:
+                    try:
+                        snapshot = fetch_snapshot(url)
+                        write_snapshot(snapshot, self.path)
+                    except Exception as e:
+                        with self._counter_lock:
+                            self.counters["refresh_errors"] += 1
+                        logger.warning(f"Could not refresh dining hours from {url}: {e}")
+                        time.sleep(min(interval, DINING_REFRESH_RETRY_SECONDS))
+                        continue
+                    with self._counter_lock:
+                        self.counters["refreshes"] += 1
+                    logger.info(f"Wrote {len(snapshot['locations'])} dining locations to {self.path}.")
+                    age = 0
+                time.sleep(interval - age)
+
+        threading.Thread(target=loop, daemon=True, name="dining-refresh").start()
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            **self.counters,
+            "locations": len(snapshot.index.locations) if snapshot else 0,
+            "generated_at": snapshot.generated_at.isoformat() if snapshot and snapshot.generated_at else None,
+        }
+
+
+_dining_hours: Optional[DiningHours] = None
+_dining_hours_lock = threading.Lock()
+
+
+def get_dining_hours() -> DiningHours:
+    """The process's snapshot, kept fresh from a side thread unless CMUGPT_DINING_REFRESH_SECONDS is 0."""
+    global _dining_hours
+    with _dining_hours_lock:
+        if _dining_hours is None:
+            _dining_hours = DiningHours()
+            if DINING_REFRESH_SECONDS > 0:
+                _dining_hours.start_refresh()
+        return _dining_hours
+
+
+# --- Refreshing the Snapshot ---
+
+def _from_api(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """A snapshot location from a CMU Eats API location."""
+    hours: Dict[str, List[str]] = {}
+    for opening in entry.get("times") or []:
+        start, end = opening["start"], opening["end"]
+        # The API counts days from Sunday (0), the snapshot from Monday
+        start_minute = ((start["day"] + 6) % 7) * DAY_MINUTES + start["hour"] * 60 + start["minute"]
+        end_minute = ((end["day"] + 6) % 7) * DAY_MINUTES + end["hour"] * 60 + end["minute"]
+        length = (end_minute - start_minute) % WEEK_MINUTES
+        # Split at midnight, from_entry() merges the pieces back into one opening
+        while length > 0:
+            day, minute = divmod(start_minute % WEEK_MINUTES, DAY_MINUTES)
+            piece = min(length, DAY_MINUTES - minute)
+            closes = "24:00" if minute + piece == DAY_MINUTES else _clock(minute + piece)
+            hours.setdefault(DAYS[day], []).append(f"{_clock(minute)}-{closes}")
+            start_minute += piece
+            length -= piece
+    coordinates = entry.get("coordinates") or {}
+    return {
+        "id": str(entry.get("conceptId") or entry["name"]),
+        "name": entry["name"],
+        "building": entry.get("location") or "",
+        "lat": coordinates.get("lat"),
+        "lon": coordinates.get("lng"),
+        "hours": hours,
+    }
+
+
+def fetch_snapshot(url: str = DINING_API_URL) -> Dict[str, Any]:
+    import requests
+    response = requests.get(url, timeout=30)
+    response.raise_for_status()
+    return {
+        "generated_at": datetime.now(CAMPUS_TIMEZONE).isoformat(timespec="seconds"),
+        "source": url,
+        "locations": [_from_api(entry) for entry in response.json().get("locations", [])],
+    }
+
+
+def write_snapshot(snapshot: Dict[str, Any], path: str = DINING_HOURS_PATH) -> None:
+    # Written next to the file and renamed over it, so a running process never reads half of it.
+    # Named per process, workers refreshing at the same moment don't write into one file
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, indent=1, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--refresh", action="store_true", help="fetch the current hours and write the snapshot")
+    parser.add_argument("--path", default=DINING_HOURS_PATH)
+    parser.add_argument("--date", help="look up this day, MM/DD/YYYY or YYYY-MM-DD")
+    parser.add_argument("--time", help="look up this time, HH:MM or e.g. 9pm")
+    parser.add_argument("--near", help="building to sort by distance from, e.g. Gates")
+    parser.add_argument("--location", help="only this dining location")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    if args.refresh:
+        snapshot = fetch_snapshot()
+        write_snapshot(snapshot, args.path)
+        logger.info(f"Wrote {len(snapshot['locations'])} dining locations to {args.path}.")
+        return 0
+    result = DiningHours(args.path).lookup(parse_when(args.date, args.time), args.near, args.location)
+    print(json.dumps(result, indent=2))
+    return 0 if result is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
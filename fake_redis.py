@@ -0,0 +1,133 @@
+# fake_redis.py
+
+"""
+A minimal in-process server that speaks enough of the Redis protocol for
+RedisCache (PING, AUTH, SELECT, GET, SET with EX/PX, DEL, SCAN, DBSIZE,
+FLUSHDB). Lets several local workers share a cache, and lets the Redis
+backend be exercised without a real Redis.
+
+    python fake_redis.py --port 6379
+"""
+
+import time
+import fnmatch
+import threading
+import socketserver
+from typing import Dict, Tuple, Optional, List
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            try:
+                args = self._read_command()
+            except (ConnectionError, ValueError):
+                return
+            if args is None:
+                return
+            self.wfile.write(self.server.execute(args))
+
+    def _read_command(self) -> Optional[List[bytes]]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # Inline commands, as sent by telnet or redis-cli --no-raw
+            return line.strip().split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+
+def _bulk(value: Optional[bytes]) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _Handler)
+        self._data: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def start(self) -> "FakeRedisServer":
+        """Serves on a daemon thread, returns self so it can be chained."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True, name="fake-redis")
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def _live(self, key: bytes) -> Optional[bytes]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self._data[key]
+            return None
+        return value
+
+    def execute(self, args: List[bytes]) -> bytes:
+        command = args[0].upper()
+        with self._lock:
+            if command == b"PING":
+                return b"+PONG\r\n"
+            if command in (b"AUTH", b"SELECT"):
+                return b"+OK\r\n"
+            if command == b"GET":
+                return _bulk(self._live(args[1]))
+            if command == b"SET":
+                expires_at = None
+                options = [a.upper() for a in args[3:]]
+                if b"EX" in options:
+                    expires_at = time.time() + int(args[3 + options.index(b"EX") + 1])
+                if b"PX" in options:
+                    expires_at = time.time() + int(args[3 + options.index(b"PX") + 1]) / 1000
+                self._data[args[1]] = (args[2], expires_at)
+                return b"+OK\r\n"
+            if command == b"DEL":
+                removed = sum(1 for key in args[1:] if self._data.pop(key, None) is not None)
+                return b":%d\r\n" % removed
+            if command == b"SCAN":
+                # Everything in one page, cursor is always 0
+                pattern = "*"
+                if b"MATCH" in [a.upper() for a in args]:
+                    pattern = args[[a.upper() for a in args].index(b"MATCH") + 1].decode()
+                keys = [key for key in list(self._data) if self._live(key) is not None
+                        and fnmatch.fnmatchcase(key.decode(errors="replace"), pattern)]
+                return b"*2\r\n" + _bulk(b"0") + b"*%d\r\n" % len(keys) + b"".join(_bulk(k) for k in keys)
+            if command == b"DBSIZE":
+                return b":%d\r\n" % sum(1 for key in list(self._data) if self._live(key) is not None)
+            if command == b"FLUSHDB":
+                self._data.clear()
+                return b"+OK\r\n"
+        return b"-ERR unknown command '%s'\r\n" % command
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a local Redis-protocol server for the shared cache.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+
+    server = FakeRedisServer(args.host, args.port)
+    print(f"Fake Redis listening on {server.url}")
+    server.serve_forever()
@@ -0,0 +1,139 @@
+# free_busy.py
+
+"""
+Busy time as a sorted list of merged, non-overlapping intervals. Building it
+is O(n log n), after which "is this range free?" is one bisect, O(log n),
+and listing free slots in a window is O(log n + k) for k gaps.
+"""
+
+import sys
+import bisect
+import logging
+from datetime import datetime, timedelta, tzinfo
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Interval = Tuple[datetime, datetime]
+
+
+class BusyIndex:
+    """Merged busy intervals. Times must all be timezone-aware (or all naive)."""
+
+    def __init__(self, intervals: Iterable[Interval] = ()):
+        self.starts: List[datetime] = []
+        self.ends: List[datetime] = []
+        for start, end in sorted(i for i in intervals if i[1] > i[0]):
+            if self.ends and start <= self.ends[-1]:
+                # Overlaps or touches the previous interval
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def add(self, start: datetime, end: datetime) -> None:
+        """Inserts an interval, merging it with any it overlaps."""
+        if end <= start:
+            return
+        lo = bisect.bisect_left(self.ends, start)
+        hi = bisect.bisect_right(self.starts, end)
+        if lo < hi:
+            start = min(start, self.starts[lo])
+            end = max(end, self.ends[hi - 1])
+        self.starts[lo:hi] = [start]
+        self.ends[lo:hi] = [end]
+
+    def is_free(self, start: datetime, end: datetime) -> bool:
+        # The only interval that can overlap is the last one starting before `end`
+        i = bisect.bisect_left(self.starts, end) - 1
+        return i < 0 or self.ends[i] <= start
+
+    def busy_between(self, start: datetime, end: datetime) -> List[Interval]:
+        lo = bisect.bisect_right(self.ends, start)
+        hi = bisect.bisect_left(self.starts, end)
+        return list(zip(self.starts[lo:hi], self.ends[lo:hi]))
+
+    def free_slots(self, start: datetime, end: datetime, duration: timedelta,
+                   limit: Optional[int] = None) -> List[Interval]:
+        """Gaps of at least `duration` within [start, end), earliest first."""
+        slots: List[Interval] = []
+        cursor = start
+        for busy_start, busy_end in self.busy_between(start, end) + [(end, end)]:
+            gap_end = min(busy_start, end)
+            if gap_end - cursor >= duration:
+                slots.append((cursor, gap_end))
+                if limit is not None and len(slots) >= limit:
+                    break
+            cursor = max(cursor, busy_end)
+        return slots
+
+
+def _parse_time(value: str, tz: Optional[tzinfo]) -> datetime:
+    moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return moment.astimezone(tz) if tz is not None else moment
+
+
+def _event_time(value: Dict[str, Any], tz: Optional[tzinfo] = None) -> Optional[datetime]:
+    if not value or "dateTime" not in value:
+        return None
+    return _parse_time(value["dateTime"], tz)
+
+
+def event_intervals(events: Iterable[Dict[str, Any]],
+                    tz: Optional[tzinfo] = None) -> List[Tuple[datetime, datetime, str]]:
+    """
+    (start, end, summary) for Calendar event resources that block time, in
+    `tz` when given. Free ("transparent") and all-day events are skipped, as
+    Calendar's own scheduling does for all-day reminders and holidays.
+    """
+    intervals = []
+    for event in events:
+        if event.get("transparency") == "transparent" or event.get("status") == "cancelled":
+            continue
+        start, end = _event_time(event.get("start"), tz), _event_time(event.get("end"), tz)
+        if start is not None and end is not None:
+            intervals.append((start, end, event.get("summary", "(no title)")))
+    return intervals
+
+
+def freebusy_intervals(response: Dict[str, Any], calendar_id: str = "primary",
+                       tz: Optional[tzinfo] = None) -> List[Interval]:
+    """
+    Busy intervals from a Calendar freebusy().query() response, in `tz` when
+    given. Calendar answers in UTC, slot edges taken from them would print as
+    UTC clock times otherwise.
+    """
+    busy = response.get("calendars", {}).get(calendar_id, {}).get("busy", [])
+    return [(_parse_time(b["start"], tz), _parse_time(b["end"], tz)) for b in busy]
+
+
+def format_slot(start: datetime, end: datetime) -> str:
+    """A slot in the clock time of `start`, whatever zone `end` is in."""
+    if start.tzinfo is not None and end.tzinfo is not None:
+        end = end.astimezone(start.tzinfo)
+    if start.date() == end.date():
+        return f"{start.strftime('%a %m/%d %H:%M')}-{end.strftime('%H:%M')}"
+    return f"{start.strftime('%a %m/%d %H:%M')}-{end.strftime('%a %m/%d %H:%M')}"
+
+
+def _check() -> int:
+    """python free_busy.py: a freebusy answer in UTC gives local, ordered slots in a local window."""
+    from zoneinfo import ZoneInfo
+    tz = ZoneInfo("America/New_York")
+    response = {"calendars": {"primary": {"busy": [{"start": "2026-10-22T17:00:00Z", "end": "2026-10-22T18:00:00Z"}]}}}
+    index = BusyIndex(freebusy_intervals(response, tz=tz))
+    window = (datetime(2026, 10, 22, 12, 0, tzinfo=tz), datetime(2026, 10, 22, 17, 0, tzinfo=tz))
+    slots = [format_slot(*slot) for slot in index.free_slots(*window, timedelta(minutes=60))]
+    expected = ["Thu 10/22 12:00-13:00", "Thu 10/22 14:00-17:00"]
+    if slots != expected:
+        print(f"Expected {expected}, got {slots}")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_check())
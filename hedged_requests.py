@@ -0,0 +1,232 @@
+# hedged_requests.py
+
+"""
+Hedged requests for idempotent upstream calls (Canvas GETs, Perplexity
+searches). When a request hasn't answered within the upstream's usual
+latency (CMUGPT_HEDGE_PERCENTILE of recent requests, p95 by default), the
+same request is sent again. Whichever responds first is used. A losing hedge
+is dropped as soon as its headers arrive, before its body is downloaded.
+Only originals are timed, so the percentile stays the upstream's own: a
+losing original is read to the end so its latency still counts, hedges
+aren't timed. A 5xx response counts as a failed attempt: the other one may
+still win, and a 5xx before the hedge delay sends the hedge right away. One
+slow or failing upstream node then costs a turn the hedge delay instead of
+the full timeout.
+
+Off unless CMUGPT_HEDGE_REQUESTS=1. A hedge budget keeps hedging from
+doubling the load: each request earns CMUGPT_HEDGE_BUDGET of a hedge (0.1,
+so at most about one extra request in ten), with a small burst allowance.
+Perplexity bills hedged searches too, and the budget caps that spend.
+Nothing is hedged while a record/replay cassette is active.
+"""
+
+import os
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout, FIRST_COMPLETED, wait
+from typing import Any, Deque, Dict, Optional
+
+import requests
+
+from http_cassette import get_cassette
+from metrics import RETRIES
+
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+HEDGE_PERCENTILE = float(os.getenv("CMUGPT_HEDGE_PERCENTILE", "95"))
+# Hedges earned per request, and how many may be saved up for a burst of slow responses
+HEDGE_BUDGET = float(os.getenv("CMUGPT_HEDGE_BUDGET", "0.1"))
+HEDGE_BURST = 5
+# Never hedge sooner than this, however fast the upstream usually is
+HEDGE_MIN_DELAY_MS = float(os.getenv("CMUGPT_HEDGE_MIN_DELAY_MS", "50"))
+# Latencies kept per upstream, and how many are needed before hedging starts
+HEDGE_MAX_SAMPLES = 200
+HEDGE_MIN_SAMPLES = 20
+# Threads for in-flight attempts across all upstreams, two per hedged request
+HEDGE_WORKERS = int(os.getenv("CMUGPT_HEDGE_WORKERS", "32"))
+
+
+class _Dropped(Exception):
+    """Raised by an attempt whose response arrived after the other attempt had already won."""
+
+
+class _ServerError(Exception):
+    """Raised by an attempt answered with a 5xx, returned as is if no other attempt does better."""
+
+    def __init__(self, response: requests.Response):
+        super().__init__(f"HTTP {response.status_code}")
+        self.response = response
+
+
+def _settle(result) -> requests.Response:
+    try:
+        return result()
+    except _ServerError as e:
+        return e.response
+
+
+def _percentile(values, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+        return _executor
+
+
+class Hedger:
+    """Hedges the requests to one upstream, from that upstream's own recent latencies."""
+
+    def __init__(self, name: str, percentile: float = HEDGE_PERCENTILE, budget: float = HEDGE_BUDGET,
+                 min_delay_ms: float = HEDGE_MIN_DELAY_MS):
+        self.name = name
+        self.percentile = percentile
+        self.budget = budget
+        self.min_delay_ms = min_delay_ms
+        self.latencies: Deque[float] = deque(maxlen=HEDGE_MAX_SAMPLES)
+        self._credits = float(HEDGE_BURST)
+        self.counters = {"requests": 0, "hedged": 0, "hedge_wins": 0, "over_budget": 0, "dropped": 0}
+        self._lock = threading.Lock()
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, None until enough latencies have been seen."""
+        with self._lock:
+            samples = list(self.latencies)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(self.min_delay_ms, _percentile(samples, self.percentile)) / 1000
+
+    def _take_credit(self) -> bool:
+        with self._lock:
+            if self._credits >= 1:
+                self._credits -= 1
+                self.counters["hedged"] += 1
+                return True
+            self.counters["over_budget"] += 1
+            return False
+
+    def request(self, session: requests.Session, method: str, url: str, **kwargs) -> requests.Response:
+        """session.request(method, url, **kwargs), hedged. Errors are raised as they would be unhedged."""
+        with self._lock:
+            self.counters["requests"] += 1
+            self._credits = min(HEDGE_BURST, self._credits + self.budget)
+        won = threading.Event()
+
+        def attempt(primary: bool = True) -> requests.Response:
+            started = time.perf_counter()
+            # Streamed, so a losing hedge is closed without downloading its body
+            response = session.request(method, url, stream=True, **kwargs)
+            if won.is_set() and not primary:
+                response.close()
+                with self._lock:
+                    self.counters["dropped"] += 1
+                raise _Dropped()
+            # Only originals are timed, to the end even when they lose: leaving out the slow ones, or adding
+            # hedges that only start after the delay, would pull the delay down
+            response.content
+            failed = response.status_code >= 500
+            if primary and not failed:
+                with self._lock:
+                    self.latencies.append((time.perf_counter() - started) * 1000)
+            if won.is_set():
+                response.close()
+                with self._lock:
+                    self.counters["dropped"] += 1
+                raise _Dropped()
+            if failed:
+                raise _ServerError(response)
+            return response
+
+        delay = self.delay()
+        if delay is None:
+            return _settle(attempt)
+
+        executor = _get_executor()
+        # Copied context, so the attempts log with the caller's session and turn id
+        primary = executor.submit(contextvars.copy_context().run, attempt, True)
+        try:
+            return primary.result(timeout=delay)
+        except FuturesTimeout:
+            pass
+        except _ServerError:
+            pass  # Hedged right away, the hedge may reach a healthy node
+        if not self._take_credit():
+            return _settle(primary.result)
+
+        RETRIES.inc(kind="hedge")
+        hedge = executor.submit(contextvars.copy_context().run, attempt, False)
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future.exception() is None:
+                    won.set()
+                    if future is hedge:
+                        with self._lock:
+                            self.counters["hedge_wins"] += 1
+                        logger.debug(f"Hedged {self.name} request won after {delay * 1000:.0f} ms: {method} {url}")
+                    return future.result()
+                # One failed attempt doesn't fail the request while the other may still succeed
+                if error is None or future is primary:
+                    error = future.exception()
+        if isinstance(error, _ServerError):
+            return error.response
+        raise error
+
+    def stats(self) -> Dict[str, Any]:
+        delay = self.delay()
+        with self._lock:
+            counters = dict(self.counters)
+        return {
+            **counters,
+            "hedge_rate": round(counters["hedged"] / counters["requests"], 3) if counters["requests"] else 0.0,
+            "hedge_win_rate": round(counters["hedge_wins"] / counters["hedged"], 3) if counters["hedged"] else 0.0,
+            "delay_ms": round(delay * 1000, 1) if delay is not None else None,
+        }
+
+
+_hedgers: Dict[str, Hedger] = {}
+_hedgers_lock = threading.Lock()
+
+
+def hedging_enabled() -> bool:
+    # Hedges would record or consume interactions the cassette doesn't expect
+    return os.getenv("CMUGPT_HEDGE_REQUESTS", "0") == "1" and get_cassette() is None
+
+
+def get_hedger(name: str) -> Optional[Hedger]:
+    """The process-wide hedger for an upstream, or None when hedging is off."""
+    if not hedging_enabled():
+        return None
+    with _hedgers_lock:
+        hedger = _hedgers.get(name)
+        if hedger is None:
+            hedger = _hedgers[name] = Hedger(name)
+        return hedger
+
+
+def hedged(session: requests.Session, name: str, method: str, url: str, **kwargs) -> requests.Response:
+    """session.request(), hedged as upstream `name` when hedging is on. Only use it for idempotent requests."""
+    hedger = get_hedger(name)
+    if hedger is None:
+        return session.request(method, url, **kwargs)
+    return hedger.request(session, method, url, **kwargs)
+
+
+def hedge_stats() -> Dict[str, Dict[str, Any]]:
+    with _hedgers_lock:
+        hedgers = list(_hedgers.values())
+    return {hedger.name: hedger.stats() for hedger in hedgers}
@@ -0,0 +1,426 @@
+# http_cassette.py
+
+"""
+Record/replay for upstream HTTP traffic, so the assistant can be profiled
+and benchmarked against real response shapes with no network. One cassette
+file holds the interactions of every client:
+
+- OpenAI, through the client's `http_client` (an httpx transport)
+- Perplexity and Canvas, through a requests adapter mounted on their sessions
+- Google Calendar, through a wrapper around googleapiclient's httplib2 `http`
+
+    CMUGPT_HTTP_MODE=record CMUGPT_HTTP_CASSETTE=run.jsonl.gz python benchmarks/replay_turns.py
+    CMUGPT_HTTP_MODE=replay CMUGPT_HTTP_CASSETTE=run.jsonl.gz CMUGPT_REPLAY_TIMING=0 python ...
+
+Cassettes are gzipped JSON lines, one interaction each, with the time to
+response headers, the total time and, for streams, when each chunk arrived.
+Replay sleeps those timings scaled by CMUGPT_REPLAY_TIMING (1 = as recorded,
+0 = instant). Credentials are never written: request headers aren't stored
+and token query parameters are dropped from URLs.
+
+A request is matched to the next unused interaction with the same method,
+URL and body. If none matches (the body has today's date in it, say), the
+next unused one for the same endpoint is used. If that fails too, replay
+raises the client's own connection error.
+"""
+
+import os
+import gzip
+import json
+import time
+import base64
+import atexit
+import hashlib
+import logging
+import threading
+import http.client
+from collections import defaultdict, deque
+from datetime import timedelta
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+CASSETTE_PATH = os.getenv("CMUGPT_HTTP_CASSETTE", "")
+# record, replay or off
+CASSETTE_MODE = os.getenv("CMUGPT_HTTP_MODE", "off")
+REPLAY_TIMING = float(os.getenv("CMUGPT_REPLAY_TIMING", "1"))
+# Query parameters never written to a cassette
+SECRET_PARAMS = {"access_token", "key", "api_key", "token"}
+# Response headers not worth keeping (hop-by-hop, cookies, or describing the raw stream)
+DROPPED_HEADERS = {"connection", "keep-alive", "transfer-encoding", "set-cookie", "date", "server",
+                   "content-encoding", "cf-ray", "alt-svc", "status"}
+
+
+class CassetteMiss(LookupError):
+    """Replay found no recorded interaction for a request."""
+
+
+def _normalize_url(url: str) -> str:
+    parts = urlsplit(url)
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in SECRET_PARAMS)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ""))
+
+
+def _endpoint(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}{parts.path}"
+
+
+def _digest(body: Any) -> str:
+    if body is None:
+        body = b""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    try:
+        # JSON bodies are compared by content, not key order or whitespace
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode("utf-8")
+    except ValueError:
+        pass
+    return hashlib.sha1(body).hexdigest()[:16]
+
+
+def _encode_body(content: bytes) -> Dict[str, str]:
+    try:
+        return {"body": content.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"body": base64.b64encode(content).decode("ascii"), "encoding": "base64"}
+
+
+def _decode_body(interaction: Dict[str, Any]) -> bytes:
+    if interaction.get("encoding") == "base64":
+        return base64.b64decode(interaction["body"])
+    return interaction["body"].encode("utf-8")
+
+
+def _open(path: str, mode: str, gzipped: Optional[bool] = None):
+    if gzipped is None:
+        gzipped = path.endswith(".gz")
+    return gzip.open(path, mode + "t", encoding="utf-8") if gzipped else open(path, mode, encoding="utf-8")
+
+
+def _kept_headers(headers: Any, dropped: set = DROPPED_HEADERS) -> List[List[str]]:
+    return [[k, v] for k, v in headers.items() if k.lower() not in dropped and not k.startswith("-")]
+
+
+class Cassette:
+    """The interactions of one recording, indexed for replay. Thread-safe."""
+
+    def __init__(self, path: str, mode: str, timing: float = REPLAY_TIMING):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Cassette mode must be 'record' or 'replay', not '{mode}'")
+        self.path = path
+        self.mode = mode
+        self.timing = timing
+        self.interactions: List[Dict[str, Any]] = []
+        self._exact: Dict[Tuple[str, ...], Deque[int]] = defaultdict(deque)
+        self._by_endpoint: Dict[Tuple[str, ...], Deque[int]] = defaultdict(deque)
+        self._used: set = set()
+        self._lock = threading.Lock()
+        self.counters = {"recorded": 0, "replayed": 0, "fallback": 0, "misses": 0}
+        if mode == "replay":
+            self._load()
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def _load(self) -> None:
+        with _open(self.path, "r") as f:
+            self.interactions = [json.loads(line) for line in f if line.strip()]
+        self.rewind()
+        logger.info(f"Loaded {len(self.interactions)} interactions from {self.path}.")
+
+    def rewind(self) -> None:
+        """Makes every interaction available to replay again, for repeated runs."""
+        with self._lock:
+            self._used.clear()
+            self._exact.clear()
+            self._by_endpoint.clear()
+            for i, it in enumerate(self.interactions):
+                self._exact[(it["client"], it["method"], it["url"], it["request_digest"])].append(i)
+                self._by_endpoint[(it["client"], it["method"], _endpoint(it["url"]))].append(i)
+
+    def save(self) -> None:
+        """Writes the recording (replacing the file), in the order requests were started."""
+        if self.mode != "record":
+            return
+        with self._lock:
+            interactions = sorted(self.interactions, key=lambda it: it["started"])
+        tmp = f"{self.path}.tmp"
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with _open(tmp, "w", gzipped=self.path.endswith(".gz")) as f:
+            for it in interactions:
+                f.write(json.dumps(it, separators=(",", ":"), ensure_ascii=False) + "\n")
+        os.replace(tmp, self.path)
+        logger.info(f"Saved {len(interactions)} interactions to {self.path}.")
+
+    # --- Recording ---
+
+    def record(self, client: str, method: str, url: str, request_body: Any, status: int, headers: List[List[str]],
+               content: bytes, started: float, ttfb: float, elapsed: float,
+               chunks: Optional[List[List[float]]] = None) -> None:
+        interaction = {
+            "client": client,
+            "method": method.upper(),
+            "url": _normalize_url(url),
+            "request_digest": _digest(request_body),
+            "status": status,
+            "headers": headers,
+            **_encode_body(content),
+            "started": round(started, 4),
+            "ttfb": round(ttfb, 4),
+            "elapsed": round(elapsed, 4),
+        }
+        if chunks and len(chunks) > 1:
+            interaction["chunks"] = chunks
+        with self._lock:
+            self.interactions.append(interaction)
+            self.counters["recorded"] += 1
+
+    # --- Replay ---
+
+    def _pop_unused(self, queue: Deque[int]) -> Optional[int]:
+        while queue:
+            i = queue.popleft()
+            if i not in self._used:
+                self._used.add(i)
+                return i
+        return None
+
+    def find(self, client: str, method: str, url: str, request_body: Any) -> Dict[str, Any]:
+        url = _normalize_url(url)
+        with self._lock:
+            i = self._pop_unused(self._exact[(client, method.upper(), url, _digest(request_body))])
+            if i is None:
+                i = self._pop_unused(self._by_endpoint[(client, method.upper(), _endpoint(url))])
+                if i is not None:
+                    self.counters["fallback"] += 1
+            if i is None:
+                self.counters["misses"] += 1
+                raise CassetteMiss(f"No recorded {client} interaction for {method.upper()} {url}")
+            self.counters["replayed"] += 1
+            return self.interactions[i]
+
+    def wait(self, seconds: float) -> None:
+        if self.timing > 0 and seconds > 0:
+            time.sleep(seconds * self.timing)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"mode": self.mode, "interactions": len(self.interactions), **self.counters}
+
+
+_cassette: Optional[Cassette] = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette() -> Optional[Cassette]:
+    """The process-wide cassette, or None unless CMUGPT_HTTP_MODE and CMUGPT_HTTP_CASSETTE are set."""
+    global _cassette
+    if CASSETTE_MODE == "off" or not CASSETTE_PATH:
+        return None
+    with _cassette_lock:
+        if _cassette is None:
+            _cassette = Cassette(CASSETTE_PATH, CASSETTE_MODE)
+            if _cassette.mode == "record":
+                atexit.register(_cassette.save)
+        return _cassette
+
+
+def replaying() -> bool:
+    cassette = get_cassette()
+    return cassette is not None and cassette.replaying
+
+
+# --- requests (Perplexity, Canvas) ---
+
+class CassetteAdapter(HTTPAdapter):
+    """A requests transport adapter that records responses, or serves them from the cassette."""
+
+    def __init__(self, cassette: Cassette, client: str, **kwargs):
+        super().__init__(**kwargs)
+        self.cassette = cassette
+        self.client = client
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if self.cassette.replaying:
+            try:
+                interaction = self.cassette.find(self.client, request.method, request.url, request.body)
+            except CassetteMiss as e:
+                raise requests.exceptions.ConnectionError(str(e), request=request)
+            self.cassette.wait(interaction["elapsed"])
+            return self._replayed_response(request, interaction)
+
+        started = time.time()
+        clock = time.perf_counter()
+        response = super().send(request, stream=stream, timeout=timeout, verify=verify, cert=cert, proxies=proxies)
+        ttfb = time.perf_counter() - clock
+        content = response.content
+        self.cassette.record(self.client, request.method, request.url, request.body, response.status_code,
+                             _kept_headers(response.headers), content, started, ttfb, time.perf_counter() - clock)
+        return response
+
+    def _replayed_response(self, request, interaction: Dict[str, Any]) -> requests.Response:
+        response = requests.Response()
+        response.status_code = interaction["status"]
+        response.reason = http.client.responses.get(response.status_code, "")
+        response.headers = CaseInsensitiveDict(dict(interaction["headers"]))
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = _decode_body(interaction)
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.elapsed = timedelta(seconds=interaction["elapsed"])
+        return response
+
+
+def mount_requests(session: requests.Session, client: str, **adapter_kwargs) -> bool:
+    """Routes a session through the cassette when one is active. Returns True if it did."""
+    cassette = get_cassette()
+    if cassette is None:
+        return False
+    adapter = CassetteAdapter(cassette, client, **adapter_kwargs)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return True
+
+
+# --- httpx (OpenAI) ---
+
+def openai_http_client():
+    """An httpx client for OpenAI(http_client=...) going through the cassette, or None when none is active."""
+    cassette = get_cassette()
+    if cassette is None:
+        return None
+    # Imported here so this module stays cheap to import
+    import httpx
+    from openai import DefaultHttpxClient
+
+    class RecordingStream(httpx.SyncByteStream):
+
+        def __init__(self, response: "httpx.Response", request: "httpx.Request", started: float,
+                     clock: float, ttfb: float):
+            self.response = response
+            self.request = request
+            self.started, self.clock, self.ttfb = started, clock, ttfb
+            self.parts: List[bytes] = []
+            self.chunks: List[List[float]] = []
+            self.recorded = False
+
+        def __iter__(self):
+            # Decoded here, so the cassette holds plain bodies and the caller gets no Content-Encoding
+            for part in self.response.iter_bytes():
+                self.parts.append(part)
+                self.chunks.append([round(time.perf_counter() - self.clock, 4), len(part)])
+                yield part
+
+        def close(self) -> None:
+            self.response.close()
+            if not self.recorded:
+                self.recorded = True
+                cassette.record("openai", self.request.method, str(self.request.url), self.request.content,
+                                self.response.status_code, _kept_headers(self.response.headers),
+                                b"".join(self.parts), self.started, self.ttfb,
+                                time.perf_counter() - self.clock, self.chunks)
+
+    class ReplayStream(httpx.SyncByteStream):
+
+        def __init__(self, interaction: Dict[str, Any]):
+            self.interaction = interaction
+
+        def __iter__(self):
+            body = _decode_body(self.interaction)
+            chunks = self.interaction.get("chunks")
+            if not chunks:
+                cassette.wait(self.interaction["elapsed"] - self.interaction["ttfb"])
+                yield body
+                return
+            # Paced like the original stream, so time to first token replays too
+            offset, previous = 0, self.interaction["ttfb"]
+            for at, size in chunks:
+                cassette.wait(at - previous)
+                previous = at
+                yield body[offset:offset + size]
+                offset += size
+
+    class CassetteTransport(httpx.BaseTransport):
+
+        def __init__(self):
+            self.inner = None if cassette.replaying else httpx.HTTPTransport()
+
+        def handle_request(self, request: "httpx.Request") -> "httpx.Response":
+            request.read()
+            if cassette.replaying:
+                try:
+                    interaction = cassette.find("openai", request.method, str(request.url), request.content)
+                except CassetteMiss as e:
+                    raise httpx.ConnectError(str(e), request=request)
+                cassette.wait(interaction["ttfb"])
+                headers = [(k, v) for k, v in interaction["headers"] if k.lower() != "content-length"]
+                return httpx.Response(interaction["status"], headers=headers,
+                                      stream=ReplayStream(interaction), request=request)
+
+            started, clock = time.time(), time.perf_counter()
+            live = self.inner.handle_request(request)
+            ttfb = time.perf_counter() - clock
+            decoded = httpx.Response(live.status_code, headers=live.headers, stream=live.stream, request=request)
+            headers = [(k, v) for k, v in live.headers.items() if k.lower() not in ("content-encoding", "content-length")]
+            return httpx.Response(live.status_code, headers=headers, request=request, extensions=live.extensions,
+                                  stream=RecordingStream(decoded, request, started, clock, ttfb))
+
+        def close(self) -> None:
+            if self.inner is not None:
+                self.inner.close()
+
+    return DefaultHttpxClient(transport=CassetteTransport())
+
+
+# --- httplib2 (Google Calendar) ---
+
+class CassetteHttp:
+    """Wraps the httplib2.Http (or AuthorizedHttp) googleapiclient calls. In replay no inner http is needed."""
+
+    def __init__(self, cassette: Cassette, inner: Any = None):
+        self.cassette = cassette
+        self.inner = inner
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        import httplib2
+
+        if self.cassette.replaying:
+            try:
+                interaction = self.cassette.find("google", method, uri, body)
+            except CassetteMiss as e:
+                raise httplib2.ServerNotFoundError(str(e))
+            self.cassette.wait(interaction["elapsed"])
+            info = {k.lower(): v for k, v in interaction["headers"]}
+            info["status"] = str(interaction["status"])
+            return httplib2.Response(info), _decode_body(interaction)
+
+        started, clock = time.time(), time.perf_counter()
+        response, content = self.inner.request(uri, method=method, body=body, headers=headers,
+                                               redirections=redirections, connection_type=connection_type)
+        elapsed = time.perf_counter() - clock
+        self.cassette.record("google", method, uri, body, response.status, _kept_headers(response),
+                             content, started, elapsed, elapsed)
+        return response, content
+
+    def __getattr__(self, name):
+        # Anything else googleapiclient looks up (timeout, credentials, close) is the inner http's
+        if self.inner is None:
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+
+
+def wrap_google_http(http: Any) -> Any:
+    """The http to hand googleapiclient: http itself, or it wrapped in the active cassette."""
+    cassette = get_cassette()
+    return http if cassette is None else CassetteHttp(cassette, http)
@@ -0,0 +1,267 @@
+# intent_router.py
+
+import os
+import re
+import sys
+import json
+import math
+import logging
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+# A local route is only taken when we are at least this sure about it.
+# Anything below falls through to the normal model tool-selection call.
+DEFAULT_THRESHOLD = 0.9
+# The classifier is a fallback for phrasings the rules miss, so it has to clear a higher bar.
+DEFAULT_CLASSIFIER_THRESHOLD = 0.95
+NO_TOOL = "none"
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+@dataclass
+class IntentRule:
+    """A keyword/regex rule that maps obvious user phrasings to a single tool call."""
+    tool_name: str
+    patterns: List[str]
+    confidence: float = 0.95
+    # Any of these patterns vetoes the rule (e.g. "drop" for the courses tool).
+    exclude: List[str] = field(default_factory=list)
+    arguments: Dict[str, Any] = field(default_factory=dict)
+    # UI-only tools answer with a fixed template instead of a second model call.
+    template: Optional[str] = None
+
+    def __post_init__(self):
+        self._patterns = [re.compile(p, re.IGNORECASE) for p in self.patterns]
+        self._exclude = [re.compile(p, re.IGNORECASE) for p in self.exclude]
+
+    def matches(self, text: str) -> bool:
+        if any(p.search(text) for p in self._exclude):
+            return False
+        return any(p.search(text) for p in self._patterns)
+
+
+@dataclass
+class RouteMatch:
+    """The result of a successful local route."""
+    tool_name: str
+    arguments: Dict[str, Any]
+    confidence: float
+    source: str  # "rule" or "classifier"
+    template: Optional[str] = None
+
+
+DEFAULT_RULES = [
+    IntentRule(
+        tool_name="show_cmueats_website",
+        patterns=[
+            r"^\W*(cmu\s?eats)(\.com)?\W*$",
+            r"\b(show|open|display|pull up|bring up|launch)\b.{0,20}\bcmu\s?eats\b",
+        ],
+        template="You can find dining locations and hours at https://cmueats.com. I've opened it for you below.",
+    ),
+    IntentRule(
+        tool_name="show_cmucourses_website",
+        patterns=[
+            r"^\W*(cmu\s?courses)(\.com)?\W*$",
+            r"\b(show|open|display|pull up|bring up|launch)\b.{0,20}\bcmu\s?courses\b",
+        ],
+        template="You can browse courses at https://cmucourses.com. I've opened it for you below.",
+    ),
+    IntentRule(
+        tool_name="get_current_canvas_courses",
+        patterns=[
+            r"\b(what|which)\b.{0,20}\b(are|is)\b.{0,10}\bmy\b.{0,20}\b(courses|classes)\b",
+            r"\b(list|show|get)\b.{0,10}\bmy\b.{0,20}\b(courses|classes)\b",
+            r"^\W*my\s+(current\s+|canvas\s+)?(courses|classes)\W*$",
+        ],
+        exclude=[
+            r"\b(due|assignments?|homework|grades?|drop|add|register|enroll|calendar|schedule|exam|next)\b",
+        ],
+    ),
+]
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+class NaiveBayesIntentClassifier:
+    """
+    A tiny multinomial Naive Bayes classifier over word tokens. It is only
+    consulted when no rule matches, and must be trained on labelled examples
+    that include a "none" class for messages that should go to the model.
+    """
+
+    def __init__(self, alpha: float = 1.0):
+        self.alpha = alpha
+        self.class_counts: Counter = Counter()
+        self.token_counts: Dict[str, Counter] = defaultdict(Counter)
+        self.vocabulary: set = set()
+
+    def fit(self, examples: Iterable[Tuple[str, str]]) -> "NaiveBayesIntentClassifier":
+        for text, label in examples:
+            label = label or NO_TOOL
+            self.class_counts[label] += 1
+            tokens = tokenize(text)
+            self.token_counts[label].update(tokens)
+            self.vocabulary.update(tokens)
+        return self
+
+    @classmethod
+    def from_jsonl(cls, path: str) -> "NaiveBayesIntentClassifier":
+        return cls().fit((ex["text"], ex.get("tool") or NO_TOOL) for ex in load_examples(path))
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """Returns the most likely label and its posterior probability."""
+        if not self.class_counts:
+            return NO_TOOL, 0.0
+        tokens = tokenize(text)
+        total = sum(self.class_counts.values())
+        vocab_size = len(self.vocabulary) or 1
+        log_scores = {}
+        for label, count in self.class_counts.items():
+            denominator = sum(self.token_counts[label].values()) + self.alpha * vocab_size
+            score = math.log(count / total)
+            for token in tokens:
+                score += math.log((self.token_counts[label][token] + self.alpha) / denominator)
+            log_scores[label] = score
+        best = max(log_scores, key=log_scores.get)
+        top = log_scores[best]
+        normalizer = sum(math.exp(s - top) for s in log_scores.values())
+        return best, 1.0 / normalizer
+
+
+class IntentRouter:
+    """
+    Routes obvious tool intents locally so the assistant can skip the
+    tool-selection round trip to OpenAI.
+    """
+
+    def __init__(self,
+                 available_tools: Optional[Iterable[str]] = None,
+                 rules: Optional[List[IntentRule]] = None,
+                 classifier: Optional[NaiveBayesIntentClassifier] = None,
+                 threshold: float = DEFAULT_THRESHOLD,
+                 classifier_threshold: float = DEFAULT_CLASSIFIER_THRESHOLD):
+        rules = DEFAULT_RULES if rules is None else rules
+        self.available_tools = set(available_tools) if available_tools is not None else None
+        self.rules = [r for r in rules if self._is_available(r.tool_name)]
+        self.classifier = classifier
+        self.threshold = threshold
+        self.classifier_threshold = classifier_threshold
+
+    def _is_available(self, tool_name: str) -> bool:
+        return self.available_tools is None or tool_name in self.available_tools
+
+    def route(self, text: str) -> Optional[RouteMatch]:
+        """Returns a RouteMatch for a high-confidence intent, or None to defer to the model."""
+        if not text or len(text) > 200:
+            # Long messages usually carry more than one intent.
+            return None
+
+        matched = [rule for rule in self.rules if rule.matches(text)]
+        if len(matched) == 1 and matched[0].confidence >= self.threshold:
+            rule = matched[0]
+            return RouteMatch(rule.tool_name, dict(rule.arguments), rule.confidence, "rule", rule.template)
+        if len(matched) > 1:
+            return None  # Ambiguous, let the model decide.
+
+        if self.classifier is not None:
+            label, probability = self.classifier.predict(text)
+            if label != NO_TOOL and self._is_available(label) and probability >= self.classifier_threshold:
+                # Only tools with a rule can be dispatched from a classifier label,
+                # since the rule is what supplies the arguments and template.
+                rule = next((r for r in self.rules if r.tool_name == label), None)
+                if rule is not None:
+                    return RouteMatch(label, dict(rule.arguments), probability, "classifier", rule.template)
+        return None
+
+
+def build_default_router(available_tools: Iterable[str]) -> Optional[IntentRouter]:
+    """
+    Builds the router used by the assistants. Set CMUGPT_INTENT_ROUTER=0 to
+    disable it, and CMUGPT_INTENT_CLASSIFIER to a JSONL file of labelled
+    examples to enable the classifier fallback.
+    """
+    if os.getenv("CMUGPT_INTENT_ROUTER", "1") == "0":
+        return None
+    classifier = None
+    classifier_path = os.getenv("CMUGPT_INTENT_CLASSIFIER")
+    if classifier_path:
+        try:
+            classifier = NaiveBayesIntentClassifier.from_jsonl(classifier_path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Could not load intent classifier from {classifier_path}: {e}")
+    return IntentRouter(available_tools=available_tools, classifier=classifier)
+
+
+# --- Offline Evaluation ---
+
+def load_examples(path: str) -> List[Dict[str, Any]]:
+    """Loads {"text": ..., "tool": ... or null} examples from a JSONL file."""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def evaluate(router: IntentRouter, examples: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Measures the router against labelled examples. Precision is what matters
+    most: a wrong local route answers the user with the wrong tool, while a
+    missed route only costs one extra model round trip.
+    """
+    routed = correct = 0
+    per_tool: Dict[str, Dict[str, int]] = defaultdict(lambda: {"tp": 0, "fp": 0, "fn": 0})
+    mistakes = []
+    for example in examples:
+        expected = example.get("tool")
+        match = router.route(example["text"])
+        predicted = match.tool_name if match else None
+        if predicted is not None:
+            routed += 1
+            if predicted == expected:
+                correct += 1
+                per_tool[predicted]["tp"] += 1
+            else:
+                per_tool[predicted]["fp"] += 1
+                mistakes.append({"text": example["text"], "expected": expected, "predicted": predicted})
+        if expected is not None and predicted != expected:
+            per_tool[expected]["fn"] += 1
+
+    expected_total = sum(1 for ex in examples if ex.get("tool"))
+    report = {
+        "examples": len(examples),
+        "routed": routed,
+        "precision": correct / routed if routed else 1.0,
+        "recall": correct / expected_total if expected_total else 1.0,
+        "per_tool": {},
+        "mistakes": mistakes,
+    }
+    for tool, c in sorted(per_tool.items()):
+        report["per_tool"][tool] = {
+            "precision": c["tp"] / (c["tp"] + c["fp"]) if c["tp"] + c["fp"] else 1.0,
+            "recall": c["tp"] / (c["tp"] + c["fn"]) if c["tp"] + c["fn"] else 1.0,
+            **c,
+        }
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Evaluate the local intent router on a labelled JSONL set.")
+    parser.add_argument("--eval", default=os.path.join(os.path.dirname(__file__), "data", "intent_router_eval.jsonl"))
+    parser.add_argument("--train", help="JSONL examples to train the optional classifier on.")
+    parser.add_argument("--min-precision", type=float, default=0.0,
+                        help="Exit non-zero if overall precision falls below this value.")
+    args = parser.parse_args()
+
+    classifier = NaiveBayesIntentClassifier.from_jsonl(args.train) if args.train else None
+    report = evaluate(IntentRouter(classifier=classifier), load_examples(args.eval))
+    print(json.dumps(report, indent=2))
+    if report["precision"] < args.min_precision:
+        sys.exit(1)
@@ -0,0 +1,429 @@
+# metrics.py
+
+"""
+Counters and histograms for dashboards and alerts, in the Prometheus text
+format. The API server serves them at GET /metrics. The Streamlit app serves
+them from a side thread on CMUGPT_METRICS_PORT.
+
+    TOOL_CALLS.inc(tool="find_free_slots", outcome="ok")
+    TOOL_SECONDS.observe(0.42, tool="find_free_slots")
+
+Recording takes no lock, so it can sit on every hot path. Each thread counts
+into its own shard, and only that thread writes to it. A scrape copies and
+sums the shards. Shards of threads that have exited are folded into a
+retired total, so a long-running process doesn't pile them up.
+
+The API runs several uvicorn workers behind one port, each with its own
+registry. WorkerMetrics has each worker write its values to a file in a
+shared directory (CMUGPT_METRICS_DIR), and a scrape of any worker adds up
+every worker's file. Gauges of workers that have exited are dropped. Their
+counters and histograms are kept, so totals never go backwards.
+
+Every metric this app records is declared at the bottom of this module.
+"""
+
+import os
+import json
+import time
+import bisect
+import logging
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+METRICS_PORT = int(os.getenv("CMUGPT_METRICS_PORT", "0"))
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# How often each API worker writes its values for the others' scrapes
+METRICS_FLUSH_SECONDS = float(os.getenv("CMUGPT_METRICS_FLUSH_SECONDS", "5"))
+# Seconds, from a cache hit to an OpenAI call that's about to time out
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == int(value) and abs(value) < 2 ** 53:
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, registry: "MetricsRegistry", name: str, help_text: str, labels: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple["Metric", LabelValues]:
+        return self, tuple(str(labels[name]) for name in self.labels)
+
+    def render(self, samples: Dict[LabelValues, Any]) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        if not samples and not self.labels:
+            samples = {(): 0}
+        for values, value in sorted(samples.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, values)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        shard = self.registry._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down (inc/dec, summed over threads), or is read from a function at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        shard = self.registry._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Reports function() instead, for values something else already keeps (e.g. live sessions)."""
+        self._function = function
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: Any) -> None:
+        shard = self.registry._shard()
+        key = self._key(labels)
+        # Per-bucket counts (the last bucket is +Inf), then the sum and the count
+        entry = shard.get(key)
+        if entry is None:
+            entry = shard[key] = [0] * (len(self.buckets) + 3)
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+    def render(self, samples: Dict[LabelValues, Any]) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, entry in sorted(samples.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), entry):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                bucket_labels = _format_labels(self.labels, values, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            labels = _format_labels(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(entry[-2])}")
+            lines.append(f"{self.name}_count{labels} {entry[-1]}")
+        return lines
+
+
+def _merge(total: Dict, values: Dict) -> None:
+    for key, value in values.items():
+        if isinstance(value, list):
+            merged = total.setdefault(key, [0] * len(value))
+            for i, v in enumerate(value):
+                merged[i] += v
+        else:
+            total[key] = total.get(key, 0) + value
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._local = threading.local()
+        # (thread, its shard), and what threads that have exited had counted
+        self._shards: List[Tuple[threading.Thread, Dict]] = []
+        self._retired: Dict = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: Metric) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric '{metric.name}' is already registered.")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self, name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(self, name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self, name, help_text, labels, buckets=buckets))
+
+    def _shard(self) -> Dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            # Once per thread, the only time recording takes the lock
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def collect(self) -> Dict[Metric, Dict[LabelValues, Any]]:
+        """Current values per metric and label values, summed over every thread."""
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    _merge(self._retired, shard)
+            self._shards = live
+            total: Dict = {}
+            _merge(total, self._retired)
+        for _, shard in live:
+            # dict.copy() and list() are single steps for the interpreter, the owning thread may keep counting
+            _merge(total, {key: list(value) if isinstance(value, list) else value
+                           for key, value in shard.copy().items()})
+        by_metric: Dict[Metric, Dict[LabelValues, Any]] = {}
+        for (metric, values), value in total.items():
+            by_metric.setdefault(metric, {})[values] = value
+        for metric in self._metrics.values():
+            function = getattr(metric, "_function", None)
+            if function is not None:
+                try:
+                    by_metric[metric] = {(): function()}
+                except Exception:
+                    logger.exception(f"Gauge {metric.name} failed to read its value.")
+                    by_metric.pop(metric, None)
+        return by_metric
+
+    def render(self, samples: Optional[Dict[Metric, Dict[LabelValues, Any]]] = None) -> str:
+        """The Prometheus text exposition of every metric, of this process unless samples are given."""
+        if samples is None:
+            samples = self.collect()
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render(samples.get(metric, {})))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+# --- Multiple Workers ---
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class WorkerMetrics:
+    """
+    The metrics of every worker process sharing `directory`. Each worker writes
+    <pid>.json every METRICS_FLUSH_SECONDS and right before it renders, so a
+    scrape is at most that old for the other workers.
+    """
+
+    def __init__(self, registry: MetricsRegistry, directory: str, flush_seconds: float = METRICS_FLUSH_SECONDS):
+        self.registry = registry
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self.pid = os.getpid()
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self) -> "WorkerMetrics":
+        def loop():
+            while True:
+                time.sleep(self.flush_seconds)
+                try:
+                    self.flush()
+                except OSError:
+                    logger.exception("Could not write this worker's metrics.")
+        self.flush()
+        threading.Thread(target=loop, daemon=True, name="metrics-flush").start()
+        return self
+
+    def flush(self) -> None:
+        samples = [[metric.name, list(values), value]
+                   for metric, by_values in self.registry.collect().items() for values, value in by_values.items()]
+        path = os.path.join(self.directory, f"{self.pid}.json")
+        # Renamed into place, a scrape never reads half a file
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(samples, f)
+        os.replace(f"{path}.tmp", path)
+
+    def _read(self, path: str) -> List[List[Any]]:
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def _retire(self, dead: List[str]) -> None:
+        """Folds the counters and histograms of exited workers into retired.json."""
+        import fcntl
+        with open(os.path.join(self.directory, ".lock"), "w") as lock:
+            # Waits for a worker retiring the same files, then reads what it wrote
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            dead = [path for path in dead if os.path.exists(path)]
+            if not dead:
+                return
+            retired_path = os.path.join(self.directory, "retired.json")
+            retired = self._read(retired_path)
+            for path in dead:
+                retired.extend(sample for sample in self._read(path)
+                               if not isinstance(self.registry._metrics.get(sample[0]), Gauge))
+            total: Dict = {}
+            for name, values, value in retired:
+                _merge(total, {(name, tuple(values)): value})
+            with open(f"{retired_path}.tmp", "w", encoding="utf-8") as f:
+                json.dump([[name, list(values), value] for (name, values), value in total.items()], f)
+            os.replace(f"{retired_path}.tmp", retired_path)
+            for path in dead:
+                os.remove(path)
+
+    def render(self) -> str:
+        """The Prometheus text exposition of every worker's metrics, added up."""
+        self.flush()
+        live, dead = [], []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json") and name[:-5].isdigit():
+                path = os.path.join(self.directory, name)
+                (live if _pid_alive(int(name[:-5])) else dead).append(path)
+        if dead:
+            self._retire(dead)
+        total: Dict = {}
+        for path in live + [os.path.join(self.directory, "retired.json")]:
+            for name, values, value in self._read(path):
+                metric = self.registry._metrics.get(name)
+                if metric is not None:
+                    _merge(total, {(metric, tuple(values)): value})
+        samples: Dict[Metric, Dict[LabelValues, Any]] = {}
+        for (metric, values), value in total.items():
+            samples.setdefault(metric, {})[values] = value
+        return self.registry.render(samples)
+
+
+_worker_metrics: Optional[WorkerMetrics] = None
+_worker_metrics_lock = threading.Lock()
+
+
+def get_worker_metrics() -> WorkerMetrics:
+    """
+    This worker's view of REGISTRY across every worker, in CMUGPT_METRICS_DIR or
+    by default a directory shared by the workers of one uvicorn parent process.
+    """
+    global _worker_metrics
+    with _worker_metrics_lock:
+        if _worker_metrics is None:
+            directory = os.getenv("CMUGPT_METRICS_DIR") or \
+                os.path.join(tempfile.gettempdir(), f"cmugpt-metrics-{os.getppid()}")
+            _worker_metrics = WorkerMetrics(REGISTRY, directory).start()
+        return _worker_metrics
+
+
+# --- Serving ---
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would drown the app's own logs
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = "0.0.0.0") -> Optional[ThreadingHTTPServer]:
+    """
+    Serves GET /metrics from a daemon thread, for processes without their own
+    HTTP API (Streamlit). Does nothing when port is 0 or a server is running.
+    """
+    global _server
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True, name="metrics").start()
+            logger.info(f"Serving metrics on port {_server.server_address[1]}.")
+        return _server
+
+
+def instrument_session(session: Any, upstream: str) -> None:
+    """Counts the status codes of every response a requests session gets, as upstream."""
+    def count(response, *args, **kwargs):
+        HTTP_RESPONSES.inc(upstream=upstream, status=response.status_code)
+    session.hooks["response"].append(count)
+
+
+# --- Metrics ---
+
+TURNS = REGISTRY.counter("cmugpt_turns_total", "Turns processed.")
+TURN_SECONDS = REGISTRY.histogram("cmugpt_turn_seconds", "Time to answer a turn, tools included.")
+TURNS_IN_PROGRESS = REGISTRY.gauge("cmugpt_turns_in_progress", "Turns being answered right now.")
+ACTIVE_SESSIONS = REGISTRY.gauge("cmugpt_active_sessions", "Sessions live in memory, over every worker.")
+OPENAI_REQUESTS = REGISTRY.counter("cmugpt_openai_requests_total", "OpenAI chat completion calls.",
+                                   ["call_type", "model", "outcome"])
+OPENAI_SECONDS = REGISTRY.histogram("cmugpt_openai_request_seconds",
+                                    "Successful OpenAI call latency (time to first byte for streams).",
+                                    ["call_type", "model"])
+TOOL_CALLS = REGISTRY.counter("cmugpt_tool_calls_total", "Tool executions, by outcome (ok or error).",
+                              ["tool", "outcome"])
+TOOL_SECONDS = REGISTRY.histogram("cmugpt_tool_seconds", "Tool execution time, from when the handler started.", ["tool"])
+TOOL_TIMEOUTS = REGISTRY.counter("cmugpt_tool_timeouts_total", "Tool calls the turn stopped waiting for, or that never left the queue.", ["tool"])
+HTTP_RESPONSES = REGISTRY.counter("cmugpt_http_responses_total", "Upstream HTTP responses by status code.",
+                                  ["upstream", "status"])
+RETRIES = REGISTRY.counter("cmugpt_retries_total",
+                           "Repeated upstream attempts: openai (turn retries), failover (other model), hedge.",
+                           ["kind"])
+CACHE_LOOKUPS = REGISTRY.counter("cmugpt_cache_lookups_total", "Shared cache lookups by key prefix.",
+                                 ["namespace", "result"])
+DINING_LOOKUPS = REGISTRY.counter("cmugpt_dining_lookups_total",
+                                  "Dining hours questions answered from the local snapshot (index) or by web search.",
+                                  ["source"])
+MODEL_TOKENS = REGISTRY.counter("cmugpt_tokens_total",
+                                "Model tokens by model and kind (prompt, cached_prompt, completion).", ["model", "kind"])
+MODEL_COST = REGISTRY.counter("cmugpt_cost_usd_total", "Estimated model cost in USD by model, see usage_accounting.py.",
+                              ["model"])
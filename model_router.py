@@ -0,0 +1,245 @@
+# model_router.py
+
+"""
+Picks the OpenAI model for each call from recent latency and errors, rather
+than a hard-coded name. Every call type has a primary and a fallback model:
+
+    tool_selection  gpt-4o-mini-2024-07-18, falls back to gpt-4.1-mini
+    synthesis       gpt-4o-mini,            falls back to gpt-4.1-mini
+
+The router keeps the latency and outcome of the last few minutes of calls per
+call type and model. When the primary's p90 latency goes over
+CMUGPT_ROUTER_SLOW_MS or its error rate over CMUGPT_ROUTER_MAX_ERROR_RATE,
+calls go to the fallback. A small share of calls (CMUGPT_ROUTER_PROBE_RATE)
+still goes to the primary, so the router notices when it recovers. A call
+that times out or gets a 429/5xx is retried once on the fallback. The
+primary gets one attempt within its call type's timeout (ROUTE_TIMEOUTS),
+without the client's own retries, so failover happens in seconds rather
+than after several 60 s attempts. Streamed calls are tracked apart from
+complete ones, since for them the latency is the time to the first byte
+(judged against CMUGPT_ROUTER_SLOW_TTFB_MS).
+
+Synthesis calls can use a smaller model when the tool results they summarize
+are short (CMUGPT_SYNTHESIS_SMALL_MODEL, off by default). Sessions over their
+usage budget use CMUGPT_BUDGET_MODEL.
+
+Each decision is logged with the turn id, and is added to the call's usage
+entry as "route", so it shows up in API turn results too.
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from openai import APIConnectionError, InternalServerError, RateLimitError
+
+from usage_accounting import BUDGET_MODEL
+from metrics import OPENAI_REQUESTS, OPENAI_SECONDS, RETRIES
+
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+ROUTES: Dict[str, Tuple[str, str]] = {
+    "tool_selection": (os.getenv("CMUGPT_TOOL_SELECTION_MODEL", "gpt-4o-mini-2024-07-18"),
+                       os.getenv("CMUGPT_TOOL_SELECTION_FALLBACK", "gpt-4.1-mini")),
+    "synthesis": (os.getenv("CMUGPT_SYNTHESIS_MODEL", "gpt-4o-mini"),
+                  os.getenv("CMUGPT_SYNTHESIS_FALLBACK", "gpt-4.1-mini")),
+}
+SYNTHESIS_SMALL_MODEL = os.getenv("CMUGPT_SYNTHESIS_SMALL_MODEL", "")
+# Tool output (characters, this turn) a synthesis call may summarize and still use the small model
+SYNTHESIS_SMALL_MAX_CHARS = int(os.getenv("CMUGPT_SYNTHESIS_SMALL_MAX_CHARS", "2000"))
+ROUTER_SLOW_MS = float(os.getenv("CMUGPT_ROUTER_SLOW_MS", "6000"))
+# The same for streamed calls, whose latency is the time to the first byte
+ROUTER_SLOW_TTFB_MS = float(os.getenv("CMUGPT_ROUTER_SLOW_TTFB_MS", "3000"))
+# Seconds one attempt on a model that has a fallback may take, before failing over
+ROUTE_TIMEOUTS: Dict[str, float] = {
+    "tool_selection": float(os.getenv("CMUGPT_TOOL_SELECTION_TIMEOUT", "20")),
+    "synthesis": float(os.getenv("CMUGPT_SYNTHESIS_TIMEOUT", "30")),
+}
+ROUTER_MAX_ERROR_RATE = float(os.getenv("CMUGPT_ROUTER_MAX_ERROR_RATE", "0.2"))
+ROUTER_PROBE_RATE = float(os.getenv("CMUGPT_ROUTER_PROBE_RATE", "0.05"))
+# Calls older than this no longer count, so a model that was slow earlier gets another chance
+ROUTER_WINDOW_SECONDS = 300
+ROUTER_MAX_SAMPLES = 200
+# Fewer calls than this in the window say nothing about a model, it's treated as healthy
+ROUTER_MIN_SAMPLES = 5
+# What's worth retrying on another model right away, bad requests would fail there too
+FAILOVER_ERRORS = (APIConnectionError, RateLimitError, InternalServerError)
+
+
+@dataclass
+class RouteDecision:
+    """The model picked for one call, and why."""
+    call_type: str
+    model: str
+    reason: str  # "primary", "fallback", "failover", "probe", "small" or "budget"
+    latency_ms: Optional[float] = None
+
+
+def _percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+class ModelHealth:
+    """Latency and outcome of one model's recent calls of one type."""
+
+    def __init__(self, slow_ms: float = ROUTER_SLOW_MS):
+        self.slow_ms = slow_ms
+        # (monotonic time, latency ms, ok)
+        self.samples: Deque[Tuple[float, float, bool]] = deque(maxlen=ROUTER_MAX_SAMPLES)
+        self._lock = threading.Lock()
+
+    def record(self, latency_ms: float, ok: bool) -> None:
+        with self._lock:
+            self.samples.append((time.monotonic(), latency_ms, ok))
+
+    def _recent(self) -> List[Tuple[float, float, bool]]:
+        cutoff = time.monotonic() - ROUTER_WINDOW_SECONDS
+        with self._lock:
+            while self.samples and self.samples[0][0] < cutoff:
+                self.samples.popleft()
+            return list(self.samples)
+
+    def stats(self) -> Dict[str, Any]:
+        samples = self._recent()
+        latencies = [latency for _, latency, ok in samples if ok]
+        errors = sum(1 for _, _, ok in samples if not ok)
+        return {
+            "calls": len(samples),
+            "errors": errors,
+            "error_rate": round(errors / len(samples), 3) if samples else 0.0,
+            "p50_ms": round(_percentile(latencies, 50), 1) if latencies else None,
+            "p90_ms": round(_percentile(latencies, 90), 1) if latencies else None,
+        }
+
+    def degraded(self) -> bool:
+        stats = self.stats()
+        if stats["calls"] < ROUTER_MIN_SAMPLES:
+            return False
+        return (stats["error_rate"] > ROUTER_MAX_ERROR_RATE
+                or (stats["p90_ms"] is not None and stats["p90_ms"] > self.slow_ms))
+
+
+class ModelRouter:
+    """
+    Shared by every session in the process, so one slow turn's experience
+    informs the next session's calls.
+    """
+
+    def __init__(self, routes: Optional[Dict[str, Tuple[str, str]]] = None,
+                 small_model: str = SYNTHESIS_SMALL_MODEL, probe_rate: float = ROUTER_PROBE_RATE):
+        self.routes = routes or ROUTES
+        self.small_model = small_model
+        self.probe_rate = probe_rate
+        # By (call type, model, streamed)
+        self._health: Dict[Tuple[str, str, bool], ModelHealth] = {}
+        self._decisions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def health(self, call_type: str, model: str, stream: bool = False) -> ModelHealth:
+        with self._lock:
+            health = self._health.get((call_type, model, stream))
+            if health is None:
+                health = self._health[(call_type, model, stream)] = ModelHealth(
+                    ROUTER_SLOW_TTFB_MS if stream else ROUTER_SLOW_MS)
+            return health
+
+    def choose(self, call_type: str, over_budget: bool = False, small_ok: bool = False,
+               stream: bool = False) -> RouteDecision:
+        primary, fallback = self.routes[call_type]
+        if over_budget:
+            return RouteDecision(call_type, BUDGET_MODEL, "budget")
+        if small_ok and self.small_model and call_type == "synthesis" \
+                and not self.health(call_type, self.small_model, stream).degraded():
+            return RouteDecision(call_type, self.small_model, "small")
+        if not self.health(call_type, primary, stream).degraded():
+            return RouteDecision(call_type, primary, "primary")
+        if self.health(call_type, fallback, stream).degraded():
+            # Both slow, stay on the primary rather than move the load around
+            return RouteDecision(call_type, primary, "primary")
+        if random.random() < self.probe_rate:
+            return RouteDecision(call_type, primary, "probe")
+        return RouteDecision(call_type, fallback, "fallback")
+
+    def complete(self, client: Any, call_type: str, over_budget: bool = False, small_ok: bool = False,
+                 **kwargs) -> Tuple[Any, RouteDecision]:
+        """
+        client.chat.completions.create(**kwargs) on the chosen model. Returns the
+        response (or stream) and the decision. For streams the latency recorded is
+        the time to the first byte.
+        """
+        decision = self.choose(call_type, over_budget, small_ok, bool(kwargs.get("stream")))
+        fallback = self.routes[call_type][1]
+        if decision.model == fallback:
+            # Nothing to fail over to, so the client's own retries and timeout apply
+            return self._call(client, decision, kwargs), decision
+        # One short attempt: the SDK would otherwise retry a hung model several times before failover
+        attempt_client = client.with_options(max_retries=0, timeout=ROUTE_TIMEOUTS.get(call_type, 30.0))
+        try:
+            return self._call(attempt_client, decision, kwargs), decision
+        except FAILOVER_ERRORS as e:
+            logger.warning(f"{call_type} call to {decision.model} failed ({type(e).__name__}), retrying on {fallback}.")
+            decision = RouteDecision(call_type, fallback, "failover")
+            RETRIES.inc(kind="failover")
+            return self._call(client, decision, kwargs), decision
+
+    def _call(self, client: Any, decision: RouteDecision, kwargs: Dict[str, Any]) -> Any:
+        with self._lock:
+            self._decisions[decision.reason] = self._decisions.get(decision.reason, 0) + 1
+        health = self.health(decision.call_type, decision.model, bool(kwargs.get("stream")))
+        started = time.perf_counter()
+        try:
+            response = client.chat.completions.create(model=decision.model, **kwargs)
+        except Exception as e:
+            health.record((time.perf_counter() - started) * 1000, ok=False)
+            OPENAI_REQUESTS.inc(call_type=decision.call_type, model=decision.model, outcome=type(e).__name__)
+            raise
+        elapsed = time.perf_counter() - started
+        decision.latency_ms = round(elapsed * 1000, 1)
+        health.record(decision.latency_ms, ok=True)
+        OPENAI_REQUESTS.inc(call_type=decision.call_type, model=decision.model, outcome="ok")
+        OPENAI_SECONDS.observe(elapsed, call_type=decision.call_type, model=decision.model)
+        logger.info(f"{decision.call_type} call routed to {decision.model} ({decision.reason})",
+                    extra={"route": decision.reason, "model": decision.model, "latency_ms": decision.latency_ms})
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            keys = list(self._health)
+            decisions = dict(self._decisions)
+        models: Dict[str, Dict[str, Any]] = {}
+        for call_type, model, stream in keys:
+            health = self.health(call_type, model, stream)
+            name = f"{model} (stream)" if stream else model
+            models.setdefault(call_type, {})[name] = {**health.stats(), "degraded": health.degraded()}
+        return {"decisions": decisions, "models": models}
+
+
+def tool_output_chars(messages: List[Dict[str, Any]]) -> int:
+    """Characters of tool results since the last user message, what a synthesis call summarizes."""
+    total = 0
+    for message in reversed(messages):
+        role = message.get("role") if isinstance(message, dict) else getattr(message, "role", None)
+        if role == "user":
+            break
+        if role == "tool":
+            total += len(message.get("content") or "")
+    return total
+
+
+_router: Optional[ModelRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_model_router() -> ModelRouter:
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+        return _router
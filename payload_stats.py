@@ -0,0 +1,91 @@
+# payload_stats.py
+
+"""
+Per-endpoint payload sizes and JSON parse times for upstream API calls
+(Canvas, Google Calendar), so the effect of field masks and gzip is visible.
+
+    from payload_stats import PAYLOAD_METER
+    PAYLOAD_METER.stats()  # {"canvas:courses": {"calls": 3, "bytes": ..., "wire_bytes": ..., "parse_ms": ...}}
+"""
+
+import json
+import time
+import logging
+import threading
+from typing import Any, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PayloadMeter:
+    """Thread-safe running totals per endpoint name."""
+
+    def __init__(self):
+        self._totals: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, body_bytes: int, wire_bytes: Optional[int], parse_seconds: float) -> None:
+        # wire_bytes is what crossed the network (compressed), when the client exposes it
+        wire = body_bytes if wire_bytes is None else wire_bytes
+        with self._lock:
+            totals = self._totals.setdefault(name, {"calls": 0, "bytes": 0, "wire_bytes": 0, "parse_seconds": 0.0})
+            totals["calls"] += 1
+            totals["bytes"] += body_bytes
+            totals["wire_bytes"] += wire
+            totals["parse_seconds"] += parse_seconds
+        logger.debug(f"{name}: {body_bytes} bytes ({wire} on the wire), parsed in {parse_seconds * 1000:.2f} ms")
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                name: {"calls": int(t["calls"]), "bytes": int(t["bytes"]), "wire_bytes": int(t["wire_bytes"]),
+                       "parse_ms": round(t["parse_seconds"] * 1000, 3)}
+                for name, t in self._totals.items()
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._totals.clear()
+
+
+PAYLOAD_METER = PayloadMeter()
+
+
+def project(value: Any, keep: Optional[Iterable[str]]) -> Any:
+    """Keeps only the `keep` keys of a dict, or of each dict in a list."""
+    if keep is None:
+        return value
+    keep = set(keep)
+    if isinstance(value, list):
+        return [{k: v for k, v in item.items() if k in keep} if isinstance(item, dict) else item for item in value]
+    if isinstance(value, dict):
+        return {k: v for k, v in value.items() if k in keep}
+    return value
+
+
+def parse_json(name: str, content: bytes, wire_bytes: Optional[int] = None,
+               keep: Optional[Iterable[str]] = None) -> Any:
+    """
+    json.loads with metering. With keep, only those top-level keys (per item
+    for lists) survive, so the rest is dropped before anything is cached.
+    """
+    started = time.perf_counter()
+    value = project(json.loads(content), keep)
+    PAYLOAD_METER.record(name, len(content), wire_bytes, time.perf_counter() - started)
+    return value
+
+
+def metered_json_model(api: str):
+    """A googleapiclient JsonModel that records response sizes and parse times as "google:<api>"."""
+    # Imported here so this module stays cheap to import
+    from googleapiclient.model import JsonModel
+
+    class MeteredJsonModel(JsonModel):
+
+        def deserialize(self, content):
+            started = time.perf_counter()
+            body = super().deserialize(content)
+            PAYLOAD_METER.record(f"google:{api}", len(content), None, time.perf_counter() - started)
+            return body
+
+    return MeteredJsonModel()
@@ -1,10 +1,17 @@
 import requests
 from typing import List, Dict, Any, Optional
+from http_cassette import mount_requests
+from hedged_requests import hedged
+from metrics import instrument_session
 
 class PerplexityAPI:
     def __init__(self, api_key: str):
         self.api_key = api_key
         self.base_url = "https://api.perplexity.ai/chat/completions"
+        # A session keeps the connection to Perplexity alive between searches
+        self.session = requests.Session()
+        mount_requests(self.session, "perplexity")
+        instrument_session(self.session, "perplexity")
         self.default_system_messages = [
             {
                 "role": "system",
@@ -48,7 +55,11 @@ class PerplexityAPI:
         }
 
         try:
-            response = requests.post(
+            # A search is idempotent, so it may be hedged (CMUGPT_HEDGE_REQUESTS=1)
+            response = hedged(
+                self.session,
+                "perplexity",
+                "POST",
                 self.base_url,
                 json=payload,
                 headers=self._get_headers(),
@@ -1,24 +1,79 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import os
+import re
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
 from dotenv import load_dotenv
 from perplexity_cmugpt.search_class_one import PerplexityAPI  # Changed from relative import
+from cache_backends import get_cache_backend
+from cache_warmer import TokenBucket, lower_thread_priority
+from usage_accounting import UsageLedger
+
+logger = logging.getLogger(__name__)
+
+# Perplexity answers about CMU change slowly, share them across sessions and workers for an hour
+SEARCH_CACHE_TTL = 3600
+# The tool searches are made for, usage is attributed to it
+SEARCH_TOOL_NAME = "general_purpose_knowledge_search"
+# Related questions kept from each answer, for the prefetcher
+MAX_RELATED_QUESTIONS = 5
 
 class CMUPerplexitySearch:
-    def __init__(self):
+    def __init__(self, usage=None):
         load_dotenv()
         api_key = os.getenv('PERPLEXITY_API_KEY')
         if not api_key:
             raise ValueError("PERPLEXITY_API_KEY not found in environment variables")
         
         self.api = PerplexityAPI(api_key)
+        self.cache = get_cache_backend()
+        # The session's UsageLedger, searches are recorded against the tool that makes them
+        self.usage = usage
+        # Shared by every session in the process, None unless CMUGPT_PREFETCH_RELATED=1
+        self.prefetcher = get_related_prefetcher()
+
+    @staticmethod
+    def cache_key(query: str) -> str:
+        normalized = " ".join(query.lower().split())
+        return "perplexity:" + hashlib.sha1(normalized.encode("utf-8")).hexdigest()
         
     def search(self, query: str) -> Dict[str, Any]:
+        cached = self.cache.get(self.cache_key(query))
+        if self.prefetcher is not None:
+            # Counts prefetch hits, and finds a prefetched answer to a differently worded follow-up
+            cached = self.prefetcher.claim(self, query, cached)
+        if cached is not None:
+            return cached
+        result = self._search(query)
+        if "error" not in result:
+            self.cache.set(self.cache_key(query), result, SEARCH_CACHE_TTL)
+            if self.prefetcher is not None:
+                self.prefetcher.schedule(self, result.get("related_questions", []))
+        return result
+
+    def warm(self, query: str, usage: Optional[UsageLedger] = None) -> bool:
+        """Caches the answer to query unless it is cached already. Returns True if a search was made."""
+        if self.cache.get(self.cache_key(query)) is not None:
+            return False
+        result = self._search(query, usage, call_type="prefetch")
+        if "error" in result:
+            raise RuntimeError(result["error"])
+        self.cache.set(self.cache_key(query), result, SEARCH_CACHE_TTL)
+        return True
+
+    def _search(self, query: str, usage: Optional[UsageLedger] = None, call_type: str = "search") -> Dict[str, Any]:
         try:
             # Format query to ensure CMU context
             cmu_query = f"At Carnegie Mellon University, {query}"
             
             # Get response from Perplexity
             response = self.api.send_message(user_message=cmu_query)
+            ledger = self.usage if usage is None else usage
+            if ledger is not None and response:
+                ledger.record_perplexity(response, tool=SEARCH_TOOL_NAME, call_type=call_type)
             
             if not response or 'choices' not in response:
                 return {
@@ -33,7 +88,9 @@ class CMUPerplexitySearch:
             return {
                 "search_query": query,
                 "answer": answer,
-                "source": "Perplexity AI"
+                "source": "Perplexity AI",
+                # Not shown to the model (the tool keeps only "answer"), the prefetcher warms them
+                "related_questions": list(response.get("related_questions") or [])[:MAX_RELATED_QUESTIONS],
             }
             
         except Exception as e:
@@ -41,4 +98,265 @@ class CMUPerplexitySearch:
                 "search_query": query,
                 "answer": "I apologize, but I encountered an error while searching.",
                 "error": str(e)
-            }
\ No newline at end of file
+            }
+
+
+# --- Speculative Search ---
+
+# Rough per-request cost of a Perplexity sonar-small search (request fee plus tokens)
+SPECULATIVE_SEARCH_COST_USD = 0.0052
+
+_QUESTION_RE = re.compile(r"^\s*(who|what|when|where|why|how|which|is|are|does|do|can|tell me|explain)\b|\?\s*$", re.IGNORECASE)
+_PERSONAL_RE = re.compile(r"\b(my|me|mine|i'm|i am|calendar|canvas|schedule|remind|event|due|cmu\s?eats|cmu\s?courses)\b", re.IGNORECASE)
+_STOPWORDS = {"a", "an", "the", "at", "of", "in", "on", "for", "to", "is", "are", "was", "were", "what", "who",
+              "when", "where", "how", "why", "which", "does", "do", "did", "can", "about", "and", "or", "tell",
+              "me", "it", "there", "carnegie", "mellon", "university", "cmu"}
+
+
+def _query_terms(text: str) -> set:
+    # Truncating to a 5 character prefix is a crude stemmer, but enough to match "founded" with "founding"
+    return {t[:5] for t in re.findall(r"[a-z0-9]+", text.lower()) if t not in _STOPWORDS}
+
+
+def _similarity(a: str, b: str) -> float:
+    terms_a, terms_b = _query_terms(a), _query_terms(b)
+    if not terms_a or not terms_b:
+        return 0.0
+    return len(terms_a & terms_b) / len(terms_a | terms_b)
+
+
+class SpeculativeSearch:
+    """
+    Starts a Perplexity search with the raw user text while the first OpenAI
+    call is still deciding whether to call general_purpose_knowledge_search.
+    If the model's query is close enough to the user text, the speculative
+    result is used; otherwise it is kept in a small cache for later turns.
+    """
+
+    _executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="speculative-search")
+
+    def __init__(self, search: CMUPerplexitySearch, match_threshold: float = 0.5,
+                 cost_per_search: float = SPECULATIVE_SEARCH_COST_USD, cache_size: int = 32):
+        self.search = search
+        self.match_threshold = match_threshold
+        self.cost_per_search = cost_per_search
+        self.cache_size = cache_size
+        self._pending: Optional[Tuple[str, Future]] = None
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+
+    @staticmethod
+    def looks_like_general_knowledge(text: str) -> bool:
+        """Cheap check for questions the model is likely to send to Perplexity."""
+        return bool(_QUESTION_RE.search(text)) and not _PERSONAL_RE.search(text) and len(text) < 300
+
+    def start(self, user_text: str) -> bool:
+        """Kicks off a speculative search for this turn. Returns True if one was started."""
+        self.finish_turn()
+        if not self.looks_like_general_knowledge(user_text):
+            return False
+        self._pending = (user_text, self._executor.submit(self.search.search, user_text))
+        self.started += 1
+        return True
+
+    def claim(self, query: str) -> Optional[Dict[str, Any]]:
+        """Returns a speculative result matching the model's query, or None on a miss."""
+        if self._pending is not None:
+            speculative_text, future = self._pending
+            if _similarity(query, speculative_text) >= self.match_threshold:
+                self._pending = None
+                self.hits += 1
+                return future.result()
+
+        with self._lock:
+            for cached_text in list(self._cache):
+                if _similarity(query, cached_text) >= self.match_threshold:
+                    self.hits += 1
+                    return self._cache.pop(cached_text)
+
+        if self._pending is not None:
+            # A speculation was in flight but the model asked for something else
+            self.misses += 1
+        return None
+
+    def finish_turn(self) -> None:
+        """Cancels an unclaimed speculative search, or caches its result once it lands."""
+        if self._pending is None:
+            return
+        speculative_text, future = self._pending
+        self._pending = None
+        if future.cancel():
+            self.cancelled += 1
+            return
+        future.add_done_callback(lambda f: self._store(speculative_text, f))
+
+    def _store(self, text: str, future: Future) -> None:
+        if future.cancelled() or future.exception() is not None:
+            return
+        result = future.result()
+        if result.get("error"):
+            return
+        with self._lock:
+            self._cache[text] = result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        # Every speculation that was neither used nor cancelled in time cost a search for nothing
+        wasted = self.started - self.hits - self.cancelled - (1 if self._pending is not None else 0)
+        return {
+            "started": self.started,
+            "hits": self.hits,
+            "misses": self.misses,
+            "cancelled": self.cancelled,
+            "wasted": wasted,
+            "hit_rate": self.hits / self.started if self.started else 0.0,
+            "wasted_cost_usd": round(wasted * self.cost_per_search, 4),
+        }
+
+
+def build_speculative_search(search: CMUPerplexitySearch) -> Optional[SpeculativeSearch]:
+    """Speculative search is opt-in, set CMUGPT_SPECULATIVE_SEARCH=1 to enable it."""
+    if os.getenv("CMUGPT_SPECULATIVE_SEARCH", "0") != "1":
+        return None
+    return SpeculativeSearch(search)
+
+
+# --- Related Question Prefetch ---
+
+PREFETCH_TOP_K = int(os.getenv("CMUGPT_PREFETCH_TOP_K", "2"))
+# Spend cap for prefetching across the process, in USD per hour
+PREFETCH_BUDGET_PER_HOUR = float(os.getenv("CMUGPT_PREFETCH_BUDGET_PER_HOUR", "0.50"))
+# Questions waiting for the prefetch thread, past this new ones are skipped
+PREFETCH_MAX_PENDING = 8
+# Prefetched questions remembered for hit accounting
+PREFETCH_REMEMBER = 256
+
+
+class RelatedQuestionPrefetcher:
+    """
+    Warms the search cache with the top related questions Perplexity suggests
+    alongside an answer, so the follow-up a student is likely to ask next is a
+    cache hit. Searches run on one low-priority thread and are capped by a
+    spend budget: a token bucket refilled at budget_per_hour / cost_per_search
+    searches per hour. Questions over the budget or the backlog limit are
+    skipped, never queued.
+    """
+
+    def __init__(self, top_k: int = PREFETCH_TOP_K, budget_per_hour: float = PREFETCH_BUDGET_PER_HOUR,
+                 cost_per_search: float = SPECULATIVE_SEARCH_COST_USD, match_threshold: float = 0.5,
+                 max_pending: int = PREFETCH_MAX_PENDING):
+        self.top_k = top_k
+        self.match_threshold = match_threshold
+        self.max_pending = max_pending
+        self.limiter = TokenBucket(budget_per_hour / cost_per_search / 60, burst=max(1, top_k))
+        # Prefetch spend shows up in usage_accounting.USAGE_METER as the "prefetch" call type
+        self.usage = UsageLedger(token_budget=0, cost_budget=0)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="related-prefetch",
+                                            initializer=lower_thread_priority)
+        # Cache key -> question, for prefetched answers nobody has used yet
+        self._prefetched: "OrderedDict[str, str]" = OrderedDict()
+        self._queued: set = set()
+        self._lock = threading.Lock()
+        self.counters = {"scheduled": 0, "prefetched": 0, "hits": 0, "already_cached": 0,
+                         "over_budget": 0, "backlog": 0, "failed": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def schedule(self, search: CMUPerplexitySearch, questions: List[str]) -> int:
+        """Queues the top_k questions for prefetching, returns how many were queued."""
+        queued = 0
+        for question in questions[:self.top_k]:
+            key = search.cache_key(question)
+            with self._lock:
+                if key in self._queued or key in self._prefetched:
+                    continue
+                if len(self._queued) >= self.max_pending:
+                    self.counters["backlog"] += 1
+                    continue
+            if not self.limiter.try_acquire():
+                self._count("over_budget")
+                continue
+            with self._lock:
+                self._queued.add(key)
+                self.counters["scheduled"] += 1
+            self._executor.submit(self._run, search, question, key)
+            queued += 1
+        return queued
+
+    def _run(self, search: CMUPerplexitySearch, question: str, key: str) -> None:
+        try:
+            searched = search.warm(question, self.usage)
+        except Exception as e:
+            logger.debug(f"Prefetching '{question}' failed: {e}")
+            self._count("failed")
+            return
+        finally:
+            with self._lock:
+                self._queued.discard(key)
+        if not searched:
+            self._count("already_cached")
+            return
+        with self._lock:
+            self.counters["prefetched"] += 1
+            self._prefetched[key] = question
+            while len(self._prefetched) > PREFETCH_REMEMBER:
+                self._prefetched.popitem(last=False)
+
+    def claim(self, search: CMUPerplexitySearch, query: str,
+              cached: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Called on every search with its cache lookup. Counts a hit when the
+        answer was prefetched, and on a miss returns a prefetched answer to a
+        similar enough question, if there is one.
+        """
+        key = search.cache_key(query)
+        with self._lock:
+            if cached is not None:
+                if self._prefetched.pop(key, None) is not None:
+                    self.counters["hits"] += 1
+                return cached
+            candidates = [(k, q) for k, q in self._prefetched.items()
+                          if _similarity(query, q) >= self.match_threshold]
+        for candidate_key, _ in candidates:
+            result = search.cache.get(candidate_key)
+            if result is not None:
+                with self._lock:
+                    if self._prefetched.pop(candidate_key, None) is not None:
+                        self.counters["hits"] += 1
+                return result
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self.counters)
+            pending = len(self._queued)
+        spend = self.usage.total["cost_usd"]
+        return {
+            **counters,
+            "pending": pending,
+            "hit_rate": counters["hits"] / counters["prefetched"] if counters["prefetched"] else 0.0,
+            "spend_usd": round(spend, 4),
+            "spend_per_hit_usd": round(spend / counters["hits"], 4) if counters["hits"] else None,
+        }
+
+
+_prefetcher: Optional[RelatedQuestionPrefetcher] = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_related_prefetcher() -> Optional[RelatedQuestionPrefetcher]:
+    """The process-wide prefetcher, or None unless CMUGPT_PREFETCH_RELATED=1 (it spends money)."""
+    global _prefetcher
+    if os.getenv("CMUGPT_PREFETCH_RELATED", "0") != "1":
+        return None
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = RelatedQuestionPrefetcher()
+        return _prefetcher
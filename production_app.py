@@ -1,73 +1,163 @@
+import uuid
 import streamlit as st
 from production_cmugpt_assistant import CMUGPTAssistant
-
+from session_manager import SessionManager
+from cache_warmer import build_cache_warmer
+from calendar_queue import get_calendar_queue
+from warmup import warm_up_in_background, warmup_enabled
+from structured_logging import configure_logging
+from metrics import ACTIVE_SESSIONS, start_metrics_server
+from dining_hours import get_dining_hours
+
+# Only the most recent messages are rendered, older ones load a page at a time
+HISTORY_PAGE_SIZE = 20
+# Function calls shown per sidebar page, newest first
+SIDEBAR_PAGE_SIZE = 5
+# How often to check for finished background calendar changes
+NOTIFICATION_POLL_SECONDS = 3
+# How often the sidebar picks up function calls from new turns, without rerunning the page
+SIDEBAR_POLL_SECONDS = 2
+
+# JSON logs on a background writer thread (a no-op after the first script run)
+configure_logging()
 
 st.title("CMUGPT Chat Assistant")
 
 
 
-# Initialize CMUGPTAssistant in session state
-if 'assistant' not in st.session_state:
-    st.session_state['assistant'] = CMUGPTAssistant()
-    st.session_state['messages'] = []
-    st.session_state['functions_called'] = []
-
-
-
-# Display the conversation
-for message in st.session_state['messages']:
-    if message['role'] == 'user':
+@st.cache_resource
+def get_session_manager():
+    # One manager per process, idle conversations are written to SQLite and evicted from memory
+    if warmup_enabled():
+        warm_up_in_background()
+    warmer = build_cache_warmer()
+    if warmer is None:
+        manager = SessionManager(CMUGPTAssistant)
+    else:
+        # Canvas courses and the upcoming week are prefetched as soon as a session goes live,
+        # and kept warm for recently active sessions
+        manager = SessionManager(CMUGPTAssistant, on_load=warmer.warm, on_drop=warmer.cancel)
+        warmer.start_schedule(manager.recent_sessions)
+    # Prometheus metrics from a side thread, when CMUGPT_METRICS_PORT is set
+    ACTIVE_SESSIONS.set_function(lambda: manager.active_sessions)
+    start_metrics_server()
+    # The dining hours snapshot, refreshed hourly from a side thread
+    get_dining_hours()
+    return manager
+
+
+# Each browser tab only keeps its session id, the assistant lives in the session manager
+if 'session_id' not in st.session_state:
+    st.session_state['session_id'] = uuid.uuid4().hex
+    st.session_state['history_shown'] = HISTORY_PAGE_SIZE
+session_id = st.session_state['session_id']
+session_manager = get_session_manager()
+
+
+def current_assistant():
+    # Looked up on every (fragment) run, the session may have been evicted and rehydrated in between
+    return session_manager.get(session_id)
+
+
+def panels_state(assistant):
+    # The panels are drawn outside any fragment, opening or closing one needs a full rerun
+    return (assistant.show_eats, assistant.show_courses)
+
+
+@st.fragment
+def chat():
+    # Submitting a message only reruns this fragment. The page reruns only when the turn
+    # opened a panel, new function calls reach the sidebar through its own polling
+    assistant = current_assistant()
+    transcript = list(assistant.messages.transcript())
+    shown = st.session_state['history_shown']
+    hidden = len(transcript) - shown
+    if hidden > 0:
+        if st.button(f"Show earlier messages ({hidden} hidden)"):
+            st.session_state['history_shown'] += HISTORY_PAGE_SIZE
+            st.rerun(scope="fragment")
+
+    # Display the conversation, straight from the assistant's message store
+    for role, content in transcript[-shown:]:
+        with st.chat_message(role):
+            st.write(content)
+
+    # Chat input
+    prompt = st.chat_input("Ask me anything about Carnegie Mellon University")
+
+    if prompt:
+        # Display user's message
         with st.chat_message('user'):
-            st.write(message['content'])
-    elif message['role'] == 'assistant':
-        with st.chat_message('assistant'):
-            st.write(message['content'])
-
-# Chat input
-prompt = st.chat_input("Ask me anything about Carnegie Mellon University")
-
-if prompt:
-    # Add user's message to session state
-    st.session_state['messages'].append({"role": "user", "content": prompt})
-
-    # Display user's message
-    with st.chat_message('user'):
-        st.write(prompt)
+            st.write(prompt)
 
-    # Process user input
-    assistant_response = st.session_state['assistant'].process_user_input(prompt)
+        # Process user input
+        before = panels_state(assistant)
+        assistant_response = assistant.process_user_input(prompt)
+        session_manager.save(session_id, assistant)
 
-    # Add assistant's message to session state
-    st.session_state['messages'].append({"role": "assistant", "content": assistant_response})
+        # Display assistant's message
+        with st.chat_message('assistant'):
+            st.write(assistant_response)
 
-    # Display assistant's message
-    with st.chat_message('assistant'):
-        st.write(assistant_response)
+        if panels_state(assistant) != before:
+            st.rerun()
 
-    # Get functions called
-    functions_called = st.session_state['assistant'].get_functions_called()
 
-    # Update functions_called in session state
-    st.session_state['functions_called'] = functions_called
-    st.rerun()
+chat()
 
-if st.session_state['assistant'].show_eats:
+assistant = current_assistant()
+if assistant.show_eats:
     st.write("CMU EATS")
     st.components.v1.iframe("https://cmueats.com", height=700, scrolling=True)
     if st.button("Close", type="primary"):
-        st.session_state['assistant'].show_eats = False
+        assistant.show_eats = False
+        session_manager.save(session_id, assistant)
         st.rerun()
-if st.session_state['assistant'].show_courses:
+if assistant.show_courses:
     st.write("CMU COURSES")
     st.components.v1.iframe("https://cmucourses.com", height=700, scrolling=True)
     if st.button("Close", type="primary"):
-        st.session_state['assistant'].show_courses = False
+        assistant.show_courses = False
+        session_manager.save(session_id, assistant)
         st.rerun()
 
+
+@st.fragment(run_every=SIDEBAR_POLL_SECONDS)
+def functions_sidebar():
+    # Paging, loading results and new calls from a turn only rerun this fragment
+    st.title("Functions Called")
+    # Polled while the tab is open: peeked, so an idle tab can still be evicted and isn't rehydrated by the poll
+    assistant = session_manager.peek(session_id)
+    if assistant is None:
+        st.caption("Send a message to load this session's function calls.")
+        return
+    functions = assistant.get_functions_called()[::-1]
+    pages = max(1, -(-len(functions) // SIDEBAR_PAGE_SIZE))
+    page = st.number_input("Page", min_value=1, max_value=pages, value=1, step=1) if pages > 1 else 1
+    for func in functions[(page - 1) * SIDEBAR_PAGE_SIZE:page * SIDEBAR_PAGE_SIZE]:
+        with st.expander(f"Function: {func['function_name']}"):
+            st.write(f"**Arguments:** {func['arguments']}")
+            # Full results can be large, only fetch and render them on request
+            if st.toggle("Show result", key=f"show_{func['result_ref']}"):
+                result = assistant.get_function_result(func['result_ref'])
+                st.write(f"**Result:** {result}" if result is not None else "*Result is no longer kept for this session.*")
+
+
 # Display functions called in the sidebar
-st.sidebar.title("Functions Called")
-for func in st.session_state['functions_called']:
-    st.sidebar.subheader(f"Function: {func['function_name']}")
-    st.sidebar.write(f"**Arguments:** {func['arguments']}")
-    st.sidebar.write(f"**Result:** {func['result']}")
-    st.sidebar.write("---")
+with st.sidebar:
+    functions_sidebar()
+
+
+@st.fragment(run_every=NOTIFICATION_POLL_SECONDS)
+def calendar_notifications(queue):
+    # Write-behind calendar changes finish after the reply, tell the user when they do
+    for note in queue.pop_notifications(session_id):
+        if note['status'] == 'done':
+            st.toast(f"Done: {note['label']}", icon="✅")
+        else:
+            st.toast(f"Failed: {note['label']} ({note['error']})", icon="⚠️")
+
+
+calendar_queue = get_calendar_queue()
+if calendar_queue is not None:
+    calendar_notifications(calendar_queue)
@@ -3,41 +3,74 @@ import json
 from dotenv import load_dotenv
 import os
 import time
-from perplexity_integration import CMUPerplexitySearch  # Changed from relative import
-import requests
-from datetime import datetime
-
-from openai import OpenAI, APITimeoutError, APIError
-import json
-from dotenv import load_dotenv
-import os
-import time
-from perplexity_integration import CMUPerplexitySearch  # Changed from relative import
-import requests
-from googleapiclient.discovery import build
-from google.oauth2 import service_account
-import datetime
-import os.path
+import uuid
+import logging
+import functools
+import threading
 from datetime import datetime, timedelta
-from tzlocal import get_localzone  # Auto-detect user's timezone
-from zoneinfo import ZoneInfo
-import difflib
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+from perplexity_integration import CMUPerplexitySearch, build_speculative_search  # Changed from relative import
+from intent_router import build_default_router
+from tool_registry import TOOL_REGISTRY
+from result_compactor import ResultStore, CompactionLedger
+from session_memory import MessageStore, new_functions_called, memory_footprint, MAX_FUNCTIONS_CALLED, MAX_RESULT_CHARS
+from cache_backends import get_cache_backend
+from free_busy import BusyIndex, event_intervals, freebusy_intervals, format_slot
+from payload_stats import metered_json_model
+from calendar_queue import get_calendar_queue, new_event_id
+from structured_logging import start_turn
+from usage_accounting import UsageLedger, BUDGET_HISTORY_MESSAGES
+from model_router import get_model_router, tool_output_chars, SYNTHESIS_SMALL_MAX_CHARS
+from http_cassette import openai_http_client, wrap_google_http, replaying
+from metrics import TURNS, TURN_SECONDS, TURNS_IN_PROGRESS, RETRIES
+# The Google client libraries, tzlocal, difflib and canvas_tools are imported where they are
+# first used, so booting a worker or starting a session doesn't pay for them (see warmup.py)
 
-import canvas_tools
 
 
 #from courses import get_courses, get_course_by_id, get_fces, get_fces_by_id, get_schedules
 
+logger = logging.getLogger(__name__)
+
 # This scope allows for some modification to the calendar, as opposed to /calendar/readonly
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
 
+# The upcoming-week window is cached (and prefetched by cache_warmer.py), writes invalidate it
+UPCOMING_EVENTS_DAYS = 7
+UPCOMING_EVENTS_TTL = 300
+UPCOMING_EVENTS_CACHE_KEY = f"calendar:upcoming:{UPCOMING_EVENTS_DAYS}d"
+# Partial responses: only the event fields the tools read come back from Google
+EVENT_FIELDS = "items(id,summary,start,end,status,transparency),nextPageToken"
+# find_free_slots lists at most this many slots per day
+MAX_FREE_SLOTS_PER_DAY = 4
+MAX_FREE_SLOT_DAYS = 14
+
+@functools.lru_cache(maxsize=1)
+def get_openai_client():
+    # One client per process so every session (and warmup.py) shares its connection pool
+    return OpenAI(
+        api_key=os.getenv('OPENAI_API_KEY'),
+        timeout=60.0,  # 60 second timeout
+        max_retries=3,  # Allow 3 retries
+        # None unless a record/replay cassette is active (http_cassette.py)
+        http_client=openai_http_client(),
+    )
+
+
+def invalidate_upcoming_events():
+    get_cache_backend().delete(UPCOMING_EVENTS_CACHE_KEY)
+
+
+@functools.lru_cache(maxsize=1)
 def authenticate_google_calendar():
     """Authenticate and return the Google Calendar API service."""
+    # Cached so new or rehydrated sessions don't rebuild the service, the credentials refresh themselves
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+
+    if replaying():
+        # Replayed responses need no credentials (or network)
+        return build_calendar_service(None)
+
     credentials_location = "credentials.json"
     creds = None
     if os.path.exists('token.json'):
@@ -46,6 +79,7 @@ def authenticate_google_calendar():
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
         else:
+            from google_auth_oauthlib.flow import InstalledAppFlow
             flow = InstalledAppFlow.from_client_secrets_file(
                 credentials_location, SCOPES
             )
@@ -53,213 +87,198 @@ def authenticate_google_calendar():
         with open('token.json', 'w') as token:
             token.write(creds.to_json())
 
-    service = build('calendar', 'v3', credentials=creds)
-    return service
+    return build_calendar_service(creds)
+
+
+def build_calendar_service(creds):
+    from googleapiclient.discovery import build
+    from googleapiclient.http import HttpRequest, build_http
+    from google_auth_httplib2 import AuthorizedHttp
+
+    # httplib2 connections aren't thread-safe and the cache warmer calls the API from its own
+    # threads, so each thread gets its own connection (kept alive between requests)
+    local = threading.local()
+
+    def thread_http():
+        if not hasattr(local, "http"):
+            local.http = wrap_google_http(AuthorizedHttp(creds, http=build_http()) if creds else None)
+        return local.http
+
+    def build_request(http, *args, **kwargs):
+        return HttpRequest(thread_http(), *args, **kwargs)
+
+    # googleapiclient already asks for gzip (Accept-Encoding plus "(gzip)" in the User-Agent)
+    return build('calendar', 'v3', http=thread_http(), requestBuilder=build_request,
+                 model=metered_json_model("calendar"))
 
 
 
 load_dotenv()
 
 class CMUGPTAssistant:
+    # The shared cache entry fetch_upcoming_events() fills, cache_warmer.py refreshes it once for every session
+    UPCOMING_EVENTS_CACHE_KEY = UPCOMING_EVENTS_CACHE_KEY
+    # Tools from tool_registry.py that this assistant exposes to the model
+    TOOL_NAMES = [
+        "general_purpose_knowledge_search",
+        "show_cmueats_website",
+        "find_open_dining",
+        "show_cmucourses_website",
+        "create_calendar_event",
+        "delete_calendar_event",
+        "delete_all_event",
+        "get_current_canvas_courses",
+        "get_upcoming_canvas_assignments",
+        "find_free_slots",
+    ]
+
     def __init__(self):
-        # Set up OpenAI client with timeout configuration
-        self.client = OpenAI(
-            api_key=os.getenv('OPENAI_API_KEY'),
-            timeout=60.0,  # 60 second timeout
-            max_retries=3  # Allow 3 retries
-        )
+        # Shared OpenAI client with timeout configuration
+        self.client = get_openai_client()
         self.show_eats = False
         self.show_courses = False
 
-        self.service = authenticate_google_calendar()
+        # Set by the session manager / API server, write-behind notifications are routed by it
+        self.session_id = None
+        # Why the last turn answered with an apology instead of an answer, None when it didn't
+        self.last_turn_error = None
+        # With CMUGPT_CALENDAR_WRITE_BEHIND=1 calendar changes are queued and applied in the background
+        self.calendar_queue = get_calendar_queue(authenticate_google_calendar, on_write=invalidate_upcoming_events)
         
+        self.registry = TOOL_REGISTRY
+
         # Define the function definitions (tools) for the model
         self.tools = self.get_tools()
         
         # Initialize conversation messages
-        self.messages = [
+        self.messages = MessageStore([
             {
                 "role": "system",
                 "content": "You are CMUGPT, an assistant knowledgeable about Carnegie Mellon University in Pittsburgh, Pennsylvania. Use the supplied tools to assist the user."
             },
             {
                 "role": "system",
-                "content": "If someone inquires about dining direct them to visit https://cmueats.com and always call the function to display it to the UI, while if someone asks about courses at CMU direct them to visit https://cmucourses.com and always call the function to display it to the UI, while if someone asks about directions direct them to visit https://cmumaps.com, while if someone asks about ScottyLabs direct them to visit https://ScottyLabs.org"
+                "content": "If someone asks which dining locations are open, or about the hours of one, call find_open_dining and answer from its result; otherwise if someone inquires about dining direct them to visit https://cmueats.com and always call the function to display it to the UI, while if someone asks about courses at CMU direct them to visit https://cmucourses.com and always call the function to display it to the UI, while if someone asks about directions direct them to visit https://cmumaps.com, while if someone asks about ScottyLabs direct them to visit https://ScottyLabs.org"
             },
             #{
             #    "role": "system",
             #    "content": "Write concise, relevant responses, with the skilled style of a Pultizer Prize-winning author.  Do not use course search function, all others allowed."
             #}
-        ]
+        ])
         
         # Keep track of functions called
-        self.functions_called = []
+        self.functions_called = new_functions_called()
+        # Full tool results are kept out of self.messages, the sidebar looks them up by reference
+        self.result_store = ResultStore(MAX_FUNCTIONS_CALLED, MAX_RESULT_CHARS)
+        self.compaction = CompactionLedger()
+        # Tokens and estimated cost of every model call, per turn, model and tool
+        self.usage = UsageLedger()
+        # Picks the model per call from recent latency and errors, shared by every session
+        self.router = get_model_router()
 
         
         
-        self.perplexity_search = CMUPerplexitySearch()
+        self.perplexity_search = CMUPerplexitySearch(usage=self.usage)
+        # Optionally start Perplexity alongside the first OpenAI call (CMUGPT_SPECULATIVE_SEARCH=1)
+        self.speculative_search = build_speculative_search(self.perplexity_search)
+
+        # Obvious tool intents are routed locally to skip the tool-selection call
+        self.intent_router = build_default_router(self.TOOL_NAMES)
     
-    def get_tools(self):
-        tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "general_purpose_knowledge_search",
-                    "description": "Search for general knowledge about Carnegie Mellon University. Today's date is "  + datetime.now().strftime("%B %d, %Y"),
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "search_query": {
-                                "type": "string",
-                                "description": "The query to search for general knowledge."
-                            }
-                        },
-                        "required": ["search_query"],
-                        "additionalProperties": False
-                    },
-                    "strict": True  # Enabling Structured Outputs
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "show_cmueats_website",
-                    "description": "Display cmueats website to the UI frontend",
-                        "required": [""],
-                        "additionalProperties": False
-                    },
-                    "strict": True  # Enabling Structured Outputs
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "show_cmucourses_website",
-                    "description": "Display cmucourses website to the UI frontend",
-                        "required": [""],
-                        "additionalProperties": False
-                    },
-                    "strict": True  # Enabling Structured Outputs
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "create_calendar_event",
-                    "description": "Create/Add an event in the user's calendar when prompted",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "summary": {
-                                "type": "string",
-                                "description": "The name of the event to be created with default settings"
-                            }, 
-                            "location": {
-                                "type": "string",
-                                "description": "The location of the event to be created with default settings"
-                            },
-                            "description": {
-                                "type": "string",
-                                "description": "A detailed description of the event to be created with default settings"
-                            },
-                            "start_date": {
-                                "type": "string",
-                                "description": f"Start date of the event to be created, in the form of 'MM/DD/YYYY' with DEFAULT DATE AS {datetime.now()} if not specified by the user. When the user specifies a day of the week, use {datetime.now()} as reference for today's date. ALWAYS think twice and count to check that the date and the user's specified day match up"
-                            },
-                            "end_date": {
-                                "type": "string",
-                                "description": f"End date of the event to be created, in the form of 'MM/DD/YYYY' with DEFAULT DATE AS {datetime.now()} if not specified by the user. When the user specifies a day of the week, use {datetime.now()} as reference for today's date. ALWAYS think twice and count to check that the date and the user's specified day match up"
-                            },
-                            "start_time": {
-                                "type": "string",
-                                "description": f"Start time during the day of the event to be created, in the form of 'HH:MM' with default set to the time 09:00"
-                            },
-                            "end_time": {
-                                "type": "string",
-                                "description": f"End time of the event to be created, in the form of 'HH:MM' with default set to one hour after start_time"
-                            }
-                        },
-                        "required": ["name", "start_time", "end_time"],
-                        "additionalProperties": False
-                    },
-                    "strict": False  # Enabling Structured Outputs
-                }
-            }, {
-                "type": "function",
-                "function": {
-                    "name": "delete_calendar_event",
-                    "description": "Delete a calendar event that matches the given summary. First fetch events and then delete the one that matches.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "summary": {
-                                "type": "string",
-                                "description": "The name of the event to be deleted with default settings"
-                            }
-                        },
-                        "required": ["name"],
-                        "additionalProperties": False
-                    },
-                    "strict": False  # Enabling Structured Outputs
-                }
-            }, {
-                "type": "function",
-                "function": {
-                    "name": "delete_all_event",
-                    "description": "Delete all events in the calendar",
-                    "strict": False  # Enabling Structured Outputs
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_current_canvas_courses",
-                    "description": "Fetches the user's currently active courses from Canvas for the most recent academic term.",
-                    "parameters": { # This tool takes no parameters from the LLM
-                        "type": "object",
-                        "properties": {},
-                        "required": []
-                    }
-                }
-            },
-        ]
-        return tools
+    @property
+    def service(self):
+        # The Calendar service is built on first use, the Google client libraries are slow to import
+        return authenticate_google_calendar()
 
-    def process_user_input(self, user_input):
+    def get_tools(self):
+        # Schemas, implementations and timeout policy are declared once in tool_registry.py
+        return self.registry.openai_tools(self.TOOL_NAMES)
+
+    def process_user_input(self, user_input, on_token=None):
+        # on_token, when given, receives the answer text as it streams in (used by api_server.py)
+        # Everything logged during this turn, tool threads included, carries its session and turn id
+        start_turn(self.session_id)
+        self.usage.start_turn()
+        self.last_turn_error = None
+        TURNS_IN_PROGRESS.inc()
+        started = time.perf_counter()
+        try:
+            return self.run_turn(user_input, on_token)
+        finally:
+            TURNS_IN_PROGRESS.dec()
+            TURNS.inc()
+            TURN_SECONDS.observe(time.perf_counter() - started)
+            turn = self.usage.last_turn()
+            logger.info(f"Turn used {turn['prompt_tokens'] + turn['completion_tokens']} tokens over {turn['calls']} model calls",
+                        extra={"usage": turn})
+
+    def complete(self, call_type, **kwargs):
+        # The model comes from the router (model_router.py). Past the session's budget it's the cheaper
+        # one, and an answer that only restates short tool results may go to the small model
+        small_ok = call_type == "synthesis" and tool_output_chars(kwargs["messages"]) <= SYNTHESIS_SMALL_MAX_CHARS
+        return self.router.complete(self.client, call_type, over_budget=self.usage.over_budget,
+                                    small_ok=small_ok, **kwargs)
+
+    def run_turn(self, user_input, on_token=None):
         self.messages.append({"role": "user", "content": user_input})
+        self.compaction.start_turn()
+        if self.usage.over_budget:
+            # Over budget the history is kept short too, it's resent on every call
+            dropped = self.messages.compact(BUDGET_HISTORY_MESSAGES)
+            if dropped:
+                logger.info(f"Session over its usage budget, dropped {dropped} older messages.")
         max_retries = 3
         retry_delay = 1
 
+        route = self.intent_router.route(user_input) if self.intent_router else None
+        if route is not None:
+            logger.info(f"Routed locally to {route.tool_name}",
+                        extra={"route_source": route.source, "confidence": round(route.confidence, 2)})
+            self.execute_routed_intent(route)
+            if route.template:
+                # UI-only tools don't need the model to say anything beyond the template
+                self.messages.append({"role": "assistant", "content": route.template})
+                if on_token:
+                    on_token(route.template)
+                return route.template
+
+        if route is None and self.speculative_search:
+            self.speculative_search.start(user_input)
+
         for attempt in range(max_retries):
             try:
-                response = self.client.chat.completions.create(
-                    #model='gpt-4o-mini',  # Fixed model name
-                    model='gpt-4o-mini-2024-07-18',
-                    messages=self.messages,
+                if route is not None:
+                    # The tool already ran locally, go straight to the final response
+                    return self.final_completion(on_token)
+
+                response, decision = self.complete(
+                    "tool_selection",
+                    messages=self.messages.to_openai(),
                     tools=self.tools,
                 )
+                self.usage.record_openai("tool_selection", response, route=decision)
 
                 assistant_message = response.choices[0].message
                 
                 if assistant_message.tool_calls:
                     # The model wants to call functions
                     tool_calls = assistant_message.tool_calls
-                    function_results = []
+                    calls = [(tool_call.function.name, json.loads(tool_call.function.arguments or "{}"))
+                             for tool_call in tool_calls]
+                    logger.info(f"Tool calls requested: {', '.join(name for name, _ in calls)}",
+                                extra={"tools": [name for name, _ in calls]})
+                    # Parallel-safe tools requested in the same turn run concurrently
+                    function_results = self.registry.dispatch_many(self, calls)
 
-                    for tool_call in tool_calls:
-                        function_name = tool_call.function.name
-                        arguments = json.loads(tool_call.function.arguments)
-                        result = self.execute_function(function_name, arguments)
+                    for tool_call, (function_name, arguments), result in zip(tool_calls, calls, function_results):
 
                         # Keep track of functions called
-                        self.functions_called.append({
-                            'function_name': function_name,
-                            'arguments': arguments,
-                            'result': result
-                        })
+                        content = self.record_tool_result(function_name, arguments, result)
 
                         # Prepare the function result message
                         function_result_message = {
                             "role": "tool",
-                            "content": json.dumps(result),
+                            "content": content,
                             "tool_call_id": tool_call.id
                         }
 
@@ -270,87 +289,141 @@ class CMUGPTAssistant:
                         })
                         self.messages.append(function_result_message)
 
-                    # After providing the function results, call the model again to get the final response
-                    response = self.client.chat.completions.create(
-                        model='gpt-4o-mini',
-                        messages=self.messages,
-                        #tools=self.tools,
-                    )
-
-                    
-
-                    assistant_message = response.choices[0].message
-                    self.messages.append(assistant_message)
+                    if self.speculative_search:
+                        self.speculative_search.finish_turn()
 
-                    return assistant_message.content
+                    # After providing the function results, call the model again to get the final response
+                    return self.final_completion(on_token)
                 else:
+                    if self.speculative_search:
+                        self.speculative_search.finish_turn()
                     self.messages.append(assistant_message)
+                    if on_token and assistant_message.content:
+                        on_token(assistant_message.content)
                     return assistant_message.content
 
             except APITimeoutError as e:
+                logger.warning(f"OpenAI call timed out (attempt {attempt + 1} of {max_retries}).")
                 if attempt == max_retries - 1:
+                    self.last_turn_error = f"{type(e).__name__}: {e}"
                     return f"I apologize, but I'm having trouble connecting. Please try again in a moment. (Error: Connection timeout)"
+                RETRIES.inc(kind="openai")
                 time.sleep(retry_delay)
                 retry_delay *= 2
                 
             except APIError as e:
+                logger.warning(f"OpenAI call failed (attempt {attempt + 1} of {max_retries}): {e}")
                 if attempt == max_retries - 1:
+                    self.last_turn_error = f"{type(e).__name__}: {e}"
                     return f"I apologize, but there was an error processing your request. Please try again. (Error: {str(e)})"
+                RETRIES.inc(kind="openai")
                 time.sleep(retry_delay)
                 retry_delay *= 2
                 
             except Exception as e:
+                logger.exception("Turn failed with an unexpected error.")
+                self.last_turn_error = f"{type(e).__name__}: {e}"
                 return f"I apologize, but an unexpected error occurred. Please try again. (Error: {str(e)})"
 
+        self.last_turn_error = f"No answer after {max_retries} attempts"
         return "I apologize, but I was unable to process your request after multiple attempts. Please try again later."
 
+    def final_completion(self, on_token=None):
+        # The answer after tool results are in the conversation, streamed when on_token is given
+        if on_token is None:
+            response, decision = self.complete("synthesis", messages=self.messages.to_openai())
+            self.usage.record_openai("synthesis", response, route=decision)
+            assistant_message = response.choices[0].message
+            self.messages.append(assistant_message)
+            return assistant_message.content
+
+        stream, decision = self.complete(
+            "synthesis",
+            messages=self.messages.to_openai(),
+            stream=True,
+            # The last chunk then carries the usage of the whole stream
+            stream_options={"include_usage": True},
+        )
+        parts = []
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                on_token(chunk.choices[0].delta.content)
+            if chunk.usage is not None:
+                self.usage.record_openai("synthesis", chunk, route=decision)
+        content = "".join(parts)
+        self.messages.append({"role": "assistant", "content": content})
+        return content
+
+    def record_tool_result(self, function_name, arguments, result):
+        # Keep the full result out-of-band and only send the compacted version to the model
+        result_ref = self.result_store.put(result)
+        content = self.registry.compact(function_name, result)
+        tokens_saved = self.compaction.record(function_name, json.dumps(result), content)
+        self.functions_called.append({
+            'function_name': function_name,
+            'arguments': arguments,
+            'result_ref': result_ref,
+            'tokens_saved': tokens_saved
+        })
+        return content
+
+    def execute_routed_intent(self, route):
+        # Record the locally routed call as if the model had requested it
+        tool_call_id = f"call_local_{uuid.uuid4().hex[:20]}"
+        result = self.execute_function(route.tool_name, route.arguments)
+        content = self.record_tool_result(route.tool_name, route.arguments, result)
+
+        self.messages.append({
+            "role": "assistant",
+            "tool_calls": [{
+                "id": tool_call_id,
+                "type": "function",
+                "function": {"name": route.tool_name, "arguments": json.dumps(route.arguments)}
+            }]
+        })
+        self.messages.append({
+            "role": "tool",
+            "content": content,
+            "tool_call_id": tool_call_id
+        })
+        return result
+
     # Function to execute the functions
     def execute_function(self, function_name, arguments):
-        if function_name == 'general_purpose_knowledge_search':
-            return self.general_purpose_knowledge_search(arguments.get('search_query'))
-        #Add elif statements here
-        elif function_name == 'show_cmueats_website':
-            return self.show_cmu_eats()
-        elif function_name == 'show_cmucourses_website':
-            return self.show_cmu_courses()
-        elif function_name == 'create_calendar_event':
-            return self.create_calendar_event(arguments.get('summary'), arguments.get('location'), arguments.get('description'), arguments.get('start_date'), arguments.get('end_date'), arguments.get('start_time'), arguments.get('end_time'))
-        elif function_name == 'delete_calendar_event':
-            return self.delete_calendar_event(arguments.get('summary'))
-        elif function_name == 'delete_all_event':
-            return self.delete_all_event()
-        elif function_name == 'get_current_canvas_courses':
-            # This tool takes no arguments from the LLM
-            # Call the function imported from canvas_tools.py
-            return canvas_tools.fetch_current_courses()
-        else:
-            return {"error": "Function not found."}
+        # Dictionary lookup in the shared tool registry, which also applies the tool's timeout
+        return self.registry.dispatch(self, function_name, arguments)
 
     # Define the functions (simulate the functionality)
     def general_purpose_knowledge_search(self, search_query):
         # Use Perplexity API for general knowledge searches
+        if self.speculative_search:
+            # The search may already be running from the raw user text
+            result = self.speculative_search.claim(search_query)
+            if result is not None:
+                return result
         return self.perplexity_search.search(search_query)
     def show_cmu_eats(self):
-        print("show cmu eats function called")
+        logger.debug("Showing CMU Eats on the frontend.")
         self.show_eats = True
         return "Displaying CMUEATS.com website on frontend."
 
     def show_cmu_courses(self):
-        print("show cmu courses function called")
+        logger.debug("Showing CMU Courses on the frontend.")
         self.show_courses = True
         return "Displaying CMUCOURSES.com website on frontend."
 
     # custom function for creating calendar
-    def create_calendar_event(self, summary, location, description, start_date, end_date, start_time = "06:00", end_time = "07:00"):
+    def create_calendar_event(self, summary, location, description, start_date, end_date, start_time = "06:00", end_time = "07:00", allow_conflicts = False):
         #location = "Tepper"
         #description = "Eating icecream"
 
         #start_date = "03/20/2025"
-        print(start_date)
         #end_date = "03/20/2025"
-        print(end_date)
-        print(start_time)
-        print(end_time)
+        logger.debug(f"Creating event '{summary}' from {start_date} {start_time} to {end_date} {end_time}")
+
+        from tzlocal import get_localzone  # Auto-detect user's timezone
+        from googleapiclient.errors import HttpError
 
         start_object = datetime.strptime(f"{start_date} {start_time}", "%m/%d/%Y %H:%M")
         end_object = datetime.strptime(f"{end_date} {end_time}", "%m/%d/%Y %H:%M")
@@ -359,6 +432,17 @@ class CMUGPTAssistant:
         start_object = start_object.replace(tzinfo=user_timezone)
         end_object = end_object.replace(tzinfo=user_timezone)
 
+        # Check for overlapping events first, the model asks the user before double-booking
+        if not allow_conflicts:
+            try:
+                conflicts = self.find_conflicts(start_object, end_object)
+            except HttpError as error:
+                logger.warning(f"Could not check for conflicts: {error}")
+                conflicts = []
+            if conflicts:
+                return (f"Not created: this overlaps with {', '.join(conflicts)}. Ask the user whether to create it "
+                        f"anyway (call again with allow_conflicts set to true) or to pick another time.")
+
         # Convert to ISO 8601 format
         start_iso = start_object.isoformat()
         end_iso = end_object.isoformat()
@@ -375,15 +459,23 @@ class CMUGPTAssistant:
         },
         }
 
+        if self.calendar_queue is not None:
+            # Write-behind: reply now, the worker inserts it and the UI is notified once it's saved
+            event['id'] = new_event_id()
+            self.calendar_queue.enqueue(self.session_id or "default", "insert", {"event": event},
+                                        f"Add '{summary}' on {start_date} at {start_time}", key=event['id'])
+            return f"'{summary}' is being added to your calendar. You'll get a confirmation once it's saved."
+
         service = self.service
 
         try:
             # insert the event 
-            event = service.events().insert(calendarId="primary", body=event).execute()
-            print(f"Event added successfully!")
+            event = service.events().insert(calendarId="primary", body=event, fields="id").execute()
+            invalidate_upcoming_events()
+            logger.info("Event added.", extra={"event_id": event.get("id")})
 
         except HttpError as error:
-            print(f"An error occurred: {error}")
+            logger.error(f"Could not add event: {error}")
         return "Your event was added successfully! Let me know if you need anything else"
 
     def fetch_events(self, delta):
@@ -398,7 +490,7 @@ class CMUGPTAssistant:
         end_of_week = start_of_week + diff
         timeMin = start_of_week.isoformat() + 'Z'
         timeMax = end_of_week.isoformat() + 'Z'
-        print("Getting all events")
+        logger.debug("Getting all events")
         events_result = (
             service.events()
             .list(
@@ -406,15 +498,113 @@ class CMUGPTAssistant:
                 timeMin=timeMin,
                 timeMax=timeMax,
                 singleEvents=True,
-                orderBy="startTime"
+                orderBy="startTime",
+                fields=EVENT_FIELDS
             )
             .execute()
         )
         event_list = events_result.get("items", [])
         if len(event_list) == 0:
-            print("No upcoming events found.")
+            logger.debug("No upcoming events found.")
         return event_list
 
+    def fetch_upcoming_events(self, refresh=False):
+        # Events from now through the next UPCOMING_EVENTS_DAYS days, from cache when possible
+        cache = get_cache_backend()
+        if not refresh:
+            cached = cache.get(UPCOMING_EVENTS_CACHE_KEY)
+            if cached is not None:
+                return cached
+        now = datetime.utcnow()
+        events_result = (
+            self.service.events()
+            .list(
+                calendarId="primary",
+                timeMin=now.isoformat() + 'Z',
+                timeMax=(now + timedelta(days=UPCOMING_EVENTS_DAYS)).isoformat() + 'Z',
+                singleEvents=True,
+                orderBy="startTime",
+                fields=EVENT_FIELDS
+            )
+            .execute()
+        )
+        event_list = events_result.get("items", [])
+        cache.set(UPCOMING_EVENTS_CACHE_KEY, event_list, UPCOMING_EVENTS_TTL)
+        return event_list
+
+    def in_upcoming_window(self, start, end):
+        # Whether the cached upcoming week, however old it is, covers all of [start, end).
+        # Callers clamp start to their own now, which is already past by the time this runs,
+        # so only the part of the range from now on is checked
+        now = datetime.now(start.tzinfo)
+        start = max(start, now)
+        return start < end <= now + timedelta(days=UPCOMING_EVENTS_DAYS, seconds=-UPCOMING_EVENTS_TTL)
+
+    def events_between(self, start, end):
+        # Events overlapping [start, end), from the cached upcoming week when it covers the range
+        if self.in_upcoming_window(start, end):
+            return self.fetch_upcoming_events()
+        events_result = self.service.events().list(
+            calendarId="primary",
+            timeMin=start.isoformat(),
+            timeMax=end.isoformat(),
+            singleEvents=True,
+            orderBy="startTime",
+            fields=EVENT_FIELDS
+        ).execute()
+        return events_result.get("items", [])
+
+    def busy_index(self, start, end):
+        # Busy time in [start, end): the synced events when cached, otherwise one freebusy query
+        if self.in_upcoming_window(start, end):
+            return BusyIndex((s, e) for s, e, _ in event_intervals(self.fetch_upcoming_events(), start.tzinfo))
+        response = self.service.freebusy().query(body={
+            "timeMin": start.isoformat(),
+            "timeMax": end.isoformat(),
+            "items": [{"id": "primary"}],
+        }, fields="calendars").execute()
+        # In the window's zone, so slot edges taken from busy time print as the user's clock time
+        return BusyIndex(freebusy_intervals(response, tz=start.tzinfo))
+
+    def find_conflicts(self, start, end):
+        # Names of events overlapping [start, end), empty when the range is free
+        intervals = event_intervals(self.events_between(start, end), start.tzinfo)
+        if BusyIndex((s, e) for s, e, _ in intervals).is_free(start, end):
+            return []
+        return [summary for s, e, summary in intervals if s < end and e > start]
+
+    def find_free_slots(self, date=None, start_time="09:00", end_time="17:00", duration_minutes=60, days=1):
+        from tzlocal import get_localzone
+        user_timezone = get_localzone()
+        now = datetime.now(user_timezone)
+        first_day = datetime.strptime(date, "%m/%d/%Y").date() if date else now.date()
+        days = max(1, min(int(days or 1), MAX_FREE_SLOT_DAYS))
+        duration_minutes = int(duration_minutes or 60)
+        duration = timedelta(minutes=duration_minutes)
+        day_start = datetime.strptime(start_time or "09:00", "%H:%M").time()
+        day_end = datetime.strptime(end_time or "17:00", "%H:%M").time()
+
+        # One window per day, slots in the past are not offered
+        windows = []
+        for offset in range(days):
+            day = first_day + timedelta(days=offset)
+            start = max(datetime.combine(day, day_start, tzinfo=user_timezone), now)
+            end = datetime.combine(day, day_end, tzinfo=user_timezone)
+            if end - start >= duration:
+                windows.append((start, end))
+        if not windows:
+            return "That time window has already passed or is shorter than the requested duration."
+
+        # Built once for the whole range, each window is then a bisect into it
+        index = self.busy_index(windows[0][0], windows[-1][1])
+        lines = []
+        for start, end in windows:
+            for slot_start, slot_end in index.free_slots(start, end, duration, limit=MAX_FREE_SLOTS_PER_DAY):
+                lines.append(f"- {format_slot(slot_start, slot_end)}")
+        if not lines:
+            return f"No free slots of {duration_minutes} minutes or more were found in that window."
+        return f"Free slots of at least {duration_minutes} minutes ({user_timezone}):\n" + "\n".join(lines)
+
     def get_event_id(self, name, event_list):
         for event in event_list:
             if event.get('summary') == name:
@@ -441,7 +631,9 @@ class CMUGPTAssistant:
     #     else:
     #         return f"No event matching '{summary}' was found in your calendar."
     def delete_calendar_event(self, summary):  # For string similarity calculation
-    
+        import difflib
+        from googleapiclient.errors import HttpError
+
         service = self.service
         events = self.fetch_events(100)
         
@@ -468,9 +660,15 @@ class CMUGPTAssistant:
         if best_match_score >= threshold:
             event_id = best_match_event.get('id')
             event_summary = best_match_event.get('summary')
+
+            if self.calendar_queue is not None:
+                self.calendar_queue.enqueue(self.session_id or "default", "delete", {"event_ids": [event_id]},
+                                            f"Delete '{event_summary}'", key=f"delete:{event_id}")
+                return f"'{event_summary}' is being deleted from your calendar. (Match score: {best_match_score:.2f})"
             
             try:
                 service.events().delete(calendarId="primary", eventId=event_id).execute()
+                invalidate_upcoming_events()
                 return f"Event '{event_summary}' was deleted successfully! (Match score: {best_match_score:.2f})"
             except HttpError as error:
                 return f"An error occurred while trying to delete '{event_summary}': {error}"
@@ -486,21 +684,41 @@ class CMUGPTAssistant:
                 return f"No event matching '{summary}' was found in your calendar."
 
     def delete_all_event(self):
+        from googleapiclient.errors import HttpError
+        if self.calendar_queue is not None:
+            # Same window as fetch_events(7), resolved to event ids by the worker
+            now = datetime.utcnow()
+            self.calendar_queue.enqueue(self.session_id or "default", "delete_window",
+                                        {"time_min": (now - timedelta(days=7)).isoformat() + 'Z',
+                                         "time_max": now.isoformat() + 'Z'},
+                                        "Delete this week's events")
+            return "Your events are being deleted. You'll get a confirmation once it's done."
         service = self.service
         events = self.fetch_events(7)
         for event in events:
             event_id = event.get('id')
             try:
                 service.events().delete(calendarId="primary", eventId=event_id).execute()
-                print(f"Event {event_id} deleted successfully!")
+                logger.debug(f"Event {event_id} deleted.")
 
             except HttpError as error:
-                print(f"An error occurred: {error}")
+                logger.error(f"Could not delete event {event_id}: {error}")
+        invalidate_upcoming_events()
         return "Your event was deleted successfully! Let me know if you need anything else"
     
 
 
     def get_functions_called(self):
-        return self.functions_called
+        return list(self.functions_called)
+
+    def get_usage(self):
+        # Token usage and estimated cost of this session, see usage_accounting.py
+        return self.usage.summary()
+
+    def memory_footprint(self):
+        return memory_footprint(self.messages, self.functions_called, self.result_store)
+
+    def get_function_result(self, result_ref):
+        return self.result_store.get(result_ref)
 
     
\ No newline at end of file
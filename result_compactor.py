@@ -0,0 +1,158 @@
+# result_compactor.py
+
+import json
+import itertools
+import logging
+from collections import OrderedDict, deque
+from typing import List, Dict, Any, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:  # Optional, we fall back to a character based estimate
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+DEFAULT_TOKEN_BUDGET = 800
+# Average characters per token for English text with the GPT-4o tokenizers
+CHARS_PER_TOKEN = 4
+TRUNCATION_MARKER = " ...[truncated]"
+# Keys that are always kept so the model can explain failures
+ALWAYS_KEEP = ("error",)
+# Per-turn detail kept per session, older turns only count towards total_saved
+MAX_COMPACTION_TURNS = 50
+
+_encoding = None
+
+
+def estimate_tokens(text: str) -> int:
+    """Counts tokens with tiktoken when it is installed, otherwise estimates them."""
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        return len(_encoding.encode(text))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def _truncate(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    return text[:max(0, max_chars - len(TRUNCATION_MARKER))].rstrip() + TRUNCATION_MARKER
+
+
+def compact_result(result: Any,
+                   keep_fields: Optional[List[str]] = None,
+                   token_budget: int = DEFAULT_TOKEN_BUDGET) -> str:
+    """
+    Returns the JSON string that goes into the conversation for a tool result.
+    Dict results are reduced to keep_fields (plus "error"), and the longest
+    string values are truncated until the result fits the token budget.
+    """
+    if isinstance(result, dict) and keep_fields is not None:
+        result = {k: v for k, v in result.items() if k in keep_fields or k in ALWAYS_KEEP}
+
+    content = _dumps(result)
+    max_chars = token_budget * CHARS_PER_TOKEN
+    if len(content) <= max_chars:
+        return content
+
+    if isinstance(result, str):
+        return _dumps(_truncate(result, max_chars))
+    if isinstance(result, dict):
+        result = dict(result)
+        # Shorten the longest strings first, they are almost always the answer text or a listing
+        for key in sorted(result, key=lambda k: len(str(result[k])), reverse=True):
+            value = result[key]
+            if not isinstance(value, str):
+                continue
+            overflow = len(_dumps(result)) - max_chars
+            if overflow <= 0:
+                break
+            result[key] = _truncate(value, len(value) - overflow)
+        content = _dumps(result)
+        if len(content) <= max_chars:
+            return content
+    # Lists and nested structures we can't shorten field by field
+    return _dumps({"truncated_result": _truncate(content, max_chars)})
+
+
+class ResultStore:
+    """
+    Keeps full tool results out of the conversation, addressed by reference.
+    With max_entries set the oldest results are dropped, and results larger
+    than max_result_chars are truncated before they are stored.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, max_result_chars: Optional[int] = None):
+        self.max_entries = max_entries
+        self.max_result_chars = max_result_chars
+        self._results: "OrderedDict[str, Any]" = OrderedDict()
+        self._ids = itertools.count(1)
+
+    def put(self, result: Any) -> str:
+        if self.max_result_chars and len(_dumps(result)) > self.max_result_chars:
+            result = json.loads(compact_result(result, token_budget=self.max_result_chars // CHARS_PER_TOKEN))
+        ref = f"result-{next(self._ids)}"
+        self._results[ref] = result
+        if self.max_entries:
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+        return ref
+
+    def get(self, ref: str) -> Any:
+        return self._results.get(ref)
+
+    def to_state(self) -> Dict[str, Any]:
+        """A JSON-serializable snapshot, used when a session is written to disk."""
+        next_id = next(self._ids)
+        self._ids = itertools.count(next_id)
+        return {"next_id": next_id, "results": list(self._results.items())}
+
+    def restore(self, state: Dict[str, Any]) -> None:
+        self._results = OrderedDict((ref, result) for ref, result in state.get("results", []))
+        self._ids = itertools.count(state.get("next_id", len(self._results) + 1))
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+
+class CompactionLedger:
+    """Records how many tokens compaction kept out of the conversation, per turn."""
+
+    def __init__(self):
+        self.turns: deque = deque(maxlen=MAX_COMPACTION_TURNS)
+        self._total_saved = 0
+
+    def start_turn(self) -> None:
+        self.turns.append({"tools": [], "original_tokens": 0, "compacted_tokens": 0, "tokens_saved": 0})
+
+    def record(self, tool_name: str, original: str, compacted: str) -> int:
+        if not self.turns:
+            self.start_turn()
+        original_tokens = estimate_tokens(original)
+        compacted_tokens = estimate_tokens(compacted)
+        saved = max(0, original_tokens - compacted_tokens)
+        turn = self.turns[-1]
+        turn["tools"].append({"tool": tool_name, "original_tokens": original_tokens,
+                              "compacted_tokens": compacted_tokens, "tokens_saved": saved})
+        turn["original_tokens"] += original_tokens
+        turn["compacted_tokens"] += compacted_tokens
+        turn["tokens_saved"] += saved
+        self._total_saved += saved
+        if saved:
+            logger.debug(f"Compacted {tool_name} result from {original_tokens} to {compacted_tokens} tokens.")
+        return saved
+
+    @property
+    def last_turn_saved(self) -> int:
+        return self.turns[-1]["tokens_saved"] if self.turns else 0
+
+    @property
+    def total_saved(self) -> int:
+        return self._total_saved
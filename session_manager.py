@@ -0,0 +1,240 @@
+# session_manager.py
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Callable, List, Tuple
+
+from session_memory import export_session, restore_session
+
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+# Sessions kept in memory at once, the least recently used are written to disk past this
+MAX_ACTIVE_SESSIONS = int(os.getenv("CMUGPT_MAX_ACTIVE_SESSIONS", "32"))
+# Sessions untouched for this many seconds are written to disk and dropped from memory
+SESSION_IDLE_SECONDS = float(os.getenv("CMUGPT_SESSION_IDLE_SECONDS", "900"))
+SESSION_DB_PATH = os.getenv("CMUGPT_SESSION_DB", "sessions.db")
+# Where sessions are stored: sqlite:///<path> on this host (default, CMUGPT_SESSION_DB), or
+# redis://host:6379/0 shared by every dyno
+SESSION_URL = os.getenv("CMUGPT_SESSION_URL", "")
+# Sessions untouched this long are dropped from Redis, which has no disk to spill them to
+SESSION_TTL_SECONDS = float(os.getenv("CMUGPT_SESSION_TTL_SECONDS", str(30 * 24 * 3600)))
+
+
+def _encode(state: Dict[str, Any]) -> bytes:
+    return zlib.compress(json.dumps(state, separators=(",", ":")).encode("utf-8"), 1)
+
+
+def _decode(blob: bytes) -> Dict[str, Any]:
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class SessionStore:
+    """Where idle sessions go. Implementations must be safe to share between threads."""
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def save(self, session_id: str, state: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> None:
+        raise NotImplementedError
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions as zlib-compressed JSON rows in a local SQLite file."""
+
+    def __init__(self, path: str = SESSION_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL lets several worker processes read while one writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, state BLOB NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT state FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return _decode(row[0]) if row else None
+
+    def save(self, session_id: str, state: Dict[str, Any]) -> None:
+        blob = _encode(state)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sessions (id, state, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                (session_id, blob, time.time()),
+            )
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Sessions as zlib-compressed JSON values on a Redis-protocol server, shared
+    by every worker on every dyno. Unlike the cache, a failed read or write
+    raises rather than passing as a miss, since it would lose the conversation.
+    """
+
+    def __init__(self, client: Any, prefix: str = "cmugpt:session:", ttl_seconds: float = SESSION_TTL_SECONDS):
+        # A RedisCache from cache_backends.py, used for its connection and command()
+        self.client = client
+        self.prefix = prefix
+        self.ttl_ms = int(ttl_seconds * 1000)
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        blob = self.client.command("GET", self.prefix + session_id)
+        return _decode(blob) if blob else None
+
+    def save(self, session_id: str, state: Dict[str, Any]) -> None:
+        self.client.command("SET", self.prefix + session_id, _encode(state), "PX", self.ttl_ms)
+
+    def delete(self, session_id: str) -> None:
+        self.client.command("DEL", self.prefix + session_id)
+
+
+def create_session_store(url: Optional[str] = None) -> SessionStore:
+    """Builds the store from a sqlite:/// or redis:// URL, CMUGPT_SESSION_URL by default."""
+    url = url if url is not None else SESSION_URL
+    if not url:
+        return SQLiteSessionStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionStore(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "tcp://")):
+        from cache_backends import create_cache_backend
+        return RedisSessionStore(create_cache_backend(url))
+    raise ValueError(f"Unsupported session store URL: {url}")
+
+
+class SessionManager:
+    """
+    Keeps a bounded number of live assistants in memory. Sessions beyond
+    max_active (least recently used first) or idle for longer than
+    idle_seconds are saved to the store and dropped, and are rehydrated
+    into a new assistant on their next message.
+
+    on_load(session_id, assistant) is called whenever a session becomes live
+    (new or rehydrated), on_drop(session_id) when it leaves memory.
+    """
+
+    def __init__(self, factory: Callable[[], Any], store: Optional[SessionStore] = None,
+                 max_active: int = MAX_ACTIVE_SESSIONS, idle_seconds: float = SESSION_IDLE_SECONDS,
+                 on_load: Optional[Callable[[str, Any], None]] = None,
+                 on_drop: Optional[Callable[[str], None]] = None):
+        self.factory = factory
+        self.on_load = on_load
+        self.on_drop = on_drop
+        self.store = store if store is not None else create_session_store()
+        self.max_active = max_active
+        self.idle_seconds = idle_seconds
+        self._active: "OrderedDict[str, Any]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self._lock = threading.RLock()
+        self.rehydrations = 0
+        self.evictions = 0
+
+    def get(self, session_id: str) -> Any:
+        """Returns the live assistant for a session, rehydrating it from the store if needed."""
+        with self._lock:
+            assistant = self._active.get(session_id)
+            if assistant is not None:
+                self._active.move_to_end(session_id)
+            else:
+                assistant = self._rehydrate(session_id)
+                self._active[session_id] = assistant
+                if self.on_load is not None:
+                    self.on_load(session_id, assistant)
+            self._last_used[session_id] = time.monotonic()
+            self._evict(keep=session_id)
+            return assistant
+
+    def peek(self, session_id: str) -> Optional[Any]:
+        """
+        The live assistant for a session, or None if it isn't in memory. Unlike
+        get() it neither rehydrates nor counts as use, for polling readers that
+        must not keep a session from being evicted.
+        """
+        with self._lock:
+            return self._active.get(session_id)
+
+    def _rehydrate(self, session_id: str) -> Any:
+        assistant = self.factory()
+        # Lets background work (e.g. queued calendar writes) report back to the right session
+        assistant.session_id = session_id
+        started = time.perf_counter()
+        state = self.store.load(session_id)
+        if state is not None:
+            restore_session(assistant, state)
+            self.rehydrations += 1
+            logger.info(f"Rehydrated session {session_id} in {(time.perf_counter() - started) * 1000:.1f} ms.")
+        return assistant
+
+    def save(self, session_id: str, assistant: Any = None) -> None:
+        """
+        Writes a session to the store, call after each turn or UI change.
+        Pass the assistant the turn ran on, in case the session was evicted
+        while the turn was in progress.
+        """
+        with self._lock:
+            assistant = assistant if assistant is not None else self._active.get(session_id)
+            if assistant is not None:
+                self.store.save(session_id, export_session(assistant))
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        now = time.monotonic()
+        idle = [sid for sid, used in self._last_used.items()
+                if sid != keep and now - used > self.idle_seconds]
+        for session_id in idle:
+            self._drop(session_id)
+        while len(self._active) > self.max_active:
+            session_id = next(iter(self._active))
+            if session_id == keep:
+                break
+            self._drop(session_id)
+
+    def _drop(self, session_id: str) -> None:
+        assistant = self._active.pop(session_id, None)
+        self._last_used.pop(session_id, None)
+        if assistant is not None:
+            self.store.save(session_id, export_session(assistant))
+            self.evictions += 1
+            if self.on_drop is not None:
+                self.on_drop(session_id)
+
+    def evict_idle(self) -> None:
+        """Saves and drops idle sessions, for callers that want to sweep on a timer."""
+        with self._lock:
+            self._evict()
+
+    def close(self, session_id: str) -> None:
+        """Forgets a session entirely, in memory and in the store."""
+        with self._lock:
+            self._active.pop(session_id, None)
+            self._last_used.pop(session_id, None)
+        self.store.delete(session_id)
+        if self.on_drop is not None:
+            self.on_drop(session_id)
+
+    def recent_sessions(self, within_seconds: Optional[float] = None) -> List[Tuple[str, Any]]:
+        """(session_id, assistant) for live sessions used in the last within_seconds (default idle_seconds)."""
+        within = self.idle_seconds if within_seconds is None else within_seconds
+        now = time.monotonic()
+        with self._lock:
+            return [(sid, self._active[sid]) for sid, used in self._last_used.items()
+                    if sid in self._active and now - used <= within]
+
+    @property
+    def active_sessions(self) -> int:
+        return len(self._active)
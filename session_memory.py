@@ -0,0 +1,196 @@
+# session_memory.py
+
+import os
+import sys
+from collections import deque
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple
+
+# --- Constants ---
+# How many functions_called entries (and full results) a session keeps for the sidebar
+MAX_FUNCTIONS_CALLED = int(os.getenv("CMUGPT_MAX_FUNCTIONS_CALLED", "50"))
+# Full tool results larger than this many characters are truncated before being stored
+MAX_RESULT_CHARS = int(os.getenv("CMUGPT_MAX_RESULT_CHARS", "20000"))
+# Optional cap on conversation length, 0 keeps the whole conversation
+MAX_MESSAGES = int(os.getenv("CMUGPT_MAX_MESSAGES", "0"))
+
+
+class MessageRecord:
+    """
+    One chat message in the smallest form we can send back to OpenAI.
+    Tool calls are kept as (id, name, arguments) tuples instead of SDK objects.
+    """
+    __slots__ = ("role", "content", "tool_calls", "tool_call_id")
+
+    def __init__(self, role: str, content: Optional[str] = None,
+                 tool_calls: Optional[Tuple[Tuple[str, str, str], ...]] = None,
+                 tool_call_id: Optional[str] = None):
+        # Roles and tool names repeat in every message, so share one copy of each string
+        self.role = sys.intern(role)
+        self.content = content
+        self.tool_calls = tool_calls
+        self.tool_call_id = tool_call_id
+
+    @classmethod
+    def from_message(cls, message: Any) -> "MessageRecord":
+        """Builds a record from a message dict or an OpenAI ChatCompletionMessage."""
+        if isinstance(message, dict):
+            get = message.get
+        else:
+            get = lambda key: getattr(message, key, None)
+
+        tool_calls = None
+        if get("tool_calls"):
+            tool_calls = tuple(_compact_tool_call(tc) for tc in get("tool_calls"))
+        return cls(get("role") or "assistant", get("content"), tool_calls, get("tool_call_id"))
+
+    def to_openai(self) -> Dict[str, Any]:
+        message: Dict[str, Any] = {"role": self.role}
+        if self.content is not None or not self.tool_calls:
+            message["content"] = self.content
+        if self.tool_calls:
+            message["tool_calls"] = [
+                {"id": call_id, "type": "function", "function": {"name": name, "arguments": arguments}}
+                for call_id, name, arguments in self.tool_calls
+            ]
+        if self.tool_call_id is not None:
+            message["tool_call_id"] = self.tool_call_id
+        return message
+
+
+def _compact_tool_call(tool_call: Any) -> Tuple[str, str, str]:
+    if isinstance(tool_call, dict):
+        function = tool_call["function"]
+        return tool_call["id"], sys.intern(function["name"]), function.get("arguments") or "{}"
+    return tool_call.id, sys.intern(tool_call.function.name), tool_call.function.arguments or "{}"
+
+
+class MessageStore:
+    """
+    The conversation history of one session. Accepts the same dicts and SDK
+    messages the assistants used to append to a plain list, but stores them
+    as slotted records.
+    """
+
+    def __init__(self, messages: Iterable[Any] = (), max_messages: int = MAX_MESSAGES):
+        self.max_messages = max_messages
+        self._records: List[MessageRecord] = []
+        for message in messages:
+            self.append(message)
+
+    def append(self, message: Any) -> None:
+        record = message if isinstance(message, MessageRecord) else MessageRecord.from_message(message)
+        self._records.append(record)
+        if self.max_messages and len(self._records) > self.max_messages and record.role == "user":
+            self._trim()
+
+    def _trim(self) -> None:
+        self.compact(self.max_messages - sum(1 for r in self._records if r.role == "system"))
+
+    def compact(self, keep_messages: int) -> int:
+        """
+        Drops the oldest turns until at most keep_messages non-system messages
+        remain (the current turn is always kept), returns how many were dropped.
+        """
+        # Never splits a tool call from its result, turns are dropped whole
+        system = [r for r in self._records if r.role == "system"]
+        rest = [r for r in self._records if r.role != "system"]
+        before = len(rest)
+        budget = max(1, keep_messages)
+        while len(rest) > budget:
+            next_user = next((i for i, r in enumerate(rest[1:], 1) if r.role == "user"), None)
+            if next_user is None:
+                break
+            rest = rest[next_user:]
+        self._records = system + rest
+        return before - len(rest)
+
+    def to_openai(self) -> List[Dict[str, Any]]:
+        """Returns the messages in the format chat.completions.create expects."""
+        return [record.to_openai() for record in self._records]
+
+    def transcript(self) -> Iterator[Tuple[str, str]]:
+        """Yields (role, content) for the user and assistant messages shown in the chat UI."""
+        for record in self._records:
+            if record.role in ("user", "assistant") and record.content:
+                yield record.role, record.content
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __iter__(self) -> Iterator[MessageRecord]:
+        return iter(self._records)
+
+    def __getitem__(self, index):
+        return self._records[index]
+
+
+def new_functions_called(max_entries: int = MAX_FUNCTIONS_CALLED) -> deque:
+    """functions_called is a ring buffer, the oldest entries fall off once it is full."""
+    return deque(maxlen=max_entries)
+
+
+def deep_getsizeof(obj: Any, seen: Optional[set] = None) -> int:
+    """Approximate memory used by obj and everything it references, in bytes."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_getsizeof(k, seen) + deep_getsizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_getsizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__slots__"):
+        size += sum(deep_getsizeof(getattr(obj, slot), seen) for slot in obj.__slots__ if hasattr(obj, slot))
+    elif hasattr(obj, "__dict__"):
+        size += deep_getsizeof(vars(obj), seen)
+    return size
+
+
+def memory_footprint(messages: MessageStore, functions_called: Iterable[Any], result_store: Any) -> Dict[str, int]:
+    """Byte counts for the parts of a session that grow with its length."""
+    footprint = {
+        "messages": deep_getsizeof(messages),
+        "functions_called": deep_getsizeof(functions_called),
+        "results": deep_getsizeof(result_store),
+    }
+    footprint["total"] = sum(footprint.values())
+    return footprint
+
+
+# --- Serialization ---
+
+# UI flags the Streamlit apps read off the assistant, saved along with the conversation
+UI_FLAGS = ("show_eats", "show_courses")
+
+
+def export_session(assistant: Any) -> Dict[str, Any]:
+    """Returns the conversation state of an assistant as JSON-serializable data."""
+    state = {
+        "messages": assistant.messages.to_openai(),
+        "functions_called": list(assistant.functions_called),
+        "results": assistant.result_store.to_state(),
+        "flags": {flag: getattr(assistant, flag) for flag in UI_FLAGS if hasattr(assistant, flag)},
+    }
+    if hasattr(assistant, "usage"):
+        # Token usage persists with the session, so budgets hold across evictions and workers
+        state["usage"] = assistant.usage.to_state()
+    return state
+
+
+def restore_session(assistant: Any, state: Dict[str, Any]) -> None:
+    """Loads state from export_session() into a freshly constructed assistant."""
+    # The system prompts come from the assistant's constructor, so the saved ones are replaced
+    system = [record for record in assistant.messages if record.role == "system"]
+    assistant.messages = MessageStore(system, assistant.messages.max_messages)
+    for message in state.get("messages", []):
+        if message.get("role") != "system":
+            assistant.messages.append(message)
+    assistant.functions_called.clear()
+    assistant.functions_called.extend(state.get("functions_called", []))
+    assistant.result_store.restore(state.get("results", {}))
+    for flag, value in state.get("flags", {}).items():
+        if flag in UI_FLAGS:
+            setattr(assistant, flag, value)
+    if "usage" in state and hasattr(assistant, "usage"):
+        assistant.usage.restore(state["usage"])
@@ -0,0 +1,224 @@
+# structured_logging.py
+
+"""
+Non-blocking structured logging. Code logs through the standard `logging`
+module as usual. The root logger's only handler puts each record on an
+in-memory queue, and a QueueListener thread formats it as one JSON line and
+writes it to stdout. A slow log drain backs up the queue instead of stalling
+a request; once the queue is full, records are dropped and counted.
+
+Records carry the session and turn id of the request that logged them, also
+from the tool threads a turn fans out to:
+
+    {"ts": "2026-10-19T14:02:11.532+00:00", "level": "INFO", "logger": "production_cmugpt_assistant",
+     "msg": "Tool calls requested: find_free_slots", "session_id": "4f1c...", "turn_id": "9a02...", "tools": [...]}
+
+Settings: CMUGPT_LOG_LEVEL (INFO), CMUGPT_LOG_FORMAT (json or text),
+CMUGPT_LOG_SAMPLE (keep rates per level, e.g. "DEBUG=0.05,INFO=0.5"; WARNING
+and above are always kept) and CMUGPT_LOG_QUEUE_SIZE.
+"""
+
+import os
+import sys
+import copy
+import json
+import uuid
+import zlib
+import queue
+import random
+import atexit
+import logging
+import threading
+import contextvars
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+LOG_LEVEL = os.getenv("CMUGPT_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("CMUGPT_LOG_FORMAT", "json")
+LOG_SAMPLE = os.getenv("CMUGPT_LOG_SAMPLE", "")
+LOG_QUEUE_SIZE = int(os.getenv("CMUGPT_LOG_QUEUE_SIZE", "10000"))
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(session_id)s %(turn_id)s] %(message)s"
+# Libraries that log every HTTP request at INFO
+QUIET_LOGGERS = ("httpx", "httpcore", "urllib3")
+
+# Attributes every LogRecord has, anything else was passed with extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_session_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("session_id", default=None)
+_turn_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("turn_id", default=None)
+
+
+# --- Request Context ---
+
+def start_turn(session_id: Optional[str] = None) -> str:
+    """
+    Tags the records logged from here on (in this thread or task) with the
+    session and a new turn id, and returns the turn id.
+    """
+    turn_id = uuid.uuid4().hex[:16]
+    _session_id.set(session_id)
+    _turn_id.set(turn_id)
+    return turn_id
+
+
+def current_context() -> Dict[str, Optional[str]]:
+    return {"session_id": _session_id.get(), "turn_id": _turn_id.get()}
+
+
+class ContextFilter(logging.Filter):
+    """Stamps records with the session and turn id. Runs in the logging thread, before the queue."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.session_id = _session_id.get()
+        record.turn_id = _turn_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a fraction of the records at each configured level. The decision is
+    made per turn, so a sampled turn is logged completely rather than a random
+    half of its lines. Levels without a rate are always kept.
+    """
+
+    def __init__(self, rates: Dict[int, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.levelno)
+        if rate is None or rate >= 1.0:
+            return True
+        turn_id = getattr(record, "turn_id", None)
+        if turn_id is None:
+            return random.random() < rate
+        return zlib.crc32(turn_id.encode()) / 2 ** 32 < rate
+
+
+def parse_sample_rates(spec: str) -> Dict[int, float]:
+    """"DEBUG=0.05,INFO=0.5" -> {10: 0.05, 20: 0.5}. WARNING and above can't be sampled."""
+    rates = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, value = part.partition("=")
+        level = logging.getLevelName(name.strip().upper())
+        if not isinstance(level, int) or level >= logging.WARNING:
+            raise ValueError(f"Can't sample log level '{name}', only DEBUG and INFO.")
+        rates[level] = float(value)
+    return rates
+
+
+# --- Formatting ---
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record. Fields passed with extra= are included as they are."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and value is not None and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """A QueueHandler that drops records when the queue is full instead of blocking or raising."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        # Approximate, it's only read for stats
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve the message and traceback now, while the arguments still have the values
+        # they were logged with, but leave the formatting to the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _DrainingQueueListener(QueueListener):
+
+    def enqueue_sentinel(self) -> None:
+        # Only called on shutdown, where waiting for the writer to make room is what we want
+        self.queue.put(self._sentinel)
+
+
+# --- Setup ---
+
+_handler: Optional[NonBlockingQueueHandler] = None
+_listener: Optional[_DrainingQueueListener] = None
+_setup_lock = threading.Lock()
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, sample: str = LOG_SAMPLE,
+                      stream=None) -> None:
+    """
+    Installs the queue handler on the root logger and starts the writer thread.
+    Entry points (the Streamlit apps, the API server, CLIs) call it once; later
+    calls are no-ops, so library modules never need to.
+    """
+    global _handler, _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+        _handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+        _handler.addFilter(ContextFilter())
+        rates = parse_sample_rates(sample)
+        if rates:
+            _handler.addFilter(SamplingFilter(rates))
+
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(_handler)
+        for name in QUIET_LOGGERS:
+            logging.getLogger(name).setLevel(max(logging.WARNING, root.level))
+
+        _listener = _DrainingQueueListener(_handler.queue, output, respect_handler_level=True)
+        _listener.start()
+        # Flushes what's still queued on a normal exit
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    global _handler, _listener
+    with _setup_lock:
+        if _listener is None:
+            return
+        logging.getLogger().removeHandler(_handler)
+        _listener.stop()
+        _handler, _listener = None, None
+
+
+def logging_stats() -> Dict[str, int]:
+    if _handler is None:
+        return {"queued": 0, "dropped": 0}
+    return {"queued": _handler.queue.qsize(), "dropped": _handler.dropped}
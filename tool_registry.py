@@ -0,0 +1,461 @@
+# tool_registry.py
+
+import time
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Callable, Iterable, Tuple, Union
+
+from result_compactor import compact_result, DEFAULT_TOKEN_BUDGET
+from metrics import TOOL_CALLS, TOOL_SECONDS, TOOL_TIMEOUTS
+from dining_hours import get_dining_hours, parse_when
+
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+DEFAULT_TIMEOUT = 30.0
+MAX_PARALLEL_TOOLS = 8
+# A call still queued behind other sessions' tools after this long is given up on without running
+MAX_QUEUE_SECONDS = 30.0
+
+
+def _no_parameters() -> Dict[str, Any]:
+    return {"type": "object", "properties": {}, "required": [], "additionalProperties": False}
+
+
+@dataclass
+class ToolSpec:
+    """
+    A tool declared once: the schema the model sees, the implementation the
+    assistant runs, and the policy the registry enforces (timeout, side
+    effects, concurrency, result size). Results aren't cached here: tools
+    cache their own data with keys that include the user.
+
+    handler is called as handler(assistant, arguments) and may use the
+    assistant's state (calendar service, UI flags, Perplexity client).
+    """
+    name: str
+    description: Union[str, Callable[[], str]]
+    handler: Callable[[Any, Dict[str, Any]], Any]
+    parameters: Union[Dict[str, Any], Callable[[], Dict[str, Any]]] = field(default_factory=_no_parameters)
+    strict: bool = False
+    # Seconds the handler may run before the model is answered with an error. A handler that
+    # times out keeps running, so tools with side effects should wait for it (None).
+    timeout: Optional[float] = DEFAULT_TIMEOUT
+    # Tools that change something outside the conversation must not be retried after a timeout
+    side_effect: bool = False
+    # Parallel-safe tools may run concurrently with other tool calls from the same turn
+    parallel_safe: bool = True
+    # Fields of a dict result the model needs, None keeps them all
+    keep_fields: Optional[List[str]] = None
+    # Results are truncated to roughly this many tokens before entering the conversation
+    token_budget: int = DEFAULT_TOKEN_BUDGET
+
+    def to_openai(self) -> Dict[str, Any]:
+        # Descriptions can be callables so dates in them are evaluated per request
+        description = self.description() if callable(self.description) else self.description
+        parameters = self.parameters() if callable(self.parameters) else self.parameters
+        return {
+            "type": "function",
+            "function": {
+                "name": self.name,
+                "description": description,
+                "parameters": parameters,
+                "strict": self.strict,
+            }
+        }
+
+
+class _CallStart:
+    """Set by the worker thread when a queued tool call begins to run."""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.at = 0.0
+
+    def mark(self) -> None:
+        self.at = time.monotonic()
+        self.started.set()
+
+
+class ToolRegistry:
+    """Generates the OpenAI tool list and dispatches tool calls by name."""
+
+    def __init__(self):
+        self._tools: Dict[str, ToolSpec] = {}
+        self._executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_TOOLS, thread_name_prefix="tool")
+
+    def register(self, spec: ToolSpec) -> ToolSpec:
+        if spec.name in self._tools:
+            raise ValueError(f"Tool '{spec.name}' is already registered.")
+        self._tools[spec.name] = spec
+        return spec
+
+    def get(self, name: str) -> Optional[ToolSpec]:
+        return self._tools.get(name)
+
+    def names(self) -> List[str]:
+        return list(self._tools)
+
+    def openai_tools(self, names: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """Builds the `tools` argument for chat.completions.create."""
+        names = self.names() if names is None else names
+        return [self._tools[name].to_openai() for name in names]
+
+    # --- Dispatch ---
+
+    # No result cache here: tools cache where it's safe (Perplexity answers, Canvas data per
+    # user) with keys that include the user, and arguments alone don't say whose data it is.
+
+    def _run(self, spec: ToolSpec, assistant: Any, arguments: Dict[str, Any], start: "_CallStart") -> Any:
+        start.mark()
+        outcome = "ok"
+        try:
+            result = spec.handler(assistant, arguments)
+            if isinstance(result, dict) and result.get("error"):
+                outcome = "error"
+            return result
+        except Exception as e:
+            logger.exception(f"Tool {spec.name} raised an exception.")
+            outcome = "error"
+            return {"error": f"Tool '{spec.name}' failed: {type(e).__name__}"}
+        finally:
+            TOOL_CALLS.inc(tool=spec.name, outcome=outcome)
+            TOOL_SECONDS.observe(time.monotonic() - start.at, tool=spec.name)
+
+    def _submit(self, spec: ToolSpec, assistant: Any, arguments: Dict[str, Any]) -> Tuple[Any, "_CallStart"]:
+        # Each call runs in a copy of the caller's context, so its log records keep the turn's ids
+        start = _CallStart()
+        future = self._executor.submit(contextvars.copy_context().run, self._run, spec, assistant, arguments, start)
+        return future, start
+
+    def _wait(self, spec: ToolSpec, future, start: "_CallStart") -> Any:
+        """The call's result. Its timeout counts from when the handler started, not from when it was queued."""
+        if not start.started.wait(MAX_QUEUE_SECONDS) and future.cancel():
+            # Never ran, so trying again is safe even for side effects
+            logger.error(f"Tool {spec.name} was still queued after {MAX_QUEUE_SECONDS}s.")
+            TOOL_TIMEOUTS.inc(tool=spec.name)
+            return {"error": f"The {spec.name} tool is busy and did not run. Please try again later."}
+        start.started.wait()
+        timeout = None if spec.timeout is None else max(0.0, start.at + spec.timeout - time.monotonic())
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            logger.error(f"Tool {spec.name} timed out after {spec.timeout}s.")
+            TOOL_TIMEOUTS.inc(tool=spec.name)
+            if spec.side_effect:
+                # The handler is still running and may yet succeed, a retry could make the change twice
+                return {"error": f"The {spec.name} tool is still in progress. Do not call it again for this "
+                                 f"request, tell the user the change may take a moment to appear."}
+            return {"error": f"The {spec.name} tool timed out. Please try again later."}
+
+    def dispatch(self, assistant: Any, name: str, arguments: Dict[str, Any]) -> Any:
+        """Runs one tool call under its timeout policy. Results aren't cached here, see above."""
+        return self.dispatch_many(assistant, [(name, arguments)])[0]
+
+    def dispatch_many(self, assistant: Any, calls: List[Tuple[str, Dict[str, Any]]]) -> List[Any]:
+        """
+        Runs the tool calls from one model turn and returns their results in
+        order. When every call is parallel-safe they run concurrently,
+        otherwise they run one after another in the order the model asked.
+        """
+        specs = [self._tools.get(name) for name, _ in calls]
+        results: List[Any] = [None] * len(calls)
+        pending = []
+        for i, (spec, (name, arguments)) in enumerate(zip(specs, calls)):
+            if spec is None:
+                logger.error(f"Function '{name}' not found.")
+                results[i] = {"error": f"Function '{name}' not found."}
+            else:
+                pending.append((i, spec, arguments))
+
+        parallel = all(spec.parallel_safe for _, spec, _ in pending)
+        if parallel:
+            submitted = [(i, spec, self._submit(spec, assistant, arguments)) for i, spec, arguments in pending]
+            for i, spec, (future, started) in submitted:
+                results[i] = self._wait(spec, future, started)
+        else:
+            for i, spec, arguments in pending:
+                results[i] = self._wait(spec, *self._submit(spec, assistant, arguments))
+        return results
+
+    def compact(self, name: str, result: Any) -> str:
+        """Returns the compacted JSON content of a tool result for the conversation."""
+        spec = self._tools.get(name)
+        if spec is None:
+            return compact_result(result)
+        return compact_result(result, spec.keep_fields, spec.token_budget)
+
+
+# --- Tool Declarations ---
+
+def _canvas():
+    # Imported on first use of a Canvas tool, not when the registry loads
+    import canvas_tools
+    return canvas_tools
+
+
+def _today() -> str:
+    return datetime.now().strftime("%B %d, %Y")
+
+
+def _find_open_dining(assistant: Any, args: Dict[str, Any]) -> Any:
+    near, location = args.get('near'), args.get('location')
+    try:
+        when = parse_when(args.get('date'), args.get('time'))
+    except ValueError as e:
+        # The search gets the date and time as the model wrote them
+        logger.info(f"find_open_dining falls back to search: {e}")
+        result = None
+    else:
+        result = get_dining_hours().lookup(when, near, location)
+    if result is not None:
+        return result
+    # A date or time it can't read, no snapshot, an outdated one, or a place it doesn't list
+    when = " ".join(part for part in ("on " + args['date'] if args.get('date') else "",
+                                      "at " + args['time'] if args.get('time') else "") if part) or "right now"
+    if location:
+        query = f"Is {location} at Carnegie Mellon open {when}, and what are its hours?"
+    else:
+        query = f"Which Carnegie Mellon dining locations are open {when}" + (f" near {near}" if near else "") + "?"
+    return assistant.general_purpose_knowledge_search(query)
+
+
+def _calendar_date_description(which: str) -> str:
+    now = datetime.now()
+    return (f"{which} date of the event to be created, in the form of 'MM/DD/YYYY' with DEFAULT DATE AS {now} "
+            f"if not specified by the user. When the user specifies a day of the week, use {now} as reference "
+            f"for today's date. ALWAYS think twice and count to check that the date and the user's specified day match up")
+
+
+def _create_event_parameters() -> Dict[str, Any]:
+    return {
+        "type": "object",
+        "properties": {
+            "summary": {
+                "type": "string",
+                "description": "The name of the event to be created with default settings"
+            },
+            "location": {
+                "type": "string",
+                "description": "The location of the event to be created with default settings"
+            },
+            "description": {
+                "type": "string",
+                "description": "A detailed description of the event to be created with default settings"
+            },
+            "start_date": {
+                "type": "string",
+                "description": _calendar_date_description("Start")
+            },
+            "end_date": {
+                "type": "string",
+                "description": _calendar_date_description("End")
+            },
+            "start_time": {
+                "type": "string",
+                "description": "Start time during the day of the event to be created, in the form of 'HH:MM' with default set to the time 09:00"
+            },
+            "end_time": {
+                "type": "string",
+                "description": "End time of the event to be created, in the form of 'HH:MM' with default set to one hour after start_time"
+            },
+            "allow_conflicts": {
+                "type": "boolean",
+                "description": "Create the event even if it overlaps existing events. Only set to true after the user confirms."
+            }
+        },
+        "required": ["summary", "start_time", "end_time"],
+        "additionalProperties": False
+    }
+
+
+TOOL_REGISTRY = ToolRegistry()
+
+TOOL_REGISTRY.register(ToolSpec(
+    name="general_purpose_knowledge_search",
+    description=lambda: "Search for general knowledge about Carnegie Mellon University. Today's date is " + _today(),
+    parameters={
+        "type": "object",
+        "properties": {
+            "search_query": {
+                "type": "string",
+                "description": "The query to search for general knowledge."
+            }
+        },
+        "required": ["search_query"],
+        "additionalProperties": False
+    },
+    strict=True,
+    handler=lambda assistant, args: assistant.general_purpose_knowledge_search(args.get('search_query')),
+    timeout=20.0,
+    # Cached inside CMUPerplexitySearch, where speculative and prefetched searches share it
+    keep_fields=["answer"],
+    token_budget=400,
+))
+
+TOOL_REGISTRY.register(ToolSpec(
+    name="show_cmueats_website",
+    description="Display cmueats website to the UI frontend",
+    strict=True,
+    handler=lambda assistant, args: assistant.show_cmu_eats(),
+    timeout=5.0,
+))
+
+TOOL_REGISTRY.register(ToolSpec(
+    name="find_open_dining",
+    description=lambda: ("Find which CMU dining locations are open at a time, e.g. \"what's open now\" or "
+                         "\"food at 9pm near Gates\", or when a named location opens and closes. "
+                         "Today's date is " + _today()),
+    parameters=lambda: {
+        "type": "object",
+        "properties": {
+            "date": {
+                "type": "string",
+                "description": (f"Day to check, in the form of 'MM/DD/YYYY'. Today ({datetime.now():%m/%d/%Y}) "
+                                f"if not specified. When the user names a day of the week, count from today's date.")
+            },
+            "time": {
+                "type": "string",
+                "description": "Time of day to check, 'HH:MM' (24h), e.g. 21:00 for 9pm. Now if not specified."
+            },
+            "near": {
+                "type": "string",
+                "description": "Campus building the user wants food near, e.g. 'Gates' or 'Cohon Center'."
+            },
+            "location": {
+                "type": "string",
+                "description": "A dining location the user asked about by name, to get only its hours."
+            }
+        },
+        "required": [],
+        "additionalProperties": False
+    },
+    handler=_find_open_dining,
+    # Answered from the local snapshot in microseconds, this only matters for the search fallback
+    timeout=20.0,
+    # Everything the index answers with, and only the answer of a search fallback
+    keep_fields=["time", "near", "note", "open", "more_open", "opening_soon", "closed", "answer"],
+    token_budget=600,
+))
+
+TOOL_REGISTRY.register(ToolSpec(
+    name="show_cmucourses_website",
+    description="Display cmucourses website to the UI frontend",
+    strict=True,
+    handler=lambda assistant, args: assistant.show_cmu_courses(),
+    timeout=5.0,
+))
+
+TOOL_REGISTRY.register(ToolSpec(
+    name="create_calendar_event",
+    description="Create/Add an event in the user's calendar when prompted",
+    parameters=_create_event_parameters,
+    handler=lambda assistant, args: assistant.create_calendar_event(
+        args.get('summary'), args.get('location'), args.get('description'), args.get('start_date'),
+        args.get('end_date'), args.get('start_time'), args.get('end_time'), bool(args.get('allow_conflicts'))),
+    # Waited for however long it takes, a timed-out change that later succeeds must not be retried
+    timeout=None,
+    side_effect=True,
+    parallel_safe=False,
+))
+
+TOOL_REGISTRY.register(ToolSpec(
+    name="delete_calendar_event",
+    description="Delete a calendar event that matches the given summary. First fetch events and then delete the one that matches.",
+    parameters={
+        "type": "object",
+        "properties": {
+            "summary": {
+                "type": "string",
+                "description": "The name of the event to be deleted with default settings"
+            }
+        },
+        "required": ["summary"],
+        "additionalProperties": False
+    },
+    handler=lambda assistant, args: assistant.delete_calendar_event(args.get('summary')),
+    timeout=None,
+    side_effect=True,
+    parallel_safe=False,
+))
+
+TOOL_REGISTRY.register(ToolSpec(
+    name="delete_all_event",
+    description="Delete all events in the calendar",
+    handler=lambda assistant, args: assistant.delete_all_event(),
+    timeout=None,
+    side_effect=True,
+    parallel_safe=False,
+))
+
+TOOL_REGISTRY.register(ToolSpec(
+    name="get_current_canvas_courses",
+    description="Fetches the user's currently active courses from Canvas for the most recent academic term.",
+    handler=lambda assistant, args: _canvas().fetch_current_courses(),
+    timeout=25.0,
+    # Cached per Canvas user inside canvas_tools
+    keep_fields=["courses_list"],
+    token_budget=600,
+))
+
+TOOL_REGISTRY.register(ToolSpec(
+    name="get_upcoming_canvas_assignments",
+    description="Lists the user's Canvas assignments and deadlines due soon, soonest first. Use for questions like \"what's due this week\".",
+    parameters={
+        "type": "object",
+        "properties": {
+            "days": {
+                "type": "integer",
+                "description": "How many days ahead to look, 7 unless the user says otherwise."
+            }
+        },
+        "required": [],
+        "additionalProperties": False
+    },
+    handler=lambda assistant, args: _canvas().fetch_upcoming_assignments(days=args.get('days') or 7),
+    timeout=30.0,
+    # Cached per course (or per planner window) inside canvas_tools
+    keep_fields=["assignments_list"],
+    token_budget=800,
+))
+
+TOOL_REGISTRY.register(ToolSpec(
+    name="find_free_slots",
+    description=lambda: ("Find free time in the user's calendar, e.g. \"a free hour Thursday afternoon\". "
+                         "Today's date is " + _today()),
+    parameters=lambda: {
+        "type": "object",
+        "properties": {
+            "date": {
+                "type": "string",
+                "description": (f"First day to search, in the form of 'MM/DD/YYYY'. Today ({datetime.now():%m/%d/%Y}) "
+                                f"if not specified. When the user names a day of the week, count from today's date.")
+            },
+            "start_time": {
+                "type": "string",
+                "description": "Earliest time of day to consider, 'HH:MM' (24h). Use 12:00 for afternoon, default 09:00."
+            },
+            "end_time": {
+                "type": "string",
+                "description": "Latest time of day to consider, 'HH:MM' (24h). Use 17:00 for afternoon, default 17:00."
+            },
+            "duration_minutes": {
+                "type": "integer",
+                "description": "Length of the slot needed in minutes, default 60."
+            },
+            "days": {
+                "type": "integer",
+                "description": "Number of consecutive days to search starting at date, default 1."
+            }
+        },
+        "required": [],
+        "additionalProperties": False
+    },
+    handler=lambda assistant, args: assistant.find_free_slots(
+        args.get('date'), args.get('start_time'), args.get('end_time'), args.get('duration_minutes'), args.get('days')),
+    timeout=20.0,
+))
@@ -0,0 +1,248 @@
+# usage_accounting.py
+
+"""
+Token usage and estimated cost of the model calls a session makes. OpenAI
+calls are recorded from `response.usage`, Perplexity searches from the
+`usage` block of their response. Each call is added to its session's
+ledger (per turn, model, call type and tool) and to process-wide totals:
+
+    assistant.usage.summary()  # {"total": {"calls": 4, "prompt_tokens": ..., "cost_usd": ...}, "by_model": ...}
+    USAGE_METER.stats()        # the same, summed over every session in this process
+
+A session can have a budget, CMUGPT_SESSION_TOKEN_BUDGET tokens and/or
+CMUGPT_SESSION_COST_BUDGET dollars. Once it is spent, the assistant trims
+older history before each turn and switches to CMUGPT_BUDGET_MODEL.
+"""
+
+import os
+import logging
+import threading
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+from metrics import MODEL_COST, MODEL_TOKENS
+
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+# USD per million (input, cached input, output) tokens. Estimates for reporting and budgets, not billing.
+# Models are matched by longest prefix, so dated snapshots ("gpt-4o-mini-2024-07-18") resolve too.
+PRICES_PER_MILLION: Dict[str, Tuple[float, float, float]] = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "llama-3.1-sonar-small-128k-online": (0.20, 0.20, 0.20),
+    "sonar": (1.00, 1.00, 1.00),
+}
+# Flat per-request fees on top of tokens (Perplexity's search fee)
+REQUEST_FEES_USD: Dict[str, float] = {
+    "llama-3.1-sonar-small-128k-online": 0.005,
+    "sonar": 0.005,
+}
+SESSION_TOKEN_BUDGET = int(os.getenv("CMUGPT_SESSION_TOKEN_BUDGET", "0"))
+SESSION_COST_BUDGET = float(os.getenv("CMUGPT_SESSION_COST_BUDGET", "0"))
+BUDGET_MODEL = os.getenv("CMUGPT_BUDGET_MODEL", "gpt-4o-mini")
+# Non-system messages kept before each turn once a session is over budget
+BUDGET_HISTORY_MESSAGES = int(os.getenv("CMUGPT_BUDGET_HISTORY_MESSAGES", "12"))
+# Per-turn detail kept per session, older turns only count towards the totals
+MAX_USAGE_TURNS = 50
+
+
+def _price(model: str) -> Tuple[Tuple[float, float, float], float]:
+    matches = [name for name in PRICES_PER_MILLION if model.startswith(name)]
+    if not matches:
+        return (0.0, 0.0, 0.0), 0.0
+    name = max(matches, key=len)
+    return PRICES_PER_MILLION[name], REQUEST_FEES_USD.get(name, 0.0)
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    (input_price, cached_price, output_price), fee = _price(model or "")
+    cost = ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+            + completion_tokens * output_price) / 1_000_000
+    return cost + fee
+
+
+def _field(obj: Any, name: str) -> Any:
+    # Usage comes as SDK objects from OpenAI and as plain dicts from Perplexity
+    if obj is None:
+        return None
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+
+def read_usage(usage: Any) -> Tuple[int, int, int]:
+    """(prompt, completion, cached prompt) tokens from an OpenAI-style usage block."""
+    cached = _field(_field(usage, "prompt_tokens_details"), "cached_tokens")
+    return int(_field(usage, "prompt_tokens") or 0), int(_field(usage, "completion_tokens") or 0), int(cached or 0)
+
+
+def _new_totals() -> Dict[str, Any]:
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "cost_usd": 0.0}
+
+
+def _add(totals: Dict[str, Any], call: Dict[str, Any]) -> None:
+    totals["calls"] += 1
+    for key in ("prompt_tokens", "completion_tokens", "cached_tokens", "cost_usd"):
+        totals[key] += call[key]
+
+
+def _rounded(totals: Dict[str, Any]) -> Dict[str, Any]:
+    return {**totals, "cost_usd": round(totals["cost_usd"], 6)}
+
+
+class UsageMeter:
+    """Thread-safe process-wide totals by model, call type and tool, also exported as Prometheus counters."""
+
+    def __init__(self):
+        self._total = _new_totals()
+        self._groups: Dict[str, Dict[str, Dict[str, Any]]] = {"by_model": {}, "by_call_type": {}, "by_tool": {}}
+        self._lock = threading.Lock()
+
+    def record(self, call: Dict[str, Any]) -> None:
+        with self._lock:
+            _add(self._total, call)
+            for group, key in (("by_model", call["model"]), ("by_call_type", call["call_type"]),
+                               ("by_tool", call.get("tool"))):
+                if key is not None:
+                    _add(self._groups[group].setdefault(key, _new_totals()), call)
+        model = call["model"]
+        MODEL_TOKENS.inc(call["prompt_tokens"] - call["cached_tokens"], model=model, kind="prompt")
+        MODEL_TOKENS.inc(call["cached_tokens"], model=model, kind="cached_prompt")
+        MODEL_TOKENS.inc(call["completion_tokens"], model=model, kind="completion")
+        MODEL_COST.inc(call["cost_usd"], model=model)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = {"total": _rounded(self._total)}
+            for group, totals in self._groups.items():
+                stats[group] = {key: _rounded(t) for key, t in totals.items()}
+            return stats
+
+    def reset(self) -> None:
+        with self._lock:
+            self._total = _new_totals()
+            for totals in self._groups.values():
+                totals.clear()
+
+
+USAGE_METER = UsageMeter()
+
+
+class UsageLedger:
+    """
+    The usage of one session. Calls can be recorded from tool threads (a
+    Perplexity search) while the turn's own OpenAI calls are recorded.
+    """
+
+    def __init__(self, token_budget: int = SESSION_TOKEN_BUDGET, cost_budget: float = SESSION_COST_BUDGET,
+                 meter: Optional[UsageMeter] = USAGE_METER):
+        self.token_budget = token_budget
+        self.cost_budget = cost_budget
+        self.meter = meter
+        self.turns: deque = deque(maxlen=MAX_USAGE_TURNS)
+        self.total = _new_totals()
+        self.by_model: Dict[str, Dict[str, Any]] = {}
+        self.by_tool: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def start_turn(self) -> None:
+        with self._lock:
+            self.turns.append({**_new_totals(), "entries": []})
+
+    def record(self, call_type: str, model: str, prompt_tokens: int, completion_tokens: int,
+               cached_tokens: int = 0, tool: Optional[str] = None, route: Any = None) -> Dict[str, Any]:
+        """
+        Adds one call. call_type says what it was for ("tool_selection",
+        "synthesis", "search", ...), tool which tool made it, if any, and route
+        why that model was picked (model_router.RouteDecision).
+        """
+        call = {
+            "call_type": call_type,
+            "model": model,
+            "tool": tool,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cached_tokens": cached_tokens,
+            "cost_usd": estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens),
+        }
+        if route is not None:
+            call["route"] = route.reason
+            call["latency_ms"] = route.latency_ms
+        with self._lock:
+            if not self.turns:
+                self.turns.append({**_new_totals(), "entries": []})
+            turn = self.turns[-1]
+            turn["entries"].append(call)
+            _add(turn, call)
+            _add(self.total, call)
+            _add(self.by_model.setdefault(model, _new_totals()), call)
+            if tool is not None:
+                _add(self.by_tool.setdefault(tool, _new_totals()), call)
+        if self.meter is not None:
+            self.meter.record(call)
+        logger.debug(f"{call_type} call to {model}: {prompt_tokens} prompt ({cached_tokens} cached), "
+                     f"{completion_tokens} completion tokens, ${call['cost_usd']:.6f}")
+        return call
+
+    def record_openai(self, call_type: str, response: Any, tool: Optional[str] = None,
+                      route: Any = None) -> Optional[Dict[str, Any]]:
+        """Records a chat completion, or the final chunk of a stream opened with include_usage."""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return None
+        return self.record(call_type, getattr(response, "model", None) or "unknown", *read_usage(usage),
+                           tool=tool, route=route)
+
+    def record_perplexity(self, response: Dict[str, Any], tool: Optional[str] = None,
+                          call_type: str = "search") -> Optional[Dict[str, Any]]:
+        usage = response.get("usage")
+        if usage is None:
+            return None
+        return self.record(call_type, response.get("model") or "unknown", *read_usage(usage), tool=tool)
+
+    @property
+    def tokens_used(self) -> int:
+        return self.total["prompt_tokens"] + self.total["completion_tokens"]
+
+    @property
+    def over_budget(self) -> bool:
+        return ((self.token_budget > 0 and self.tokens_used >= self.token_budget)
+                or (self.cost_budget > 0 and self.total["cost_usd"] >= self.cost_budget))
+
+    def last_turn(self) -> Optional[Dict[str, Any]]:
+        """Totals of the current turn, with its individual calls."""
+        with self._lock:
+            if not self.turns:
+                return None
+            turn = self.turns[-1]
+            return {**_rounded(turn), "entries": list(turn["entries"])}
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "total": _rounded(self.total),
+                "turns": len(self.turns),
+                "by_model": {model: _rounded(t) for model, t in self.by_model.items()},
+                "by_tool": {tool: _rounded(t) for tool, t in self.by_tool.items()},
+                "token_budget": self.token_budget,
+                "cost_budget_usd": self.cost_budget,
+                "over_budget": self.over_budget,
+            }
+
+    # --- Serialization ---
+
+    def to_state(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"turns": list(self.turns), "total": dict(self.total),
+                    "by_model": self.by_model, "by_tool": self.by_tool}
+
+    def restore(self, state: Dict[str, Any]) -> None:
+        """Loads to_state() output. Restored usage isn't added to the process-wide meter again."""
+        with self._lock:
+            self.turns = deque(state.get("turns", []), maxlen=MAX_USAGE_TURNS)
+            self.total = {**_new_totals(), **state.get("total", {})}
+            self.by_model = state.get("by_model", {})
+            self.by_tool = state.get("by_tool", {})
+
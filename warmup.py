@@ -0,0 +1,91 @@
+# warmup.py
+
+"""
+Optional warm-up before a worker takes traffic (CMUGPT_WARMUP=1). Imports the
+modules the assistant defers to first use, and opens the upstream
+connections (OpenAI, Google Calendar, Canvas) that the first user would
+otherwise wait on. The API server runs it at startup, the Streamlit app in
+the background when its session manager is created.
+"""
+
+import os
+import time
+import logging
+import importlib
+import threading
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+# What production_cmugpt_assistant and tool_registry import lazily, see benchmarks/import_time.py
+DEFERRED_MODULES = (
+    "googleapiclient.discovery",
+    "googleapiclient.http",
+    "googleapiclient.errors",
+    "google_auth_httplib2",
+    "google.oauth2.credentials",
+    "google.auth.transport.requests",
+    "tzlocal",
+    "difflib",
+    "canvas_tools",
+)
+
+
+def warmup_enabled() -> bool:
+    return os.getenv("CMUGPT_WARMUP", "0") == "1"
+
+
+def _connect_openai() -> None:
+    from production_cmugpt_assistant import get_openai_client
+    # Any cheap authenticated call opens the pooled connection the shared client reuses
+    get_openai_client().models.list()
+
+
+def _connect_calendar() -> None:
+    # Without a saved token this would start the interactive OAuth flow, never do that here
+    if not os.path.exists("token.json"):
+        raise FileNotFoundError("token.json not found, skipping")
+    from production_cmugpt_assistant import authenticate_google_calendar
+    authenticate_google_calendar()
+
+
+def _connect_canvas() -> None:
+    base_url = os.getenv("CANVAS_BASE_URL")
+    if not base_url:
+        raise ValueError("CANVAS_BASE_URL not set, skipping")
+    import canvas_tools
+    canvas_tools._http.head(base_url, timeout=5)
+
+
+def warm_up(connect: bool = True) -> Dict[str, float]:
+    """
+    Runs every warm-up step, returns milliseconds per step. A failing step is
+    logged and skipped, warming up must never keep the worker from starting.
+    """
+    steps: Dict[str, Callable[[], object]] = {
+        "import production_cmugpt_assistant": lambda: importlib.import_module("production_cmugpt_assistant"),
+    }
+    for module in DEFERRED_MODULES:
+        steps[f"import {module}"] = lambda module=module: importlib.import_module(module)
+    if connect:
+        steps.update({"connect openai": _connect_openai, "connect calendar": _connect_calendar,
+                      "connect canvas": _connect_canvas})
+
+    timings = {}
+    started = time.perf_counter()
+    for name, step in steps.items():
+        step_started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            logger.info(f"Warm-up step '{name}' skipped: {e}")
+        timings[name] = round((time.perf_counter() - step_started) * 1000, 1)
+    logger.info(f"Warm-up finished in {(time.perf_counter() - started) * 1000:.0f} ms.")
+    return timings
+
+
+def warm_up_in_background() -> threading.Thread:
+    thread = threading.Thread(target=warm_up, daemon=True, name="warmup")
+    thread.start()
+    return thread